@@ -11,6 +11,9 @@ from fastapi.middleware.gzip import GZipMiddleware
 from backend.config import CONFIG, override_schema
 CONFIG['importer'] = 'app.py'
 from backend.routes import cset_crud, db, graph
+from backend.db.async_utils import dispose_async_engines
+from backend.db.query_stats import ROUTE
+from backend.db.utils import dispose_engines
 
 # users on the same server
 # APP = FastAPI()
@@ -40,6 +43,23 @@ async def set_schema_globally(request: Request, call_next):
     return response
 
 
+@APP.middleware("http")
+async def set_route_for_query_stats(request: Request, call_next):
+    """Attribute SQL run while handling a request to its route. See backend/db/query_stats.py."""
+    token = ROUTE.set(request.url.path)
+    try:
+        return await call_next(request)
+    finally:
+        ROUTE.reset(token)
+
+
+@APP.on_event("shutdown")
+async def close_db_pools():
+    """Close pooled DB connections"""
+    dispose_engines()
+    await dispose_async_engines()
+
+
 def run(port: int = 8000):
     """Run app"""
     uvicorn.run(APP, host='0.0.0.0', port=port)
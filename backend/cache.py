@@ -0,0 +1,93 @@
+"""In-process result caches"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+MISSING = object()
+
+
+class LruTtlCache:
+    """Thread-safe LRU cache with a time-to-live and a total size budget
+
+    Entries are evicted least-recently-used first once either max_entries or max_bytes is exceeded, and are treated as
+    misses once they are older than ttl_seconds. Values are shared between callers, so they must not be mutated."""
+
+    def __init__(
+        self, max_bytes: int, ttl_seconds: float, max_entries: int = None, sizeof: Callable[[Any], int] = lambda v: 1,
+    ):
+        """Set up cache
+
+        :param sizeof: Estimated size of a value, in bytes, for the max_bytes budget."""
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.sizeof = sizeof
+        self._entries: OrderedDict[Hashable, Tuple[float, int, Any]] = OrderedDict()  # key: (expires at, size, value)
+        self._lock = threading.Lock()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _pop(self, key: Hashable):
+        """Remove entry; caller holds the lock"""
+        _, size, _ = self._entries.pop(key)
+        self.n_bytes -= size
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Value for key, or default if it isn't cached or has expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, value: Any):
+        """Cache value, evicting least-recently-used entries as needed. Values bigger than max_bytes aren't cached."""
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes or (self.max_entries and len(self._entries) > self.max_entries):
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Cached value for key, computing and caching it on a miss"""
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """Drop all entries. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and current usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries), 'bytes': self.n_bytes, 'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None, 'evictions': self.evictions,
+                'expirations': self.expirations}
@@ -24,7 +24,7 @@ PROJECT_ROOT = Path(THIS_DIR).parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 from backend.config import DOCS_DIR
 from backend.db.initialize import SCHEMA
-from backend.db.utils import get_db_connection, insert_from_dict, list_tables, sql_query
+from backend.db.utils import get_db_connection, insert_from_dict, list_tables, sql_query, sql_query_stream
 
 COUNTS_OVER_TIME_OPTIONS = [
     'counts_table',
@@ -87,11 +87,11 @@ def _current_counts_and_deltas(
         sessions: 0.0
     """
     if from_cache:
-        with get_db_connection(schema='', local=local) as con:
-            counts: List[Dict] = [dict(x) for x in sql_query(con, f'SELECT * from counts;', return_with_keys=True)]
-            df = pd.DataFrame(counts)
-            df = df[df['schema'] == schema]
-            return df
+        # Only this schema's counts, a batch at a time, rather than all of them as RowMappings, then dicts, then a df
+        batches = sql_query_stream(
+            'SELECT * FROM counts WHERE schema = :schema;', {'schema': schema}, batches=True, schema='', local=local)
+        dfs: List[pd.DataFrame] = [pd.DataFrame(batch) for batch in batches]
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
     # Get previous counts
     with get_db_connection(schema='', local=local) as con:
         ts_strings: List[List[str]] = sql_query(con, f"SELECT DISTINCT timestamp from counts WHERE schema = '{schema}';", return_with_keys=False)
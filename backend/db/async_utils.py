@@ -0,0 +1,125 @@
+"""Async counterparts of db/utils.py's query helpers, for async routes
+
+Queries run on asyncpg, via SQLAlchemy's asyncio extension, from their own pooled engines. A route awaiting a slow
+query yields to the event loop, so other requests on the worker carry on meanwhile, whereas the sync helpers block it.
+
+asyncpg is stricter about parameter types than psycopg2: e.g. ids compared to an integer column must be ints, not
+strings of digits. Lists bind as arrays, so filter with `= ANY(:ids)`, rather than sql_in().
+"""
+import time
+from threading import Lock
+from typing import Any, Dict, List, Tuple, Union
+
+from sqlalchemy import CursorResult
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.sql import text
+from sqlalchemy.sql.elements import TextClause
+
+from backend.db.config import get_pg_async_connect_url
+from backend.db.query_stats import observe_query
+from backend.db.utils import DB_POOL_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE_SECONDS, DB_POOL_SIZE, \
+    DB_POOL_TIMEOUT_SECONDS, DEBUG, SCHEMA, StatusVarStore, status_vars
+
+_ASYNC_ENGINES: Dict[Tuple[str, str], AsyncEngine] = {}
+_ASYNC_ENGINES_LOCK = Lock()
+
+
+def get_async_engine(schema: str = SCHEMA, local=False) -> AsyncEngine:
+    """Get the process-wide async engine for a database and schema, creating it on first use. Like
+    utils.get_engine(), w/ the same pool settings, but always AUTOCOMMIT.
+
+    :param local: If True, engine is for local instead of production database.
+    """
+    url = get_pg_async_connect_url(local)
+    key = (url, schema)
+    engine = _ASYNC_ENGINES.get(key)
+    if engine is None:
+        with _ASYNC_ENGINES_LOCK:
+            engine = _ASYNC_ENGINES.get(key)
+            if engine is None:
+                # search_path is a server setting of each new connection, so it's set once per pooled connection
+                connect_args = {'server_settings': {'search_path': schema}} if schema else {}
+                engine = _ASYNC_ENGINES[key] = create_async_engine(
+                    url, isolation_level='AUTOCOMMIT', pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT_SECONDS, pool_recycle=DB_POOL_RECYCLE_SECONDS,
+                    pool_pre_ping=DB_POOL_PRE_PING, connect_args=connect_args)
+    return engine
+
+
+async def dispose_async_engines():
+    """Close all pooled async connections and forget the engines, e.g. on app shutdown"""
+    with _ASYNC_ENGINES_LOCK:
+        engines = list(_ASYNC_ENGINES.values())
+        _ASYNC_ENGINES.clear()
+    for engine in engines:
+        await engine.dispose()
+
+
+def get_db_connection_async(schema: str = SCHEMA, local=False) -> AsyncConnection:
+    """Get async DB connection object, from a pool. Use as: `async with get_db_connection_async() as con:`
+
+    :param local: If True, connection is on local instead of production database.
+    """
+    return get_async_engine(schema, local).connect()
+
+
+async def _execute_async(
+    con: AsyncConnection, query: Union[TextClause, str], params: Dict[str, Any] = {}
+) -> CursorResult:
+    """Run a sql command, w/o reporting it to query_stats"""
+    query = text(query) if not isinstance(query, TextClause) else query
+    return await con.execute(query, params) if params else await con.execute(query)
+
+
+async def run_sql_async(
+    con: AsyncConnection, query: Union[TextClause, str], params: Dict[str, Any] = {}
+) -> CursorResult:
+    """Run a sql command"""
+    t0 = time.perf_counter()
+    result: CursorResult = await _execute_async(con, query, params)
+    observe_query(query, params, time.perf_counter() - t0, result.rowcount)
+    return result
+
+
+async def sql_query_async(
+    con: AsyncConnection, query: Union[TextClause, str], params: Dict = {}, debug: bool = DEBUG, return_with_keys=True
+) -> Union[List[RowMapping], List[List[Any]]]:
+    """Run an idempotent (read) SQL query with optional params, fetching records. Async utils.sql_query()."""
+    try:
+        t0 = time.perf_counter()
+        q: CursorResult = await _execute_async(con, query, params)
+        if debug:
+            print(f'{query}\n{params}')
+        if return_with_keys:
+            # noinspection PyTypeChecker
+            results: List[RowMapping] = q.mappings().all()  # Key value pairs
+        else:
+            # noinspection PyTypeChecker
+            results: List[List] = [list(x) for x in q.fetchall()]  # Row tuples, with additional properties
+        observe_query(query, params, time.perf_counter() - t0, results)
+        return results
+    except (ProgrammingError, OperationalError) as err:
+        raise RuntimeError(f'Got an error [{err}] executing the following statement:\n{query}, {params}')
+
+
+async def sql_query_single_col_async(*argv) -> List:
+    """Run SQL query on single column"""
+    results: List = await sql_query_async(*argv, return_with_keys=False)
+    return [r[0] for r in results]
+
+
+async def check_db_status_var_async(key: str, local=False, refresh=False):
+    """Check the value of a given variable the `manage`table. Async utils.check_db_status_var().
+
+    Shares utils.status_vars()'s cache, so it only queries once that's expired, then refreshes it w/ all variables.
+    :param refresh: If True, re-read it, rather than using a value cached up to STATUS_VARS_CACHE_SECONDS ago."""
+    store: StatusVarStore = status_vars(local)
+    values: Union[Dict[str, str], None] = None if refresh else store.cached()
+    if values is None:
+        async with get_db_connection_async(schema='', local=local) as con:
+            rows: List[List] = await sql_query_async(
+                con, 'SELECT key, value FROM public.manage;', return_with_keys=False)
+        values = store.load(rows)
+    return values.get(key)
@@ -18,27 +18,6 @@ def invert_list_dict(d1: Dict[str, List[str]]) -> Dict[str, List[str]]:
     return d2
 
 
-def recursify_key_in_list_dict(d1: Dict[str, List[str]], key: str) -> Dict:
-    """Given a dictionary with keys and values that may or may not be keys in the dictionary, and given a specific key,
-    recursively go through and build a dictionary for that key of all of the recursive key value mappings."""
-    if key in d1:
-        inner_map = {}
-        for value in d1[key]:
-            inner_map[value] = recursify_key_in_list_dict(d1, value)
-        # return {key: inner_map}
-        return inner_map
-    else:
-        return {}
-
-
-def recursify_list_dict(d1: Dict[str, List[str]]) -> Dict[str, Dict]:
-    """Given a dictionary with keys and values that may or may not be keys in the dictionary, recursively go through and
-     build a dictionary of each key as it maps to its values."""
-    d2 = {}
-    for key in d1.keys():
-        d2[key] = recursify_key_in_list_dict(d1, key)
-    return d2
-
 def get_pg_connect_url(local=False):
     """Get URL to connect to the database server"""
     config = CONFIG_LOCAL if local else CONFIG
@@ -47,6 +26,14 @@ def get_pg_connect_url(local=False):
            f'/{config["db"]}'
 
 
+def get_pg_async_connect_url(local=False):
+    """Get URL to connect to the database server, via asyncpg. See db/async_utils.py."""
+    config = CONFIG_LOCAL if local else CONFIG
+    return f'{config["server"]}+asyncpg://' \
+           f'{config["user"]}:{config["pass"]}@{config["host"]}:{config["port"]}' \
+           f'/{config["db"]}'
+
+
 # https://stackoverflow.com/a/49927846/1368860
 # def connect(conn_config_file = 'Commons/config/conn_commons.json'):
 #     with open(conn_config_file) as config_file:
@@ -175,6 +162,3 @@ DERIVED_TABLE_DEPENDENCY_MAP: Dict[str, List[str]] = {
 # the table in the key is updated, the tables in the values under that key also need to be updated. Inversion of
 #  DERIVED_TABLE_DEPENDENCY_MAP. If nothing depends on a table, it  will not appear in the keys.
 DIRECT_DEPENDENT_TABLE_MAP = invert_list_dict(DERIVED_TABLE_DEPENDENCY_MAP)
-# RECURSIVE_DEPENDENT_TABLE_MAP: Hierarchy of each table and all of the tables that depend on it. If nothing depends on
-# a table, it  will not appear in the keys.
-RECURSIVE_DEPENDENT_TABLE_MAP: Dict[str, Dict] = recursify_list_dict(DIRECT_DEPENDENT_TABLE_MAP)
@@ -19,7 +19,8 @@ PROJECT_ROOT = Path(THIS_DIR).parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 from backend.db.config import CONFIG
 from backend.db.load import download_artefacts, make_derived_tables_and_more, initialize_test_schema, seed
-from backend.db.utils import database_exists, run_sql, list_schema_objects, get_db_connection, DB
+from backend.db.utils import database_exists, run_sql, list_schema_objects, get_db_connection, DB, \
+    DDL_MANAGE_UNIQUE_KEY
 
 SCHEMA = CONFIG['schema']
 
@@ -27,7 +28,7 @@ SCHEMA = CONFIG['schema']
 DDL_MANAGE = """
     CREATE TABLE IF NOT EXISTS public.manage (
     key text not null,
-    value text);"""
+    value text);""" + DDL_MANAGE_UNIQUE_KEY
 
 DDL_COUNTS = """
     CREATE TABLE IF NOT EXISTS public.counts (
@@ -112,6 +113,13 @@ def create_database(con: Connection, schema: str):
         run_sql(con, f'CREATE SCHEMA IF NOT EXISTS {schema};')
 
 
+def add_manage_unique_key(local=False):
+    """Add manage.key's unique index to a DB made before DDL_MANAGE had it, ahead of the first status var write, which
+    would otherwise add it. See utils.DDL_MANAGE_UNIQUE_KEY."""
+    with get_db_connection(schema='', local=local) as con:
+        run_sql(con, DDL_MANAGE_UNIQUE_KEY)
+
+
 def _delete_rxnorm_extension_records(con: Connection):
     """Delete all concepts in the RxNorm Extension vocabulary
         This is for issue #514 and
@@ -197,7 +205,14 @@ def cli():
              'as uploading data to the DB.\n'
              'This is useful if expecting errors to happen during table creation / seeding process, and you don\'t want'
              ' to start over from the beginning.')
-    initialize(**vars(parser.parse_args()))
+    parser.add_argument(
+        '-k', '--manage-unique-key', action='store_true', default=False,
+        help='Just add the unique index on public.manage.key, which DBs created before it was added lack until their '
+             'first status var write, and exit.')
+    kwargs = vars(parser.parse_args())
+    if kwargs.pop('manage_unique_key'):
+        return add_manage_unique_key(kwargs['local'])
+    initialize(**kwargs)
 
 
 if __name__ == '__main__':
@@ -6,8 +6,8 @@ from sqlalchemy.engine.base import Connection
 
 from backend.db.config import CONFIG
 from backend.db.utils import get_ddl_statements, check_if_updated, current_datetime, insert_from_dict, \
-    is_table_up_to_date, load_csv, refresh_any_dependent_tables, run_sql, get_db_connection, sql_in, \
-    sql_query, update_db_status_var
+    invalidate_column_types, is_table_up_to_date, load_csv, refresh_any_dependent_tables, run_sql, get_db_connection, \
+    sql_in, sql_query, status_vars, update_db_status_var
 from enclave_wrangler.config import DATASET_REGISTRY
 from enclave_wrangler.datasets import download_datasets
 from enclave_wrangler.objects_api import download_favorite_objects
@@ -160,10 +160,8 @@ def make_derived_tables_and_more(
     if start_step:
         last_successful_step = start_step
     else:
-        with get_db_connection(schema='', local=local) as con2:
-            last_successful_step = run_sql(
-                con2, f"SELECT value FROM public.manage WHERE key = '{last_successful_step_key}';").first()
-        last_successful_step = int(last_successful_step[0]) if last_successful_step else None
+        last_successful_step = status_vars(local).get(last_successful_step_key, refresh=True)
+        last_successful_step = int(last_successful_step) if last_successful_step else None
         print('INFO: Creating derived tables (e.g. `all_csets`) and indexes.')
     if last_successful_step:
         print(f'INFO: Last successful command was {last_successful_step} of {steps}. '
@@ -193,9 +191,9 @@ def make_derived_tables_and_more(
                 raise err
         t1 = datetime.now()
         print(f'  - completed in {(t1 - t0).seconds} seconds')
+    invalidate_column_types(schema_name)
 
-    update_db_status_var(last_successful_step_key, '0', local)
-    update_db_status_var(last_completed_key, str(current_datetime()), local)
+    status_vars(local).set_many({last_successful_step_key: '0', last_completed_key: str(current_datetime())})
 
 
 # todo: this has no usages. it used to be used by initialize(), but no more. remove?
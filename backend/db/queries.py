@@ -3,8 +3,10 @@ from functools import cache
 from typing import List, Dict, Set, Union
 from fastapi import Query
 from sqlalchemy import Connection
+from sqlalchemy.ext.asyncio import AsyncConnection
 
-from backend.db.utils import sql_query, sql_query_single_col, get_db_connection, sql_in
+from backend.db.async_utils import get_db_connection_async, sql_query_async
+from backend.db.utils import sql_query, sql_query_prepared, sql_query_single_col, get_db_connection, sql_in
 
 
 def get_concepts(concept_ids: Union[List[int], Set[int]], con: Connection = None, table:str='concepts_with_counts') -> List:
@@ -13,13 +15,28 @@ def get_concepts(concept_ids: Union[List[int], Set[int]], con: Connection = None
     q = f"""
           SELECT *
           FROM {table}
-          WHERE concept_id {sql_in(concept_ids)};"""
-    rows: List = sql_query(conn, q)
+          WHERE concept_id = ANY(:concept_ids);"""
+    rows: List = sql_query_prepared(conn, q, {'concept_ids': list(concept_ids)})
     if not con:
         conn.close()
     return rows
 
 
+async def get_concepts_async(
+    concept_ids: Union[List[int], Set[int]], con: AsyncConnection = None, table: str = 'concepts_with_counts'
+) -> List:
+    """get_concepts(), without blocking the event loop"""
+    q = f"""
+          SELECT *
+          FROM {table}
+          WHERE concept_id = ANY(:concept_ids);"""
+    params = {'concept_ids': [int(x) for x in concept_ids]}
+    if con:
+        return await sql_query_async(con, q, params)
+    async with get_db_connection_async() as conn:
+        return await sql_query_async(conn, q, params)
+
+
 def get_vocab_of_concepts(id: List[int] = Query(...), con: Connection = None, table:str='concept') -> List:
     """Expecting only one vocab for the list of concepts"""
     conn = con if con else get_db_connection()
@@ -0,0 +1,225 @@
+"""Query instrumentation: timings, row counts & sizes of SQL statements, by statement shape and calling route
+
+run_sql(), sql_query(), sql_query_stream() and their async counterparts report each statement to observe_query(). Every
+statement is timed, which is cheap, and ones slower than SLOW_QUERY_SECONDS are logged. A sample of them,
+QUERY_STATS_SAMPLE_RATE, is also added to rolling, per-minute latency histograms, grouped by fingerprint: the statement
+w/ its literals, e.g. ids, replaced by '?'. Stats are per process; see the /query-stats route.
+"""
+import hashlib
+import logging
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from functools import lru_cache
+from threading import Lock
+from typing import Any, Deque, Dict, List, Sequence, Tuple, Union
+
+QUERY_STATS_SAMPLE_RATE = float(os.getenv('TERMHUB_QUERY_STATS_SAMPLE_RATE', 0.1))
+SLOW_QUERY_SECONDS = float(os.getenv('TERMHUB_SLOW_QUERY_SECONDS', 1))
+# Also write the slow query log to this file, if set. It always goes to the 'backend.db.query_stats' logger.
+SLOW_QUERY_LOG_PATH = os.getenv('TERMHUB_SLOW_QUERY_LOG_PATH')
+QUERY_STATS_WINDOW_MINUTES = int(os.getenv('TERMHUB_QUERY_STATS_WINDOW_MINUTES', 60))
+# Serve the /query-stats routes. Off by default: they show what the app queries, and can reset the stats.
+QUERY_STATS_ROUTES = os.getenv('TERMHUB_QUERY_STATS_ROUTES', 'false').lower() in ('1', 'true', 'yes')
+SLOW_QUERIES_MAX = 200  # most recent slow queries kept in memory
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, float('inf'))
+BYTES_SAMPLE_ROWS = 100  # result size is estimated from this many rows
+QUERY_TEXT_MAX_CHARS = 1000
+FINGERPRINT_CACHE_SIZE = 2048
+FINGERPRINT_CACHE_MAX_CHARS = 4096  # longer statements aren't cached, so the cache stays under ~10MB
+
+# Calling route, set per request by app.py's middleware. Outside requests, e.g. refreshes, it's the script.
+ROUTE: ContextVar[str] = ContextVar('route', default='')
+PROCESS_NAME = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'python'
+
+logger = logging.getLogger(__name__)
+if SLOW_QUERY_LOG_PATH:
+    logger.addHandler(logging.FileHandler(SLOW_QUERY_LOG_PATH))
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_NUMBERED_PARAMS = re.compile(r'(:[A-Za-z_]\w*?)\d+\b')  # e.g. VALUES (:id0, :name0), (:id1, :name1), ...
+_REPEATED_TUPLES = re.compile(r'(\([^()]*\))(?:\s*,\s*\1)+')
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+
+
+def fingerprint(query: str) -> Tuple[str, str]:
+    """Id and normalized text of a statement's shape: comments & literals removed, lists of them collapsed, e.g.
+    `WHERE id IN (1, 2, 3)` and `WHERE id IN (4)` are both `WHERE id IN (?)`. Likewise, VALUES lists of any length
+    w/ numbered params, e.g. from insert_from_dicts(), are `VALUES (:id, :name)`.
+
+    Cached, keyed by the statement, unless it's longer than FINGERPRINT_CACHE_MAX_CHARS. Longer ones, e.g. from
+    sql_in() or insert_from_dicts(), can be megabytes, and rarely repeat exactly."""
+    if len(query) > FINGERPRINT_CACHE_MAX_CHARS:
+        return _fingerprint(query)
+    return _cached_fingerprint(query)
+
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def _cached_fingerprint(query: str) -> Tuple[str, str]:
+    """fingerprint(), cached"""
+    return _fingerprint(query)
+
+
+def _fingerprint(query: str) -> Tuple[str, str]:
+    """See fingerprint()"""
+    normalized = _COMMENTS.sub(' ', query)
+    normalized = _LISTS.sub('(?)', _LITERALS.sub('?', normalized))
+    normalized = _REPEATED_TUPLES.sub(r'\1', _NUMBERED_PARAMS.sub(r'\1', normalized))
+    normalized = ' '.join(normalized.split()).rstrip(';')
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest(), normalized[:QUERY_TEXT_MAX_CHARS]
+
+
+def estimate_bytes(rows: Sequence) -> int:
+    """Rough size of a result, as text: that of its first BYTES_SAMPLE_ROWS rows, scaled up to all of them"""
+    if not rows:
+        return 0
+    sample = rows[:BYTES_SAMPLE_ROWS]
+    sample_bytes = sum(len(str(v)) for row in sample for v in (row.values() if hasattr(row, 'values') else row))
+    return round(sample_bytes * len(rows) / len(sample))
+
+
+class _Aggregate:
+    """Sampled stats of 1 fingerprint in 1 time slot"""
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'rows', 'bytes', 'buckets', 'routes')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.max_seconds = 0.
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.routes = Counter()
+
+    def add(self, seconds: float, n_rows: Union[int, None], n_bytes: Union[int, None], route: str):
+        """Add a sampled call"""
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += max(n_rows or 0, 0)
+        self.bytes += n_bytes or 0
+        ms = seconds * 1000
+        self.buckets[next(i for i, upper in enumerate(LATENCY_BUCKETS_MS) if ms <= upper)] += 1
+        self.routes[route] += 1
+
+    def merge(self, other: '_Aggregate'):
+        """Add another slot's stats to these"""
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+        self.rows += other.rows
+        self.bytes += other.bytes
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.routes.update(other.routes)
+
+    def percentile_ms(self, q: float) -> float:
+        """Upper bound of the latency bucket of the q'th quantile"""
+        target, total = q * self.calls, 0
+        for upper, n in zip(LATENCY_BUCKETS_MS, self.buckets):
+            total += n
+            if total >= target:
+                return upper
+        return LATENCY_BUCKETS_MS[-1]
+
+
+class QueryStats:
+    """Thread-safe rolling stats of sampled statements, in 1-minute slots over the last window_minutes, and a log of
+    the most recent slow ones"""
+
+    def __init__(self, window_minutes: int = QUERY_STATS_WINDOW_MINUTES, sample_rate: float = QUERY_STATS_SAMPLE_RATE):
+        self.window_minutes = window_minutes
+        self.sample_rate = sample_rate
+        self._slots: Deque[Tuple[int, Dict[str, _Aggregate]]] = deque()  # (minute, {fingerprint: stats})
+        self._texts: Dict[str, str] = {}  # fingerprint: normalized statement
+        self.slow_queries: Deque[Dict[str, Any]] = deque(maxlen=SLOW_QUERIES_MAX)
+        self._lock = Lock()
+
+    def add(self, query: str, seconds: float, n_rows: int = None, n_bytes: int = None, route: str = ''):
+        """Add a sampled statement"""
+        fp, normalized = fingerprint(query)
+        minute = int(time.time() // 60)
+        with self._lock:
+            if not self._slots or self._slots[-1][0] != minute:
+                self._slots.append((minute, {}))
+                while self._slots[0][0] <= minute - self.window_minutes:
+                    self._slots.popleft()
+                    self._texts = {fp: self._texts[fp] for _, slot in self._slots for fp in slot}
+            self._texts[fp] = normalized
+            slot: Dict[str, _Aggregate] = self._slots[-1][1]
+            if fp not in slot:
+                slot[fp] = _Aggregate()
+            slot[fp].add(seconds, n_rows, n_bytes, route)
+
+    def add_slow(self, query: str, params: Dict, seconds: float, n_rows: int = None, route: str = ''):
+        """Log a slow statement. Its params, which can hold user data, only go to the log, not slow_queries."""
+        fp, normalized = fingerprint(query)
+        entry = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'seconds': round(seconds, 3), 'rows': n_rows,
+            'route': route, 'fingerprint': fp, 'query': normalized}
+        with self._lock:
+            self.slow_queries.append(entry)
+        logger.warning(
+            f'Slow query ({seconds:.3f}s, {n_rows} rows, {route}): {" ".join(query.split())[:QUERY_TEXT_MAX_CHARS]} '
+            f'{repr(params)[:QUERY_TEXT_MAX_CHARS]}')
+
+    def snapshot(self, top: int = 50, sort_by='total_seconds') -> Dict[str, Any]:
+        """Stats per fingerprint over the window, the top ones by sort_by, w/ calls etc. estimated from the sample"""
+        oldest = int(time.time() // 60) - self.window_minutes
+        merged: Dict[str, _Aggregate] = {}
+        with self._lock:
+            for minute, slot in self._slots:
+                if minute <= oldest:
+                    continue
+                for fp, agg in slot.items():
+                    if fp not in merged:
+                        merged[fp] = _Aggregate()
+                    merged[fp].merge(agg)
+            texts = {fp: self._texts[fp] for fp in merged}
+            slow_queries = list(self.slow_queries)
+        scale = 1 / self.sample_rate if self.sample_rate else 0
+        queries = [{
+            'fingerprint': fp, 'query': texts[fp], 'sampled_calls': agg.calls, 'est_calls': round(agg.calls * scale),
+            'total_seconds': round(agg.seconds * scale, 3), 'mean_ms': round(agg.seconds / agg.calls * 1000, 2),
+            'p50_ms': agg.percentile_ms(.5), 'p95_ms': agg.percentile_ms(.95), 'p99_ms': agg.percentile_ms(.99),
+            'max_ms': round(agg.max_seconds * 1000, 2), 'mean_rows': round(agg.rows / agg.calls, 1),
+            'mean_bytes': round(agg.bytes / agg.calls), 'routes': dict(agg.routes.most_common(5)),
+            'histogram_ms': {str(upper): n for upper, n in zip(LATENCY_BUCKETS_MS, agg.buckets) if n},
+        } for fp, agg in merged.items()]
+        queries.sort(key=lambda x: x[sort_by], reverse=True)
+        return {
+            'window_minutes': self.window_minutes, 'sample_rate': self.sample_rate,
+            'slow_query_seconds': SLOW_QUERY_SECONDS, 'queries': queries[:top], 'slow_queries': slow_queries[::-1]}
+
+    def clear(self):
+        """Drop all stats and slow queries"""
+        with self._lock:
+            self._slots.clear()
+            self._texts.clear()
+            self.slow_queries.clear()
+
+
+QUERY_STATS = QueryStats()
+
+
+def observe_query(query: Any, params: Dict, seconds: float, rows: Union[Sequence, int, None] = None):
+    """Report a statement that took `seconds`
+
+    :param rows: The rows fetched, from which their number and size are taken, or the number of rows, e.g. a
+     CursorResult's rowcount, which is -1 if unknown."""
+    sampled = random.random() < QUERY_STATS.sample_rate
+    slow = seconds >= SLOW_QUERY_SECONDS
+    if not (sampled or slow):
+        return
+    query = str(query)
+    n_rows = rows if isinstance(rows, int) or rows is None else len(rows)
+    route = ROUTE.get() or PROCESS_NAME
+    if sampled:
+        n_bytes = None if isinstance(rows, int) or rows is None else estimate_bytes(rows)
+        QUERY_STATS.add(query, seconds, n_rows, n_bytes, route)
+    if slow:
+        QUERY_STATS.add_slow(query, params, seconds, n_rows, route)
@@ -18,7 +18,8 @@ from backend.db.config import CONFIG
 from backend.db.resolve_fetch_failures_0_members import resolve_failures_0_members_if_exist, \
     resolve_failures_excess_items_if_exist
 from backend.db.utils import current_datetime, get_db_connection, is_refresh_active, last_refresh_timestamp, \
-    reset_temp_refresh_tables, tz_datetime_str, update_db_status_var, check_db_status_var, delete_db_status_var
+    reset_temp_refresh_tables, status_vars, tz_datetime_str, update_db_status_var, check_db_status_var, \
+    delete_db_status_var
 from enclave_wrangler.objects_api import csets_and_members_enclave_to_db
 
 DESC = 'Refresh TermHub database w/ newest updates from the Enclave using the objects API.'
@@ -91,7 +92,6 @@ def refresh_db(
     todo: resolve_fetch_failures_excess_items currently set to False until the following issues are addressed:
      - https://github.com/jhu-bids/TermHub/issues/499
      - https://github.com/jhu-bids/TermHub/issues/518
-    todo: Can update update_db_status_var() so that it can accept optional param 'con' to improve performance.
     todo: refactor `new_request_while_refreshing` usage for brevity in code and DB: Rather than checking a variable
      new_request_while_refreshing , at the end of the refresh, if the last_refresh_request has changed / is newer than
      what was set at the beginning of the script, it knows that a new request while refreshing has occurred, and use
@@ -117,8 +117,7 @@ def refresh_db(
         # todo: consider running trigger_resolve_failure(), but maybe not necessary.
         # trigger_resolve_failures(resolve_fetch_failures_excess_items, resolve_fetch_failures_0_members, local)
         return
-    update_db_status_var('refresh_status', 'active', local)
-    update_db_status_var('last_refresh_request', start_time, local)
+    status_vars(local).set_many({'refresh_status': 'active', 'last_refresh_request': start_time})
 
     try:
         with get_db_connection(local=local) as con:
@@ -128,11 +127,10 @@ def refresh_db(
             # - csets_and_members_enclave_to_db(): Runs the refresh
             new_data: bool = csets_and_members_enclave_to_db(con, since, cset_ids, schema)
             if new_data:
-                update_db_status_var('last_refresh_success', end_time_reported, local)
-                update_db_status_var('last_refresh_result', 'success', local)
+                status_vars(local).set_many(
+                    {'last_refresh_success': end_time_reported, 'last_refresh_result': 'success'})
     except Exception as err:
-        update_db_status_var('last_refresh_result', 'error', local)
-        update_db_status_var('last_refresh_error_message', str(err), local)
+        status_vars(local).set_many({'last_refresh_result': 'error', 'last_refresh_error_message': str(err)})
         reset_temp_refresh_tables(schema)
         print(f"Database refresh incomplete; exception occurred.", file=sys.stderr)
         counts_update('DB refresh error.', schema, local, filter_temp_refresh_tables=True)
@@ -141,8 +139,7 @@ def refresh_db(
         raise err
     finally:
         # Update status vars
-        update_db_status_var('last_refresh_exited', current_datetime(), local)
-        update_db_status_var('refresh_status', 'inactive', local)
+        status_vars(local).set_many({'last_refresh_exited': current_datetime(), 'refresh_status': 'inactive'})
         trigger_resolve_failures(resolve_fetch_failures_excess_items, resolve_fetch_failures_0_members, local)
 
     if new_data:
@@ -154,7 +151,7 @@ def refresh_db(
     else:
         print('INFO: No new data was found in the Enclave. Exiting.')
 
-    if check_db_status_var('new_request_while_refreshing'):
+    if check_db_status_var('new_request_while_refreshing', refresh=True):
         print('INFO: New refresh request detected while refresh was running. Starting a new refresh.')
         delete_db_status_var('new_request_while_refreshing')
         refresh_db(None, None, use_local_db, schema, force_non_contiguity)
@@ -45,7 +45,7 @@ def load_dataset_group(dataset_group_name: str, schema: str = SCHEMA, alternate_
                 load_csv(
                     con, table, replace_rule='do not replace', schema=schema, optional_suffix='_new',
                     path_override=Path(alternate_dataset_dir) / f'{table}.csv' if alternate_dataset_dir else None,
-                    is_test_table=bool(alternate_dataset_dir))
+                    is_test_table=bool(alternate_dataset_dir), unlogged=True)
                 run_sql(con, f'ALTER TABLE IF EXISTS {schema}.{table} RENAME TO {table}_old;')
                 run_sql(con, f'ALTER TABLE {schema}.{table}_new RENAME TO {table};')
 
@@ -20,7 +20,8 @@ PROJECT_ROOT = os.path.join(BACKEND_DIR, '..')
 sys.path.insert(0, str(PROJECT_ROOT))
 from backend.db.config import CONFIG
 from backend.db.load import load, make_derived_tables_and_more
-from backend.db.utils import check_if_updated, current_datetime, get_db_connection, run_sql, update_db_status_var
+from backend.db.utils import check_if_updated, current_datetime, get_db_connection, invalidate_column_types, run_sql, \
+    update_db_status_var
 from enclave_wrangler.datasets import download_datasets
 from enclave_wrangler.objects_api import download_favorite_objects
 
@@ -74,6 +75,7 @@ def reset_and_update_db(
     with get_db_connection(schema=schema_new_temp, local=local) as con:
         run_sql(con, f'ALTER SCHEMA {schema} RENAME TO {schema_old_backup};')
         run_sql(con, f'ALTER SCHEMA {schema_new_temp} RENAME TO {schema};')
+        invalidate_column_types()
         update_db_status_var(last_updated_db_key, str(current_datetime()), local)
     counts_update('DB reset and update.', schema, local)
     print('INFO: Database reset complete.')
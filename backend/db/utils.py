@@ -5,11 +5,18 @@ todo's
   2. Making 'Connection' optional: Can write a wrapper function and decorate all functions that need, where all it does
   is `conn = con if con else get_db_connection()`, run the inner function, and then close conn if not con.
 """
+import csv
+import hashlib
+import io
+import itertools
 import json
 import os
 import sys
 import time
 from argparse import ArgumentParser
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from pathlib import Path
 from random import randint
 
@@ -18,27 +25,34 @@ import dateutil.parser as dp
 from datetime import datetime, timedelta, timezone
 from glob import glob
 import re
+from threading import Lock, RLock, local as thread_local
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 from jinja2 import Template
 # noinspection PyUnresolvedReferences
 from psycopg2.errors import UndefinedTable
 from sqlalchemy import create_engine, event, CursorResult
-from sqlalchemy.engine import Row, RowMapping
+from sqlalchemy.engine import Engine, Row, RowMapping
 from sqlalchemy.engine.base import Connection
-from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.exc import NotSupportedError, OperationalError, ProgrammingError
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import text
 from sqlalchemy.sql.elements import TextClause
-from typing import Any, Dict, Set, Tuple, Union, List
+from typing import Any, Dict, Iterable, Iterator, Set, Tuple, Union, List
 
 
 DB_DIR = os.path.dirname(os.path.realpath(__file__))
 PROJECT_ROOT = Path(DB_DIR).parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
-from backend.db.config import CORE_CSET_TABLES, PG_DATATYPES_BY_GROUP, RECURSIVE_DEPENDENT_TABLE_MAP, \
-    REFRESH_JOB_MAX_HRS, get_pg_connect_url
+from backend.db.config import CORE_CSET_TABLES, DERIVED_TABLE_DEPENDENCY_MAP, PG_DATATYPES_BY_GROUP, \
+    REFRESH_JOB_MAX_HRS, get_pg_connect_url, invert_list_dict
 from backend.config import CONFIG, DATASETS_PATH, OBJECTS_PATH
+from backend.db.query_stats import observe_query
 from backend.utils import commify
+from enclave_wrangler.config import DATASET_REGISTRY
 from enclave_wrangler.models import pkey
 
 
@@ -47,6 +61,37 @@ TIMEZONE_DEFAULT = ['UTC/GMT', 'EST/EDT'][1]
 DEBUG = False
 DB = CONFIG["db"]
 SCHEMA = CONFIG["schema"]
+# Connection pool, per engine. See get_engine().
+DB_POOL_SIZE = int(os.getenv('TERMHUB_DB_POOL_SIZE', 5))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('TERMHUB_DB_POOL_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT_SECONDS = int(os.getenv('TERMHUB_DB_POOL_TIMEOUT_SECONDS', 30))
+# Recycle before kill_idle_cons() would terminate a connection sitting idle in the pool; pre-ping catches the rest
+DB_POOL_RECYCLE_SECONDS = int(os.getenv('TERMHUB_DB_POOL_RECYCLE_SECONDS', 300))
+DB_POOL_PRE_PING = os.getenv('TERMHUB_DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# Derived tables rebuilt at once by refresh_derived_tables_exec(), each on its own pooled connection
+DERIVED_REFRESH_WORKERS = int(os.getenv('TERMHUB_DERIVED_REFRESH_WORKERS', 4))
+# Server-side prepared statements kept per pooled connection, by sql_query_prepared()
+PREPARED_STATEMENTS_MAX = 100
+# Bulk loads, see copy_load(): rows per chunk when rewriting or inferring types, and bytes per read while streaming
+COPY_CHUNK_ROWS = 100_000
+COPY_READ_BYTES = 1024 ** 2
+# Rows per COPY + INSERT round trip in bulk_insert_from_dicts()
+BULK_INSERT_CHUNK_ROWS = 50_000
+# Rows per fetch from a server-side cursor: See sql_query_stream()
+SQL_STREAM_FETCH_SIZE = int(os.getenv('TERMHUB_SQL_STREAM_FETCH_SIZE', 10_000))
+# How long status vars read from public.manage are reused in process: See StatusVarStore
+STATUS_VARS_CACHE_SECONDS = float(os.getenv('TERMHUB_STATUS_VARS_CACHE_SECONDS', 5))
+# Postgres types for pandas dtype kinds, as DataFrame.to_sql() creates them
+PANDAS_PG_TYPES = {'i': 'BIGINT', 'u': 'BIGINT', 'f': 'DOUBLE PRECISION', 'b': 'BOOLEAN', 'M': 'TIMESTAMP', 'O': 'TEXT'}
+# CSV values pd.read_csv() reads as NA, by default, quoted or not: DataFrame.to_sql() loaded them as NULL
+PANDAS_NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA',
+    'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'])
+_ENGINES: Dict[Tuple[str, str, str], Engine] = {}
+_ENGINES_LOCK = Lock()
+# {schema: {table: {column: (data_type, udt_name)}}}: See column_type_catalog()
+_COLUMN_TYPES: Dict[str, Dict[str, Dict[str, Tuple[str, str]]]] = {}
+_COLUMN_TYPES_LOCK = Lock()
 
 
 def dedupe_dicts(list_of_dicts: List[Dict]) -> List[Dict]:
@@ -55,21 +100,55 @@ def dedupe_dicts(list_of_dicts: List[Dict]) -> List[Dict]:
     return list(map(dict, set(tuple(sorted(d.items())) for d in list_of_dicts)))
 
 
-def extract_keys_from_nested_dict(d: Dict[str, Dict]) -> List[str]:
-    """Extract keys from a nested dictionary.
+def derived_tables_dag(
+    independent_tables: Union[List[str], str], dependency_map: Dict[str, List[str]] = DERIVED_TABLE_DEPENDENCY_MAP
+) -> Dict[str, Set[str]]:
+    """Dependency graph of all derived tables that depend, directly or not, on independent_tables
 
-    :return An ordered list in which the keys appear in the dictionary, walking
-    through from top to bottom. If a key appears in the list multiple times, it
-    will only appear once in the list, in the order in which it first appeared."""
-    ordered_unique_keys = []
-    def _extract_keys(d2):
-        for k, v in d2.items():
-            if k not in ordered_unique_keys:
-                ordered_unique_keys.append(k)
-            if isinstance(v, dict):
-                _extract_keys(v)
-    _extract_keys(d)
-    return ordered_unique_keys
+    :return: {table: the tables in the graph it's derived from}. Tables outside the graph, e.g. independent_tables, are
+     left out, as they're not being refreshed."""
+    independent_tables: List[str] = [independent_tables] if isinstance(independent_tables, str) else independent_tables
+    dependents: Dict[str, List[str]] = invert_list_dict(dependency_map)
+    tables: Set[str] = set()
+    to_visit: List[str] = list(independent_tables)
+    while to_visit:
+        for table in dependents.get(to_visit.pop(), []):
+            if table not in tables:
+                tables.add(table)
+                to_visit.append(table)
+    return {table: set(dependency_map[table]) & tables for table in tables}
+
+
+def topological_generations(dag: Dict[str, Set[str]]) -> List[List[str]]:
+    """Order a dependency graph w/ Kahn's algorithm, in generations, each depending only on the ones before it
+
+    :param dag: {node: the nodes it depends on}. Dependencies that aren't keys are ignored.
+    :raises ValueError: If there's a dependency cycle."""
+    n_dependencies: Dict[str, int] = {}
+    dependents: Dict[str, List[str]] = {node: [] for node in dag}
+    for node, dependencies in dag.items():
+        dependencies = [x for x in dependencies if x in dag]
+        n_dependencies[node] = len(dependencies)
+        for dependency in dependencies:
+            dependents[dependency].append(node)
+
+    generations: List[List[str]] = []
+    generation: List[str] = sorted(node for node, n in n_dependencies.items() if not n)
+    while generation:
+        generations.append(generation)
+        next_generation: List[str] = []
+        for node in generation:
+            for dependent in dependents[node]:
+                n_dependencies[dependent] -= 1
+                if not n_dependencies[dependent]:
+                    next_generation.append(dependent)
+        generation = sorted(next_generation)
+
+    # Nodes in a cycle, or depending on one, never get to 0 dependencies left
+    unordered: List[str] = sorted(node for node, n in n_dependencies.items() if n)
+    if unordered:
+        raise ValueError(f'Dependency cycle; can\'t order: {", ".join(unordered)}')
+    return generations
 
 
 def get_dependent_tables_queue(independent_tables: Union[List[str], str], _filter: str = None) -> List[str]:
@@ -80,72 +159,24 @@ def get_dependent_tables_queue(independent_tables: Union[List[str], str], _filte
     which derived tables need to be updated in the correct order.
     :param _filter: One of 'table' or 'views'.
     :return: A list in the correct order such that for every entry in the list, any tables that depend on that entry
-    will appear further down in the list.
-
-    TODO: Replace heuristic w/ a correct algorithm.
-     I originally had no steps 2&3, and only 1&4 combined. But the result was out of order. This algorithm below is
-     based on a quick (but messy/long) heuristic. Basically, the longer dependency trees go first. This corrected the
-     problem that I had. But this is just a heuristic. I feel confident that there is some correct algorithm for this
-     solvable in polynomial time.
-     2024/11/09: Determined that this often returns incorrect result. Non-deterministic. For now, have a patch if
-     independent_tables == CORE_CSET_TABLES.
-     - DDL: For now: I have a fix at the bottom, where we go by the order of the DDL. However if the DDL order ever
-     becomes incorrect, this will break.
+    will appear further down in the list. Tables in the same generation of topological_generations() don't depend on
+    each other; they're in DDL order, so that the queue is deterministic.
     """
     if _filter not in [None, 'tables', 'views']:
         raise ValueError(f'Invalid _filter value: {_filter}. Must be one of "tables" or "views".')
 
-    queue: List[str] = []
-    pre_queue1: List[List[str]] = []
-    pre_queue2: List[List[str]] = []
-    queues_by_len: Dict[int, List[List[str]]] = {}
-    independent_tables: List[str] = [independent_tables] if isinstance(independent_tables, str) else independent_tables
+    dag: Dict[str, Set[str]] = derived_tables_dag(independent_tables)
+    queue: List[str] = [
+        table for generation in topological_generations(dag) for table in order_modules_by_ddl_order(generation)]
 
-    # 1 & 4: Get a queue of dependent tables
-    # 1. Build up a list of queues; queue is dependent tables
-    for table in independent_tables:
-        dependent_tree: Dict = RECURSIVE_DEPENDENT_TABLE_MAP.get(table, {})
-        if not dependent_tree:
-            continue
-        q: List[str] = extract_keys_from_nested_dict(dependent_tree)
-        pre_queue1.append(q)
-
-    # 2-3: Heuristic: Reorder the queue
-    # 2. Group by queue lengths
-    # - some dependency trees are the same for multiple tables; dedupe for simplicity
-    pre_queue1 = [list(x) for x in set([tuple(x) for x in pre_queue1])]
-    for q in pre_queue1:
-        l = len(q)
-        if l not in queues_by_len:
-            queues_by_len[l] = []
-        queues_by_len[l].append(q)
-
-    # 3. Reorganize list of queues, sorted by longest queues first
-    queue_len_keys = list(queues_by_len.keys())
-    queue_len_keys.sort(reverse=True)
-    for k in queue_len_keys:
-        queues: List[List[str]] = queues_by_len[k]
-        for q in queues:
-            pre_queue2.append(q)
-
-    # 4. Flatten to single list queue of dependent tables
-    for q in pre_queue2:
-        for i in q:
-            if i not in queue:
-                queue.append(i)
-
-    # 5. Optional: Filtering
+    # Optional: Filtering
     if _filter:
         views: List[str] = [x for x in list_views() if x in queue]
         if _filter == 'views':
             return views
         elif _filter == 'tables':
             return [x for x in queue if x not in views]
-
-    # todo - temporary fix: see "DDL" comment in docstring
-    ddl_order_based_queue: List[str] = order_modules_by_ddl_order(queue)
-
-    return ddl_order_based_queue
+    return queue
 
 
 def refresh_any_dependent_tables(con: Connection, independent_tables: List[str] = CORE_CSET_TABLES, schema=SCHEMA):
@@ -160,42 +191,100 @@ def refresh_any_dependent_tables(con: Connection, independent_tables: List[str]
     refresh_derived_tables_exec(con, derived_tables, schema)
 
 
+def _refresh_derived_module(
+    con: Connection, module: str, schema=SCHEMA, table_or_view='table', temp_table_suffix='_new'
+):
+    """Create a derived table/view w/ temp_table_suffix, then swap it in, backing up the current one as {module}_old"""
+    t0 = datetime.now()
+    print(f' - creating new {table_or_view}: {module}...')
+    statements: List[str] = get_ddl_statements(schema, module, temp_table_suffix, 'flat')
+    for statement in statements:
+        try:
+            run_sql(con, statement)
+        except ProgrammingError as err:
+            # Context: https://github.com/jhu-bids/TermHub/issues/792
+            if schema == 'test_n3c' and 'does not exist for access method' in str(err):
+                print('Warning: A known error occurred while trying to create an extension-based index in the test'
+                      ' schema. For now, we\'re skipping creation of this index here as is not necessary for '
+                      'testing.', file=sys.stderr)
+                continue
+            raise err
+    # todo: warn if counts in _new table not >= _old table (if it exists)?
+    run_sql(con, f'ALTER TABLE IF EXISTS {schema}.{module} RENAME TO {module}_old;')
+    run_sql(con, f'ALTER TABLE {schema}.{module}{temp_table_suffix} RENAME TO {module};')
+    print(f'   - {module} completed in {(datetime.now() - t0).seconds} seconds')
+
+
+def _refresh_derived_modules_concurrently(
+    engine: Engine, dag: Dict[str, Set[str]], schema=SCHEMA, views: List[str] = [], workers=DERIVED_REFRESH_WORKERS
+):
+    """Refresh each module of a dependency graph once all it depends on are, up to `workers` at a time, each on its own
+    pooled connection from engine.
+
+    On failure, modules queued but not yet started are cancelled, and no more are queued. Modules already running
+    can't be interrupted mid-statement, so they finish, and swap in their new table or view. The refresh is then
+    partial: modules that finished before or alongside the failure are new, the rest, including all that depend on the
+    failed one, are as they were. Re-running the refresh rebuilds them all."""
+    topological_generations(dag)  # fail on cycles before changing anything
+    waiting_on: Dict[str, Set[str]] = {module: set(dependencies) for module, dependencies in dag.items()}
+
+    def refresh(module: str) -> str:
+        """Refresh 1 module on its own connection"""
+        with engine.connect() as con:
+            _refresh_derived_module(con, module, schema, 'view' if module in views else 'table')
+        return module
+
+    error: Union[BaseException, None] = None
+    running: Set[Future] = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derived-refresh') as executor:
+        while running or (waiting_on and not error):
+            ready: List[str] = [module for module, dependencies in waiting_on.items() if not dependencies]
+            for module in order_modules_by_ddl_order(ready) if ready and not error else []:
+                del waiting_on[module]
+                running.add(executor.submit(refresh, module))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                if future.exception():
+                    error = error or future.exception()
+                    for pending in running:
+                        pending.cancel()
+                    continue
+                for dependencies in waiting_on.values():
+                    dependencies.discard(future.result())
+    if error:
+        raise error
+
+
 def refresh_derived_tables_exec(
-    con: Connection, derived_tables_queue: List[str], schema=SCHEMA
+    con: Connection, derived_tables_queue: List[str], schema=SCHEMA, workers: int = DERIVED_REFRESH_WORKERS
 ):
     """Refresh TermHub core cset derived tables
 
     This can also work to initially create the tables if they don't already exist.
 
+    Each module is rebuilt as {module}_new, then swapped in, once the modules in the queue it's derived from (per
+    DERIVED_TABLE_DEPENDENCY_MAP) are. Modules that don't depend on each other are rebuilt concurrently.
+
     :param derived_tables_queue: Should be ordered such that for every entry in the list, any tables that depend on that
-     entry will appear further down in the list."""
-    temp_table_suffix = '_new'
-    ddl_modules_queue = derived_tables_queue
+     entry will appear further down in the list.
+    :param workers: Max modules rebuilt at once, each on its own connection from con's pool. If 1, they're rebuilt in
+     queue order on con."""
+    ddl_modules_queue = list(derived_tables_queue)
     views = [x for x in list_views(schema=schema) if x in ddl_modules_queue]
 
     # Create new tables/views and backup old ones
     print('Derived tables')
     t0 = datetime.now()
-    for module in ddl_modules_queue:
-        t0_2 = datetime.now()
-        table_or_view = 'view' if module in views else 'table'
-        print(f' - creating new {table_or_view}: {module}...')
-        statements: List[str] = get_ddl_statements(schema, module, temp_table_suffix, 'flat')
-        for statement in statements:
-            try:
-                run_sql(con, statement)
-            except ProgrammingError as err:
-                # Context: https://github.com/jhu-bids/TermHub/issues/792
-                if schema == 'test_n3c' and 'does not exist for access method' in str(err):
-                    print('Warning: A known error occurred while trying to create an extension-based index in the test'
-                          ' schema. For now, we\'re skipping creation of this index here as is not necessary for '
-                          'testing.', file=sys.stderr)
-                    continue
-                raise err
-        # todo: warn if counts in _new table not >= _old table (if it exists)?
-        run_sql(con, f'ALTER TABLE IF EXISTS {schema}.{module} RENAME TO {module}_old;')
-        run_sql(con, f'ALTER TABLE {schema}.{module}{temp_table_suffix} RENAME TO {module};')
-        print(f'   - completed in {(datetime.now() - t0_2).seconds} seconds')
+    if workers <= 1:
+        for module in ddl_modules_queue:
+            _refresh_derived_module(con, module, schema, 'view' if module in views else 'table')
+    else:
+        dag: Dict[str, Set[str]] = {
+            module: set(DERIVED_TABLE_DEPENDENCY_MAP.get(module, [])) & set(ddl_modules_queue)
+            for module in ddl_modules_queue}
+        _refresh_derived_modules_concurrently(con.engine, dag, schema, views, workers)
 
     # Delete old tables/views. Because of view dependencies, order & commands are different
     print(f' - Removing older, temporarily backed up tables/views...')
@@ -205,6 +294,7 @@ def refresh_derived_tables_exec(
 
     for module in ddl_modules_queue:
         run_sql(con, f'DROP TABLE IF EXISTS {schema}.{module}_old;')
+    invalidate_column_types(schema)
     t1 = datetime.now()
     print(f' - completed in {(t1 - t0).seconds} seconds')
 
@@ -248,55 +338,17 @@ def refresh_derived_tables(
             break
 
 
-# todo: Any use to having this? If not, remove. Otherwise, needs fixing. It was working when in get_db_connection() we
-#  were not passing schema... but that's not really working. We need to be able to control the schema. After changing to
-#  pass schema, sometimes it worked, and sometimes we got err: AttributeError: 'dict' object has no attribute 'cursor',
-#  indicating that the kwargs weren't getting passed appropriately.
-# from functools import partial
-# from sqlalchemy.pool import QueuePool
-# def set_search_path(dbapi_connection, schema=SCHEMA, connection_record=None):
-#     """Set the search_path when connecting.
-#
-#     Source: https://chat.openai.com/share/0472ba44-0e58-44ad-bbcb-5eabffae3d39
-#
-#     Note: This hasn't helped w/ a problem we were having. If it continues to not help, we could rever to the old
-#     version of get_db_connection().
-#     """
-#     cursor = dbapi_connection.cursor()
-#     cursor.execute(f"SET SESSION search_path='{schema}'")
-#     cursor.close()
-#
-#
-# def get_db_connection(isolation_level='AUTOCOMMIT', schema: str = SCHEMA, local=False) -> Connection:
-#     """Get database connection object
-#
-#     :param local: If True, connection is on local instead of production database.
-#     """
-#     if schema == None:
-#         raise ValueError('Must pass schema to get_db_connection()')
-#     engine = create_engine(
-#         get_pg_connect_url(local),
-#         poolclass=QueuePool,
-#         isolation_level=isolation_level,
-#     )
-#     # event.listen(engine, "connect", set_search_path)
-#     event.listen(engine, "connect", partial(set_search_path, {'schema': schema}))
-#     return engine.connect()
-
-
-# todo: make 'isolation_level' the final param, since we never override it. this would it so we dont' have to pass the
-#  other params as named params.
-def get_db_connection(isolation_level='AUTOCOMMIT', schema: str = SCHEMA, local=False) -> Connection:
-    """Get DB connection object.
-
-    :param local: If True, connection is on local instead of production database.
-    """
-    engine = create_engine(get_pg_connect_url(local), isolation_level=isolation_level)
+def _create_engine(url: str, isolation_level: str, schema: str) -> Engine:
+    """Create a pooled engine. Every connection the pool opens gets its search_path set to schema, once."""
+    engine = create_engine(
+        url, isolation_level=isolation_level, poolclass=QueuePool, pool_size=DB_POOL_SIZE,
+        max_overflow=DB_POOL_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS, pool_pre_ping=DB_POOL_PRE_PING)
 
     # noinspection PyUnusedLocal
     @event.listens_for(engine, "connect", insert=True)
     def set_search_path(dbapi_connection, connection_record):
-        """This does "set search_path to n3c;" when you connect.
+        """This does "set search_path to n3c;" when the pool opens a new connection.
         https://docs.sqlalchemy.org/en/14/dialects/postgresql.html#setting-alternate-search-paths-on-connect
         :param connection_record: Part of the example but we're not using yet.
 
@@ -312,7 +364,42 @@ def get_db_connection(isolation_level='AUTOCOMMIT', schema: str = SCHEMA, local=
         cursor.close()
         dbapi_connection.autocommit = existing_autocommit
 
-    return engine.connect()
+    return engine
+
+
+def get_engine(isolation_level='AUTOCOMMIT', schema: str = SCHEMA, local=False) -> Engine:
+    """Get the process-wide pooled engine for a database, schema and isolation level, creating it on first use.
+
+    Connections from the same engine share a search_path, so engines are keyed by schema as well as URL.
+    :param local: If True, engine is for local instead of production database.
+    """
+    url = get_pg_connect_url(local)
+    key = (url, schema, isolation_level)
+    engine = _ENGINES.get(key)
+    if engine is None:
+        with _ENGINES_LOCK:
+            engine = _ENGINES.get(key)
+            if engine is None:
+                engine = _ENGINES[key] = _create_engine(url, isolation_level, schema)
+    return engine
+
+
+def dispose_engines():
+    """Close all pooled connections and forget the engines, e.g. in a forked child process, or before exiting"""
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+
+
+# todo: make 'isolation_level' the final param, since we never override it. this would it so we dont' have to pass the
+#  other params as named params.
+def get_db_connection(isolation_level='AUTOCOMMIT', schema: str = SCHEMA, local=False) -> Connection:
+    """Get DB connection object, checked out from a pool. Closing it returns it to the pool.
+
+    :param local: If True, connection is on local instead of production database.
+    """
+    return get_engine(isolation_level, schema, local).connect()
 
 
 def chunk_list(input_list: List, chunk_size) -> List[List]:
@@ -337,26 +424,168 @@ def current_datetime(time_zone=TIMEZONE_DEFAULT) -> str:
     return tz_datetime_str(datetime.now(), time_zone=time_zone)
 
 
-# todo: Can update update_db_status_var() so that it can accept optional param 'con' to improve performance.
+# manage.key's unique index, needed by StatusVarStore's upserts. A DB made before DDL_MANAGE had it gets it on its first
+#  status var write; see StatusVarStore._ensure_unique_key(). Any duplicate keys are dropped first, keeping the row of
+#  each w/ the greatest ctid, i.e. the last one written, barring a VACUUM FULL since. The lock makes concurrent runs wait
+#  on each other, rather than both building the index.
+DDL_MANAGE_UNIQUE_KEY = """
+    BEGIN;
+    LOCK TABLE public.manage IN SHARE ROW EXCLUSIVE MODE;
+    DELETE FROM public.manage a USING public.manage b WHERE a.key = b.key AND a.ctid < b.ctid;
+    CREATE UNIQUE INDEX IF NOT EXISTS manage_key_idx ON public.manage (key);
+    COMMIT;"""
+
+
+class StatusVarStore:
+    """Status variables in the public.manage table, e.g. when a table was last updated, or refresh bookkeeping
+
+    Reads fetch all keys in 1 query, reused in process for cache_seconds, so several lookups cost 1 query. Writes are 1
+    upsert, however many keys, and writes in a batch() are sent together at its end. This process's writes update the
+    cache right away; other processes' are seen once it expires, or when reading w/ refresh=True."""
+
+    def __init__(self, local=False, cache_seconds: float = STATUS_VARS_CACHE_SECONDS):
+        """Set up store
+
+        :param local: If True, variables are on local instead of production database."""
+        self.local = local
+        self.cache_seconds = cache_seconds
+        self._values: Dict[str, str] = {}
+        self._expires_at = 0.
+        self._lock = RLock()
+        self._thread = thread_local()  # batch() writes pending in this thread
+        self._has_unique_key = False
+
+    def _pending(self) -> Union[Dict[str, str], None]:
+        """Writes waiting for the end of this thread's batch(), if in one"""
+        return getattr(self._thread, 'pending', None)
+
+    def all(self, refresh=False) -> Dict[str, str]:
+        """All variables, as {key: value}
+
+        :param refresh: If True, re-read them, even if cached values haven't expired yet."""
+        with self._lock:
+            if refresh or time.monotonic() >= self._expires_at:
+                with get_db_connection(schema='', local=self.local) as con:
+                    rows: List[List] = sql_query(con, 'SELECT key, value FROM public.manage;', return_with_keys=False)
+                return self.load(rows)
+            values = dict(self._values)
+        return values | (self._pending() or {})
+
+    def cached(self) -> Union[Dict[str, str], None]:
+        """All variables, as {key: value}, if the cached values haven't expired, else None. Doesn't query."""
+        with self._lock:
+            if time.monotonic() >= self._expires_at:
+                return None
+            values = dict(self._values)
+        return values | (self._pending() or {})
+
+    def load(self, rows: Iterable[Iterable[str]]) -> Dict[str, str]:
+        """Cache all variables, as (key, value) rows of public.manage read elsewhere, e.g. by an async query
+
+        :return: The variables, as all() would."""
+        with self._lock:
+            self._values = {key: value for key, value in rows}
+            self._expires_at = time.monotonic() + self.cache_seconds
+            values = dict(self._values)
+        return values | (self._pending() or {})
+
+    def get(self, key: str, refresh=False) -> Union[str, None]:
+        """Value of a variable, or None if not set"""
+        return self.all(refresh).get(key)
+
+    def set(self, key: str, val: str):
+        """Set a variable"""
+        self.set_many({key: val})
+
+    def set_many(self, values: Dict[str, str]):
+        """Set variables, in 1 upsert. In a batch(), they're written at its end."""
+        values = {key: None if val is None else str(val) for key, val in values.items()}
+        pending = self._pending()
+        if pending is not None:
+            pending.update(values)
+        elif values:
+            self._write(values)
+
+    def _ensure_unique_key(self, con: Connection):
+        """Add manage.key's unique index, which _write()'s ON CONFLICT needs, if it's missing. Checked once per store."""
+        if self._has_unique_key:
+            return
+        indexed: List[List] = sql_query(con, """
+            SELECT 1
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+            WHERE i.indrelid = 'public.manage'::regclass AND i.indisunique AND i.indnatts = 1 AND a.attname = 'key';""",
+            return_with_keys=False)
+        if not indexed:
+            run_sql(con, DDL_MANAGE_UNIQUE_KEY)
+        self._has_unique_key = True
+
+    def _write(self, values: Dict[str, str]):
+        """Upsert variables"""
+        with get_db_connection(schema='', local=self.local) as con:
+            self._ensure_unique_key(con)
+            run_sql(con, """
+                INSERT INTO public.manage (key, value)
+                SELECT * FROM unnest(CAST(:keys AS text[]), CAST(:vals AS text[]))
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;""",
+                {'keys': pg_array_literal(list(values.keys())), 'vals': pg_array_literal(list(values.values()))})
+        with self._lock:
+            self._values.update(values)
+
+    def delete(self, key: str):
+        """Delete a variable"""
+        pending = self._pending()
+        if pending:
+            pending.pop(key, None)
+        with get_db_connection(schema='', local=self.local) as con:
+            run_sql(con, 'DELETE FROM public.manage WHERE key = :key;', {'key': key})
+        with self._lock:
+            self._values.pop(key, None)
+
+    @contextmanager
+    def batch(self):
+        """Write all variables set in this block at its end, in 1 upsert, even if it raises. Nested batches are part of
+        the outermost one. Use as: `with status_vars().batch():`"""
+        if self._pending() is not None:
+            yield self
+            return
+        self._thread.pending = {}
+        try:
+            yield self
+        finally:
+            pending, self._thread.pending = self._thread.pending, None
+            if pending:
+                self._write(pending)
+
+
+_STATUS_VAR_STORES: Dict[bool, StatusVarStore] = {}
+_STATUS_VAR_STORES_LOCK = Lock()
+
+
+def status_vars(local=False) -> StatusVarStore:
+    """The process-wide store of status variables in public.manage, for the production or local database"""
+    store = _STATUS_VAR_STORES.get(local)
+    if store is None:
+        with _STATUS_VAR_STORES_LOCK:
+            store = _STATUS_VAR_STORES.setdefault(local, StatusVarStore(local))
+    return store
+
+
 def update_db_status_var(key: str, val: str, local=False):
     """Update the `manage` table with information for a given variable, e.g. when a table was last updated"""
-    with get_db_connection(schema='', local=local) as con:
-        run_sql(con, f"DELETE FROM public.manage WHERE key = '{key}';")
-        sql_str = f"INSERT INTO public.manage (key, value) VALUES (:key, :val);"
-        run_sql(con, sql_str, {'key': key, 'val': val})
+    status_vars(local).set(key, val)
 
 
-def check_db_status_var(key: str,  local=False):
-    """Check the value of a given variable the `manage`table """
-    with get_db_connection(schema='', local=local) as con:
-        results: List = sql_query_single_col(con, f"SELECT value FROM public.manage WHERE key = '{key}';")
-        return results[0] if results else None
+def check_db_status_var(key: str,  local=False, refresh=False):
+    """Check the value of a given variable the `manage`table
+
+    :param refresh: If True, re-read it, rather than using a value cached up to STATUS_VARS_CACHE_SECONDS ago."""
+    return status_vars(local).get(key, refresh)
 
 
 def delete_db_status_var(key: str, local=False):
     """Delete information from the `manage` table """
-    with get_db_connection(schema='', local=local) as con2:
-        run_sql(con2, f"DELETE FROM public.manage WHERE key = '{key}';")
+    status_vars(local).delete(key)
 
 
 def last_refresh_timestamp(con: Connection) -> str:
@@ -401,14 +630,17 @@ def reset_refresh_status(local=False):
         ('last_derived_refresh_request', 'last_derived_refresh_exited'),
         ('last_refresh_request', 'last_refresh_exited')
     ]
-    for start_time_key, end_time_key in key_pairs:
-        last_start: datetime = dp.parse(check_db_status_var(start_time_key, local))
-        last_end: datetime = dp.parse(check_db_status_var(end_time_key, local))
-        if last_end < last_start:
-            # arbitrarily add 1 microsecond so considered exited after start
-            last_end: str = tz_datetime_str(last_start + timedelta(microseconds=1))
-            update_db_status_var(end_time_key, last_end, local)
-    update_db_status_var('refresh_status', 'inactive', local)
+    store = status_vars(local)
+    values: Dict[str, str] = store.all(refresh=True)
+    with store.batch():
+        for start_time_key, end_time_key in key_pairs:
+            last_start: datetime = dp.parse(values.get(start_time_key))
+            last_end: datetime = dp.parse(values.get(end_time_key))
+            if last_end < last_start:
+                # arbitrarily add 1 microsecond so considered exited after start
+                last_end: str = tz_datetime_str(last_start + timedelta(microseconds=1))
+                store.set(end_time_key, last_end)
+        store.set('refresh_status', 'inactive')
 
 
 def reset_refresh_state(local=False):
@@ -432,10 +664,12 @@ def is_refresh_active(refresh_type=('standard', 'derived')[0], local=False, thre
     key_pairs = [('last_derived_refresh_request', 'last_derived_refresh_exited')]
     if refresh_type == 'standard':
         key_pairs = [('last_refresh_request', 'last_refresh_exited')] + key_pairs
+    # Re-read, as another process's refresh may have started since: all keys in 1 query
+    values: Dict[str, str] = status_vars(local).all(refresh=True)
     for start_time_key, end_time_key in key_pairs:
         # Check status
-        last_start = dp.parse(check_db_status_var(start_time_key, local))
-        last_end = dp.parse(check_db_status_var(end_time_key, local))
+        last_start = dp.parse(values.get(start_time_key))
+        last_end = dp.parse(values.get(end_time_key))
         # Determine if active
         considered_active_via_reported_time = last_start >= last_end
         hours_since_last_refresh: float = (dp.parse(current_datetime()) - last_end).total_seconds() / 60 / 60
@@ -483,33 +717,39 @@ def database_exists(con: Connection, db_name: str) -> bool:
     return len(result) == 1
 
 
-def run_sql(con: Connection, query: str, params: Dict[str, Any] = {}) -> CursorResult:
-    """Run a sql command"""
+def _execute(con: Connection, query: Union[TextClause, str], params: Dict[str, Any] = {}) -> CursorResult:
+    """Run a sql command, w/o reporting it to query_stats"""
     query = text(query) if not isinstance(query, TextClause) else query
     return con.execute(query, params) if params else con.execute(query)
 
 
+def run_sql(con: Connection, query: str, params: Dict[str, Any] = {}) -> CursorResult:
+    """Run a sql command"""
+    t0 = time.perf_counter()
+    result: CursorResult = _execute(con, query, params)
+    observe_query(query, params, time.perf_counter() - t0, result.rowcount)
+    return result
+
+
 def sql_handle_none_to_null(query: str, params: Dict[str, Any], table: str, schema=SCHEMA) -> str:
     """Convert None to NULL for certain fields.
 
     SqlAlchemy w/ Postegres is finicky when accepting None as a NULL value for certain field types, e.g. numeric ones.
     Will find any numeric fields on table and convert None to NULL.
+
+    Not needed for update_from_dicts(), which binds typed arrays, but kept for hand-written queries w/ VALUES lists.
     """
     # Find numeric fields
     field_data_types: Dict[str, str] = get_field_data_types(table, schema)
-    numeric_fields: Set[str] = set([k for k, v in field_data_types.items() if v in PG_DATATYPES_BY_GROUP['numeric']])
-    # Figure out which fields need replacement
-    fields_with_none: List[str] = [k for k, v in params.items() if v is None]
-    # todo: this is really inefficient: O(n^2)
-    numeric_fields_with_none: List[str] = []
-    for fld1 in fields_with_none:
-        for fld2 in numeric_fields:
-            if fld1.startswith(fld2):
-                numeric_fields_with_none.append(fld2)
-                # numeric_fields.remove(fld2)  # would be performance optimization; but causes set size change err
+    numeric_fields: Set[str] = {k for k, v in field_data_types.items() if v in PG_DATATYPES_BY_GROUP['numeric']}
+    # Figure out which fields need replacement: params are named <field><row index>; see key_vals_for_sqlalchemy_query()
+    fields_with_none: Set[str] = set()
+    for k, v in params.items():
+        if v is None:
+            fields_with_none.update((k, re.sub(r'\d+$', '', k)))
     # Make replacements
     query2 = query
-    for fld in numeric_fields_with_none:
+    for fld in numeric_fields & fields_with_none:
         query2 = query2.replace(f'"{fld}" = v.{fld}',
             f'"{fld}" = CASE WHEN v.{fld}::text = \'None\' THEN NULL ELSE v.{fld}::double precision END')
     return query2
@@ -542,11 +782,20 @@ def sql_query(
       query = "SELECT * FROM my_table t WHERE t.id = ANY(:ids);"
       conn.execute(sqlalchemy.text(query), ids=some_ids)
     """
-    try:
-        q: CursorResult = run_sql(con, query, params)
+    t0 = time.perf_counter()
+    results: Union[List[RowMapping], List[List[Any]]] = _fetch_all(con, query, params, return_with_keys)
+    observe_query(query, params, time.perf_counter() - t0, results)
+    if debug:
+        print(f'{query}\n{json.dumps(params, indent=2)}')
+    return results
 
-        if debug:
-            print(f'{query}\n{json.dumps(params, indent=2)}')
+
+def _fetch_all(
+    con: Connection, query: Union[text, str], params: Dict, return_with_keys=True
+) -> Union[List[RowMapping], List[List[Any]]]:
+    """sql_query(), w/o reporting it to query_stats"""
+    try:
+        q: CursorResult = _execute(con, query, params)
         # Conversions: after upgrading some packages, fastapi can no longer serialize Row & RowMapping objects
         # todo: format q.mappings() for FastAPI like w/ q.fetchall() below? Are we not doing this cuz heavy refactor?
         if return_with_keys:
@@ -569,6 +818,119 @@ def sql_query_single_col(*argv) -> List:
     return [r[0] for r in results]
 
 
+def sql_query_stream(
+    query: Union[text, str], params: Dict = {}, fetch_size: int = SQL_STREAM_FETCH_SIZE, batches=False,
+    return_with_keys=True, schema: str = SCHEMA, local=False
+) -> Iterator[Union[Dict, List, List[Dict], List[List]]]:
+    """Like sql_query(), but yields rows as they're fetched, so that peak memory stays flat for large results
+
+    Rows are fetched fetch_size at a time from a named, server-side cursor. Cursors need a transaction, so the query
+    runs on its own pooled READ COMMITTED connection, rather than an AUTOCOMMIT one, which goes back to the pool once
+    the generator is exhausted or closed, e.g. if a StreamingResponse's client disconnects.
+
+    :param batches: If True, yields lists of up to fetch_size rows, rather than rows. See json_array_chunks().
+    :param return_with_keys: If True, rows are dicts, else lists.
+
+    Reported to observe_query() once done, or closed early, timed w/o the time spent waiting on the consumer."""
+    query = text(query) if not isinstance(query, TextClause) else query
+    convert = dict if return_with_keys else list
+    with get_db_connection(isolation_level='READ COMMITTED', schema=schema, local=local) as con:
+        t0 = time.perf_counter()
+        try:
+            result: CursorResult = con.execute(query, params, execution_options={'yield_per': fetch_size})
+        except (ProgrammingError, OperationalError) as err:
+            raise RuntimeError(
+                f'Got an error [{err}] executing the following statement:\n{query}, {json.dumps(params, indent=2)}')
+        seconds, n_rows = time.perf_counter() - t0, 0
+        partitions = iter((result.mappings() if return_with_keys else result).partitions())
+        try:
+            while True:
+                t0 = time.perf_counter()
+                partition = next(partitions, None)
+                seconds += time.perf_counter() - t0
+                if partition is None:
+                    break
+                n_rows += len(partition)
+                if batches:
+                    yield [convert(row) for row in partition]
+                else:
+                    yield from (convert(row) for row in partition)
+        finally:
+            observe_query(query, params, seconds, n_rows)
+
+
+def pg_array_literal(values: Union[List, Set, Tuple]) -> str:
+    """Postgres array literal, e.g. '{1,2,3}', to bind a list as a single parameter: `WHERE id = ANY(:ids)`
+
+    psycopg2 would otherwise send a list as ARRAY[1, 2, 3, ...], an expression w/ a node per item for the server to
+    parse. Postgres infers the literal's type from the column it's compared to. Dicts are items as JSON, and lists as
+    nested array literals, e.g. for json or array columns; see update_from_dicts_statement()."""
+    items = []
+    for x in values:
+        if x is None:
+            items.append('NULL')
+        elif isinstance(x, (int, float)) and not isinstance(x, bool):
+            items.append(str(x))
+        else:
+            x = json.dumps(x) if isinstance(x, dict) else pg_array_literal(x) if isinstance(x, (list, tuple, set)) \
+                else str(x)
+            items.append('"' + x.replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(items) + '}'
+
+
+def _prepared_statement(query: str, params: Dict[str, Any]) -> Tuple[str, str, List[str]]:
+    """Name, PREPARE body and parameter order for query, w/ its :name params replaced by $1, $2, ..."""
+    order: List[str] = []
+
+    def positional(match: re.Match) -> str:
+        """$n for a :name param"""
+        name = match.group(1)
+        if name not in params:
+            return match.group(0)
+        if name not in order:
+            order.append(name)
+        return f'${order.index(name) + 1}'
+
+    body = re.sub(r'(?<![:\w]):(\w+)', positional, query).strip().rstrip(';')
+    name = 'th_' + hashlib.blake2b(body.encode(), digest_size=8).hexdigest()
+    return name, body, order
+
+
+def sql_query_prepared(
+    con: Connection, query: str, params: Dict[str, Any], return_with_keys=True
+) -> Union[List[RowMapping], List[List[Any]]]:
+    """sql_query(), via a server-side prepared statement, so Postgres parses & plans a query shape once per connection
+
+    Statements are cached per pooled connection, keyed by query text, up to PREPARED_STATEMENTS_MAX. Lists, sets and
+    tuples in params are each bound as one array, via psycopg2's list adaptation, so filter on them with
+    `= ANY(:ids)`. Its element type is the one the statement's parameter was planned w/, so the plan is reused
+    whatever the values. A statement whose result columns changed, e.g. after a table was rebuilt, is re-prepared.
+    Use it for hot queries w/ a fixed shape; don't put values in the query text, or each call prepares a new one."""
+    name, body, order = _prepared_statement(query, params)
+    # psycopg2 adapts lists to arrays, but tuples to (a, b, ...) row constructors, and sets not at all
+    values = {k: list(v) if isinstance(v, (set, tuple)) else v for k, v in params.items()}
+    execute = f'EXECUTE {name}' + (f'({", ".join(f":{k}" for k in order)})' if order else '')
+    prepared: OrderedDict = con.info.setdefault('prepared_statements', OrderedDict())
+    for attempt in range(2):
+        if name in prepared:
+            prepared.move_to_end(name)
+        else:
+            run_sql(con, f'PREPARE {name} AS {body}')
+            prepared[name] = True
+            if len(prepared) > PREPARED_STATEMENTS_MAX:
+                run_sql(con, f'DEALLOCATE {prepared.popitem(last=False)[0]}')
+        try:
+            t0 = time.perf_counter()
+            results: Union[List[RowMapping], List[List[Any]]] = _fetch_all(con, execute, values, return_with_keys)
+            observe_query(query, params, time.perf_counter() - t0, results)  # reported as the query, not EXECUTE
+            return results
+        except NotSupportedError as err:
+            if attempt or 'cached plan must not change result type' not in str(err):
+                raise err
+            run_sql(con, f'DEALLOCATE {name}')
+            del prepared[name]
+
+
 # todo: consider adding 'schema' param
 def delete_obj_by_composite_key(con, table: str, key_ids: Dict[str, Union[str, int]]):
     """Delete object by ID"""
@@ -611,12 +973,11 @@ def get_objs_by_id(con, table: str, pk: str, obj_ids: List[Union[str, int]]) ->
 def get_objs_by_composite_key(con, table: str, keys: List[str], objs: List[Dict]) -> List[Dict]:
     """Get database records by their IDs
     todo: could be made more consistent w/ get_objs_by_id(): accept objs_ids instead?
-    todo: refactor: look to insert_from_dicts() more secure way to do this by passing `params` to run_sql()`
     :return: dictionary with keys as the primary key and values as the row contents"""
-    key_vals = {key: [str(obj[key]) for obj in objs] for key in keys}
-    conditions = ' AND '.join([f'"{k}" {sql_in(v, True)}' for k, v in key_vals.items()])
+    key_vals = {f'key_{i}': [obj[key] for obj in objs] for i, key in enumerate(keys)}
+    conditions = ' AND '.join([f'"{key}" = ANY(:key_{i})' for i, key in enumerate(keys)])
     query = f"SELECT * FROM {table} WHERE {conditions};"
-    results: List[RowMapping] = sql_query(con, query, return_with_keys=True)
+    results: List[RowMapping] = sql_query_prepared(con, query, key_vals, return_with_keys=True)
     return [dict(x) for x in results]
 
 
@@ -649,23 +1010,49 @@ def fix_jagged_rows(rows: List[Dict]) -> List[Dict]:
     return [{field: row.get(field, None) for field in fields} for row in rows]
 
 
-def update_from_dicts(con: Connection, table: str, rows: List[Dict]):
-    """Update rows in table from a list of dictionaries"""
-    pk: str = pkey(table)
+def update_from_dicts_statement(
+    table: str, rows: List[Dict], schema=SCHEMA, param_prefix='v'
+) -> Tuple[str, Dict[str, str]]:
+    """UPDATE statement and params, to update rows in table from a list of dictionaries. See update_from_dicts().
+
+    Each field's values are bound as 1 array literal, cast to an array of the column's type, and unnest() zips the
+    arrays back into rows. So, None is NULL whatever the column's type, and the statement's text is the same however
+    many rows there are. Array columns are bound as text[], and each item is cast to the column's type.
+
+    :param schema: Schema of the table, for its column types. The table updated is the one on the connection's
+     search_path, as before.
+    :param param_prefix: Params are named <param_prefix><field index>. Use different ones to run several of these
+     statements in 1 round trip."""
+    pk: Union[str, List[str]] = pkey(table)
+    pks: List[str] = [pk] if isinstance(pk, str) else pk
     rows = fix_jagged_rows(rows)
-    # todo: fully use parameterized queries to prevent SQL injection
-    key_vals: Dict[str, Any] = key_vals_for_sqlalchemy_query(rows)
-    values: str = value_str_for_sqlalchemy_query(rows)
-    fields: str = ', '.join([f'"{x}"' for x in rows[0].keys()])
-    field_set_str: str= ', '.join([f'"{x}" = v.{x}' for x in [x for x in rows[0].keys() if x != pk]])
+    fields: List[str] = list(rows[0].keys())
+    udt_names: Dict[str, str] = {col: udt for col, (_, udt) in column_type_catalog(table, schema).items()}
+    missing: List[str] = [x for x in fields if x not in udt_names]
+    if missing:
+        raise ValueError(f'Fields not in {schema}.{table}: {", ".join(missing)}')
+    array_types: List[str] = ['text' if udt_names[x].startswith('_') else udt_names[x] for x in fields]
+    arrays: str = ', '.join([f'CAST(:{param_prefix}{i} AS {t}[])' for i, t in enumerate(array_types)])
+    field_set_str: str = ', '.join([
+        f'"{x}" = CAST(v."{x}" AS {udt_names[x]})' if udt_names[x].startswith('_') else f'"{x}" = v."{x}"'
+        for x in fields if x not in pks])
     statement = f"""
         UPDATE {table}
         SET {field_set_str}
-        FROM (VALUES
-            {values}
-        ) AS v({fields})
-        WHERE {table}.{pk} = v.{pk};"""
-    run_sql_update(con, statement, key_vals, handle_none_as_null_on_table=table)
+        FROM unnest({arrays}) AS v({', '.join([f'"{x}"' for x in fields])})
+        WHERE {' AND '.join([f'{table}."{x}" = v."{x}"' for x in pks])};"""
+    params: Dict[str, str] = {
+        f'{param_prefix}{i}': pg_array_literal([row[x] for row in rows]) for i, x in enumerate(fields)}
+    return statement, params
+
+
+def update_from_dicts(con: Connection, table: str, rows: List[Dict], schema=SCHEMA):
+    """Update rows in table from a list of dictionaries, in 1 statement per BULK_INSERT_CHUNK_ROWS rows
+
+    :param schema: Schema of the table, for its column types. See update_from_dicts_statement()."""
+    for chunk in chunk_list(rows, BULK_INSERT_CHUNK_ROWS):
+        statement, params = update_from_dicts_statement(table, chunk, schema)
+        run_sql(con, statement, params)
 
 
 def key_vals_for_sqlalchemy_query(rows: List[Dict]) -> Dict[str, Any]:
@@ -698,6 +1085,83 @@ def insert_from_dicts(con: Connection, table: str, rows: List[Dict], skip_if_alr
         run_sql(con, statement, key_vals)
 
 
+def _copy_csv(rows: List[Dict], columns: List[str]) -> str:
+    """rows as CSV text for COPY: None as an unquoted empty value, i.e. NULL, and other values quoted unless numeric"""
+    lines = []
+    for row in rows:
+        values = []
+        for col in columns:
+            val = row.get(col)
+            if val is None:
+                values.append('')
+                continue
+            if isinstance(val, bool):
+                val = 'true' if val else 'false'
+            elif isinstance(val, (int, float)):
+                values.append(str(val))
+                continue
+            elif isinstance(val, (list, tuple, set)):
+                val = pg_array_literal(val)
+            elif isinstance(val, dict):
+                val = json.dumps(val)
+            values.append('"' + str(val).replace('"', '""') + '"')
+        lines.append(','.join(values) + '\n')
+    return ''.join(lines)
+
+
+def bulk_insert_from_dicts(
+    con: Connection, table: str, rows: List[Dict], skip_if_already_exists=True, update_if_exists=False,
+    chunk_size: int = BULK_INSERT_CHUNK_ROWS
+) -> int:
+    """Insert rows into table from a list of dictionaries, set-based: each chunk of rows is COPYed into a temp table,
+    then inserted from there in one statement. For big batches; like insert_from_dicts(), but w/o a bind parameter per
+    value, or fetching existing rows to compare in Python.
+
+    :param skip_if_already_exists: Skip rows whose primary key, see pkey(), is already in table, or earlier in rows
+    :param update_if_exists: Instead of skipping them, update those rows. Needs table to have the primary key
+     constraint. Of rows w/ the same key, the last one wins.
+    :return: Number of rows inserted or updated"""
+    if not rows:
+        return 0
+    pk: Union[str, List[str], None] = pkey(table)
+    pk_cols: List[str] = [pk] if isinstance(pk, str) else pk or []
+    columns: List[str] = list(dict.fromkeys([k for row in rows for k in row.keys()]))  # missing values are NULL
+    cols = ', '.join([f'"{x}"' for x in columns])
+    tmp = '_bulk_insert_' + re.sub(r'\W', '_', table)
+    row_col = '_bulk_insert_row'  # serial, so rows' position in the COPY, i.e. in rows
+    insert = f'INSERT INTO {table} ({cols}) SELECT {cols} FROM {tmp}'
+    if pk_cols and (skip_if_already_exists or update_if_exists):
+        pk_str = ', '.join([f'"{x}"' for x in pk_cols])
+        # dedupe within the chunk, and skip what's in the table, so ON CONFLICT only has to handle concurrent inserts.
+        # Of duplicates, keep the first row when skipping, the last when updating, by position in rows: see row_col.
+        order_by = ', '.join([f'"{x}"' for x in pk_cols] + [f'{row_col} DESC' if update_if_exists else row_col])
+        insert = f'INSERT INTO {table} ({cols}) SELECT {cols} FROM (' \
+            f'SELECT DISTINCT ON ({pk_str}) {cols} FROM {tmp} ORDER BY {order_by}) t'
+        if not update_if_exists:
+            insert += f' WHERE NOT EXISTS (SELECT 1 FROM {table} x WHERE ' + \
+                ' AND '.join([f'x."{k}" = t."{k}"' for k in pk_cols]) + ') ON CONFLICT DO NOTHING'
+        else:
+            updates = ', '.join([f'"{x}" = EXCLUDED."{x}"' for x in columns if x not in pk_cols])
+            insert += f' ON CONFLICT ({pk_str}) ' + (f'DO UPDATE SET {updates}' if updates else 'DO NOTHING')
+
+    n = 0
+    run_sql(con, f'DROP TABLE IF EXISTS {tmp}; CREATE TEMP TABLE {tmp} AS SELECT {cols} FROM {table} WITH NO DATA; '
+                 f'ALTER TABLE {tmp} ADD COLUMN {row_col} BIGSERIAL;')
+    try:
+        for chunk in chunk_list(rows, chunk_size):
+            cursor = con.connection.cursor()
+            try:
+                cursor.copy_expert(
+                    f'COPY {tmp} ({cols}) FROM STDIN WITH (FORMAT csv)', io.StringIO(_copy_csv(chunk, columns)))
+            finally:
+                cursor.close()
+            n += run_sql(con, insert).rowcount
+            run_sql(con, f'TRUNCATE {tmp};')
+    finally:
+        run_sql(con, f'DROP TABLE IF EXISTS {tmp};')
+    return n
+
+
 def insert_from_dict(con: Connection, table: str, d: Union[Dict, List[Dict]], skip_if_already_exists=True):
     """Insert row into table from a dictionary"""
     if isinstance(d, list):
@@ -798,9 +1262,159 @@ def list_views(con: Connection = None, schema: str = None, filter_temp_refresh_v
     return list_schema_objects(con, schema, False, True, filter_temp_refresh_views, True, True, False)
 
 
+class _ChunkStream:
+    """File-like wrapper of an iterable of str chunks, for cursor.copy_expert() to read() from"""
+
+    def __init__(self, chunks: Iterable[str]):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        """Up to size characters; all that's left if size < 0"""
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        out, self.buffer = self.buffer[:size], self.buffer[size:]
+        return out
+
+
+def _widest_kind(kind1: Union[str, None], kind2: str) -> str:
+    """numpy dtype kind that holds values of both kinds, as pandas would unify them across a whole CSV"""
+    kinds = {kind1 or kind2, kind2}
+    if len(kinds) == 1:
+        return kind2
+    if kinds <= {'i', 'u'}:
+        return 'i'
+    if kinds <= {'i', 'u', 'f'}:
+        return 'f'
+    return 'O'
+
+
+def infer_csv_column_types(path: Union[Path, str], chunksize: int = COPY_CHUNK_ROWS) -> Tuple[Dict[str, str], int]:
+    """Postgres types of a CSV's columns, the same as DataFrame.to_sql() would create from the whole file, and its
+    number of rows. Reads the file in chunks, so it's never all in memory."""
+    kinds: Dict[str, str] = {col: 'O' for col in pd.read_csv(path, nrows=0).columns}
+    n_rows = 0
+    seen = set()
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        n_rows += len(chunk)
+        for col, dtype in chunk.dtypes.items():
+            kinds[col] = _widest_kind(kinds[col] if col in seen else None, dtype.kind)
+            seen.add(col)
+    return {col: PANDAS_PG_TYPES.get(kind, 'TEXT') for col, kind in kinds.items()}, n_rows
+
+
+def parquet_column_types(path: Union[Path, str]) -> Tuple[Dict[str, str], int]:
+    """Postgres types of a parquet file's columns, from its schema, and its number of rows"""
+    parquet = pq.ParquetFile(path)
+    types = {}
+    for field in parquet.schema_arrow:
+        t = field.type
+        types[field.name] = 'BOOLEAN' if pa.types.is_boolean(t) else 'BIGINT' if pa.types.is_integer(t) \
+            else 'DOUBLE PRECISION' if pa.types.is_floating(t) else 'DATE' if pa.types.is_date(t) \
+            else 'TIMESTAMP' if pa.types.is_timestamp(t) else 'TEXT'
+    return types, parquet.metadata.num_rows
+
+
+def file_column_names(path: Union[Path, str]) -> List[str]:
+    """Column names of a CSV, from its header, or of a parquet file, from its schema, in the file's order"""
+    if str(path).endswith('.parquet'):
+        return pq.ParquetFile(path).schema_arrow.names
+    with open(path, newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def count_csv_rows(path: Union[Path, str], chunksize: int = COPY_CHUNK_ROWS) -> int:
+    """Number of rows in a CSV, not counting the header"""
+    return sum(len(chunk) for chunk in pd.read_csv(path, usecols=[0], chunksize=chunksize))
+
+
+def _csv_chunks(path: Union[Path, str], skip_rows=0, max_rows: int = None) -> Iterable[str]:
+    """A CSV's rows, from row skip_rows, w/o its header, as CSV text chunks. Rows are parsed & rewritten rather than
+    split on newlines, since quoted values can contain them. PANDAS_NA_VALUES are rewritten as empty, for COPY to load
+    as NULL."""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        rows = itertools.islice(reader, skip_rows, skip_rows + max_rows if max_rows is not None else None)
+        rows = ([('' if x in PANDAS_NA_VALUES else x) for x in row] for row in rows)
+        while True:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(itertools.islice(rows, COPY_CHUNK_ROWS))
+            chunk = buffer.getvalue()
+            if not chunk:
+                break
+            yield chunk
+
+
+def _parquet_chunks(path: Union[Path, str], skip_rows=0, max_rows: int = None) -> Iterable[str]:
+    """A parquet file's rows, from row skip_rows, as CSV text chunks, a record batch at a time"""
+    remaining = max_rows
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=COPY_CHUNK_ROWS):
+        if skip_rows >= len(batch):
+            skip_rows -= len(batch)
+            continue
+        batch = batch.slice(skip_rows, remaining)
+        skip_rows = 0
+        buffer = pa.BufferOutputStream()
+        pa_csv.write_csv(batch, buffer, pa_csv.WriteOptions(include_header=False))
+        yield buffer.getvalue().to_pybytes().decode()
+        if remaining is not None:
+            remaining -= len(batch)
+            if remaining <= 0:
+                break
+
+
+def copy_load(
+    con: Connection, table: str, path: Union[Path, str], column_types: Dict[str, str], schema: str = SCHEMA,
+    create=True, unlogged=False, skip_rows=0, max_rows: int = None
+) -> int:
+    """Stream a CSV or parquet file into a table via COPY FROM STDIN, w/o holding the file in memory
+
+    :param column_types: {column: Postgres type}, in any order. See infer_csv_column_types(), parquet_column_types().
+     They're matched to the file's columns by name, from its header or schema.
+    :param create: Create the table first, w/ column_types, in the file's column order. If False, it must already exist.
+    :param unlogged: Create the table UNLOGGED, so the load isn't written to the WAL, then SET LOGGED once loaded, in
+     one pass. Build indexes after this.
+    :param skip_rows: Skip this many of the file's rows, e.g. ones already loaded
+    :param max_rows: Load at most this many rows
+    :raises ValueError: If the file's column names aren't those of column_types
+    :return: Number of rows loaded"""
+    file_columns: List[str] = file_column_names(path)
+    if sorted(file_columns) != sorted(column_types):
+        raise ValueError(
+            f'Columns of {path} don\'t match column_types for {schema}.{table}:\n - file: {file_columns}'
+            f'\n - column_types: {list(column_types)}')
+    columns = ', '.join(f'"{col}"' for col in file_columns)
+    if create:
+        cols_ddl = ', '.join(f'"{col}" {column_types[col]}' for col in file_columns)
+        run_sql(con, f'CREATE {"UNLOGGED " if unlogged else ""}TABLE {schema}.{table} ({cols_ddl});')
+        invalidate_column_types(schema)
+    is_parquet = str(path).endswith('.parquet')
+    copy_sql = f'COPY {schema}.{table} ({columns}) FROM STDIN WITH (FORMAT csv'
+    # A CSV is rewritten w/ NA values as empty, which COPY only reads as NULL unquoted, unless FORCE_NULL. A parquet
+    # file's nulls are unquoted & empty already, and its empty strings, quoted, stay empty strings, as with to_sql().
+    copy_sql += ')' if is_parquet else f', FORCE_NULL ({columns}))'
+    chunks = _parquet_chunks(path, skip_rows, max_rows) if is_parquet else _csv_chunks(path, skip_rows, max_rows)
+    cursor = con.connection.cursor()
+    try:
+        cursor.copy_expert(copy_sql, _ChunkStream(chunks), size=COPY_READ_BYTES)
+        n_rows = cursor.rowcount
+    finally:
+        cursor.close()
+    if create and unlogged:
+        run_sql(con, f'ALTER TABLE {schema}.{table} SET LOGGED;')
+    return n_rows
+
+
 def load_csv(
     con: Connection, table: str, table_type: str = ['dataset', 'object'][0], replace_rule='replace if diff row count',
-    schema: str = SCHEMA, is_test_table=False, local=False, optional_suffix='', path_override: Union[Path, str] = None
+    schema: str = SCHEMA, is_test_table=False, local=False, optional_suffix='', path_override: Union[Path, str] = None,
+    unlogged=False, column_types: Dict[str, str] = None
 ):
     """Load CSV into table
     :param replace_rule:
@@ -813,8 +1427,12 @@ def load_csv(
     :param optional_suffix: Useful for when remaking tables when database is live. For example, you can upload a new
     'concept' table using the suffix '_new', then after 'concept_new' is successfully loaded, you can delete the old
     table and rename this table as just 'concept'.
+    :param path_override: A .csv, or a .parquet. By default, a dataset's .parquet is used if there's no .csv.
+    :param unlogged: Load into an UNLOGGED table, then SET LOGGED. Faster for big tables. See copy_load().
+    :param column_types: {column: Postgres type}. Defaults to the dataset's column_types in DATASET_REGISTRY, or, if
+     none, the types DataFrame.to_sql() would have created; see infer_csv_column_types().
 
-    - Uses: https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.to_sql.html
+    - Uses: COPY FROM STDIN, streaming the file; see copy_load()
     """
     table_name_no_suffix = table
     table = table + optional_suffix
@@ -837,40 +1455,85 @@ def load_csv(
     # Load table
     path = path_override if path_override else os.path.join(DATASETS_PATH, f'{table_name_no_suffix}.csv') \
         if table_type == 'dataset' else os.path.join(OBJECTS_PATH, table, 'latest.csv')
+    if not path_override and table_type == 'dataset' and not os.path.isfile(path):
+        path = os.path.join(DATASETS_PATH, f'{table_name_no_suffix}.parquet')
     if not os.path.isfile(path):
         print(f'INFO: {path} does not exist; skipping')
         return
-    df = pd.read_csv(path)
+    column_types = column_types or DATASET_REGISTRY.get(table_name_no_suffix, {}).get('column_types')
+    if str(path).endswith('.parquet'):
+        inferred_types, n_rows = parquet_column_types(path)
+    elif column_types:
+        inferred_types = None
+        n_rows = count_csv_rows(path) if existing_rows else None  # only needed to compare w/ existing rows
+    else:
+        inferred_types, n_rows = infer_csv_column_types(path)
+    column_types = column_types or inferred_types
 
     # todo: this could be replaced by using path_override and saving some static files with 1 line
-    if is_test_table and not path_override:
-        df = df.head(1)
+    max_rows = 1 if is_test_table and not path_override else None
+    if max_rows is not None and n_rows is not None:
+        n_rows = min(n_rows, max_rows)
 
-    print(f'INFO: loading {schema}.{table} ({len(df)} rows) into {CONFIG["server"]}:{DB}')
-    if replace_rule == 'replace if diff row count' and existing_rows == len(df):
+    print(f'INFO: loading {schema}.{table} ({n_rows if n_rows is not None else "?"} rows) into {CONFIG["server"]}:{DB}')
+    if replace_rule == 'replace if diff row count' and existing_rows == n_rows:
         print(f'INFO: {schema}.{table} exists with same number of rows {existing_rows}; leaving it')
         return
-    if replace_rule == 'finish aborted upload' and existing_rows < len(df):
-        print(f'INFO: {schema}.{table} exists with {commify(existing_rows)} rows; uploading remaining {commify(len(df)-existing_rows)} rows')
-        df = df.iloc[existing_rows: len(df)]
+    skip_rows = 0
+    if replace_rule == 'finish aborted upload' and 0 < existing_rows < n_rows:
+        print(f'INFO: {schema}.{table} exists with {commify(existing_rows)} rows; uploading remaining '
+              f'{commify(n_rows - existing_rows)} rows')
+        skip_rows = existing_rows
     else:
         con.execute(text(f'DROP TABLE IF EXISTS {schema}.{table} CASCADE'))
 
     # - load
-    df.to_sql(table, con, **{'if_exists': 'append', 'index': False, 'schema': schema, 'chunksize': 1000})
+    copy_load(
+        con, table, path, column_types, schema, create=not skip_rows, unlogged=unlogged, skip_rows=skip_rows,
+        max_rows=max_rows)
     # - update status
     if not is_test_table:
         update_db_status_var(f'last_updated_{table_name_no_suffix}', str(current_datetime()), local)
 
 
+def _load_column_types(schema: str) -> Dict[str, Dict[str, Tuple[str, str]]]:
+    """{table: {column: (data_type, udt_name)}} for all tables and views in schema, in 1 query"""
+    with get_db_connection(schema='') as con:
+        rows: List[RowMapping] = sql_query(con, """
+            SELECT table_name, column_name, data_type, udt_name FROM information_schema.columns
+            WHERE table_schema = :schema ORDER BY table_name, ordinal_position;""", {'schema': schema})
+    catalog: Dict[str, Dict[str, Tuple[str, str]]] = {}
+    for row in rows:
+        catalog.setdefault(row['table_name'], {})[row['column_name']] = (row['data_type'], row['udt_name'])
+    return catalog
+
+
+def column_type_catalog(table: str, schema=SCHEMA) -> Dict[str, Tuple[str, str]]:
+    """{column: (data_type, udt_name)} for table, e.g. {'codeset_id': ('integer', 'int4')}
+
+    Looked up in a catalog of all of the schema's columns, loaded once per process, and reloaded after
+    invalidate_column_types(), or if the table isn't in it, e.g. if another process created it since."""
+    catalog = _COLUMN_TYPES.get(schema)
+    if catalog is None or table not in catalog:
+        with _COLUMN_TYPES_LOCK:
+            catalog = _COLUMN_TYPES.get(schema)
+            if catalog is None or table not in catalog:
+                catalog = _COLUMN_TYPES[schema] = _load_column_types(schema)
+    return catalog.get(table, {})
+
+
+def invalidate_column_types(schema: str = None):
+    """Forget the cached column types of a schema, or all schemas, e.g. after DDL. See column_type_catalog()."""
+    with _COLUMN_TYPES_LOCK:
+        if schema is None:
+            _COLUMN_TYPES.clear()
+        else:
+            _COLUMN_TYPES.pop(schema, None)
+
+
 def get_field_data_types(table: str, schema=SCHEMA) -> Dict[str, str]:
     """Get data types for each field in the table"""
-    with get_db_connection(schema='') as con:
-        field_data_types: List[Dict[str, str]] = [dict(x) for x in sql_query(con, f"""
-            SELECT column_name,  data_type FROM information_schema.columns 
-            WHERE table_schema = '{schema}' AND table_name = '{table}';""")]
-        field_data_types: Dict[str, str] = {x['column_name']: x['data_type'] for x in field_data_types}
-    return field_data_types
+    return {col: data_type for col, (data_type, _) in column_type_catalog(table, schema).items()}
 
 
 def list_tables(con: Connection = None, schema: str = None, filter_temp_refresh_tables=False) -> List[str]:
@@ -997,6 +1660,7 @@ def reset_temp_refresh_tables(schema: str = SCHEMA, local=False, verbose=True):
                     run_sql(con, f'DROP {item_type} {schema}.{item}_new;')
                 else:  # not sure if this would ever happen. never seen it happen. if so it will err if name collision
                     run_sql(con, f'ALTER {item_type} {schema}.{item}_new RENAME TO {item};')
+    invalidate_column_types(schema)
 
 
 def get_idle_connections(interval: str = '1 week'):
@@ -0,0 +1 @@
+"""Graph data structures and algorithms"""
@@ -0,0 +1,63 @@
+"""Super-node condensation: shrink subgraphs whose high-fanout nodes, e.g. SNOMED "Clinical finding", have hundreds of
+children that are only there as descendants
+
+A super node is one with more than threshold children in the subgraph. Its children are hidden, i.e. dropped along
+with their edges, when nothing else depends on them: they aren't in keep (e.g. the concept set's own concepts), have
+no children of their own in the subgraph, and have no parent in the subgraph that isn't a super node. What's left is
+still a valid subgraph, and each super node gets a summary of what was hidden under it, so that it can be expanded
+on request.
+"""
+from typing import Dict, Set, Tuple
+
+import numpy as np
+
+from backend.graph.csr import CsrSubgraph, NodeIds, ids_to_array
+
+
+class CondensedSubgraph(CsrSubgraph):
+    """A CsrSubgraph with some super nodes' children hidden
+
+    super_nodes: {super node concept_id: {'n_children': children in the full subgraph, 'n_hidden': children hidden}}"""
+    super_nodes: Dict[int, Dict[str, int]]
+    hidden: Set[int]
+
+
+def condense_super_nodes(sg: CsrSubgraph, threshold: int = 10, keep: NodeIds = ()) -> CondensedSubgraph:
+    """Hide the children of nodes with more than threshold children, where nothing else depends on them
+
+    :param keep: concept_ids never to hide."""
+    n = len(sg.graph)
+    out_degree = np.bincount(sg.src_rows, minlength=n) if len(sg.src_rows) else np.zeros(n, dtype=np.int64)
+    is_super = out_degree > threshold
+    protected = np.zeros(n, dtype=bool)
+    keep_rows = sg.graph.rows_of(ids_to_array(keep))
+    protected[keep_rows[keep_rows >= 0]] = True
+    protected[sg.src_rows] = True  # has children
+    protected[sg.tgt_rows[~is_super[sg.src_rows]]] = True  # has a parent that isn't a super node
+
+    from_super = is_super[sg.src_rows]
+    hide_edge = from_super & ~protected[sg.tgt_rows]
+    hidden_rows = np.unique(sg.tgt_rows[hide_edge])
+    is_hidden = np.zeros(n, dtype=bool)
+    is_hidden[hidden_rows] = True
+
+    condensed = CondensedSubgraph.from_rows(
+        sg.graph, sg.node_rows[~is_hidden[sg.node_rows]], sg.src_rows[~hide_edge], sg.tgt_rows[~hide_edge])
+    super_rows, n_hidden = np.unique(sg.src_rows[hide_edge], return_counts=True)
+    node_ids = sg.graph.node_ids
+    condensed.super_nodes = {
+        int(node_ids[row]): {'n_children': int(out_degree[row]), 'n_hidden': int(count)}
+        for row, count in zip(super_rows.tolist(), n_hidden.tolist())}
+    condensed.hidden = set(node_ids[hidden_rows].tolist())
+    return condensed
+
+
+def expand_super_node(sg: CsrSubgraph, super_node: int) -> Tuple[np.ndarray, np.ndarray, bool]:
+    """Edges from super_node to each of its children in the full, uncondensed, subgraph
+
+    :return: (source ids, target ids, whether the subgraph's descendant budget cut off some of super_node's children,
+      i.e. it's in sg.meta['truncated'])"""
+    row = sg.graph.rows_of([super_node])[0]
+    mask = sg.src_rows == row if row >= 0 else np.zeros(len(sg.src_rows), dtype=bool)
+    truncated = super_node in (sg.meta.get('truncated') or [])
+    return sg.graph.node_ids[sg.src_rows[mask]], sg.graph.node_ids[sg.tgt_rows[mask]], truncated
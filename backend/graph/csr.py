@@ -0,0 +1,367 @@
+"""Compact, CSR-backed relationship graph
+
+The OMOP hierarchy stored as flat NumPy arrays instead of a networkx dict-of-dicts:
+- node_ids: concept_id of each row, in the order networkx would have inserted the nodes
+- succ_indptr / succ_indices: successor (child) rows of each row, compressed sparse row layout
+- pred_indptr / pred_indices: predecessor (parent) rows of each row, same layout
+- sorted_ids / sorted_rows: concept_id -> row lookup via binary search
+
+Rows, and the neighbors within each row, are kept in networkx insertion order. That way edge lists produced here are
+identical, including order, to what `DiGraph.edges` / `DiGraph.subgraph(...).edges` return for a graph built from the
+same edge stream.
+"""
+from typing import Any, Dict, Iterable, List, Set, Tuple, Union
+
+import numpy as np
+from networkx import DiGraph
+
+ID_DTYPE = np.int32  # concept_id is int4 in postgres
+ROW_DTYPE = np.int32
+INDPTR_DTYPE = np.int64
+NodeIds = Union[List[int], Set[int], np.ndarray, Iterable[int]]
+
+
+def ids_to_array(ids: NodeIds) -> np.ndarray:
+    """Convert an iterable of concept_ids to an int64 array, preserving iteration order"""
+    if isinstance(ids, np.ndarray):
+        return ids.astype(np.int64, copy=False)
+    if isinstance(ids, (list, tuple, set, frozenset, dict)):
+        return np.fromiter(ids, dtype=np.int64, count=len(ids))
+    return np.fromiter(ids, dtype=np.int64)
+
+
+def edge_keys(sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Pack (source, target) int32 concept_id pairs into single sortable int64 keys"""
+    return (sources.astype(np.int64) << 32) | (targets.astype(np.int64) & 0xFFFFFFFF)
+
+
+def csr_from_pairs(rows_a: np.ndarray, rows_b: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Build CSR (indptr, indices) mapping each row in rows_a to its rows_b, keeping the input order within a row"""
+    perm = np.argsort(rows_a, kind='stable')
+    counts = np.bincount(rows_a, minlength=n)
+    indptr = np.zeros(n + 1, dtype=INDPTR_DTYPE)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr, rows_b[perm].astype(ROW_DTYPE, copy=False)
+
+
+def gather_neighbors(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """For each row in rows, in order, get its neighbor rows, in order.
+
+    :return: (source rows, neighbor rows), one entry per edge."""
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = indptr[rows]
+    lens = indptr[rows + 1] - starts
+    total = int(lens.sum())
+    if not total:
+        return np.empty(0, dtype=ROW_DTYPE), np.empty(0, dtype=ROW_DTYPE)
+    # position of each gathered edge = start of its row + offset within the row
+    run_starts = np.cumsum(lens) - lens
+    idx = np.repeat(starts - run_starts, lens) + np.arange(total, dtype=np.int64)
+    return np.repeat(rows, lens).astype(ROW_DTYPE, copy=False), indices[idx]
+
+
+class CsrGraph:
+    """Directed graph of concept_ids backed by CSR arrays
+
+    Covers the subset of the networkx.DiGraph API that the graph routes need."""
+
+    def __init__(
+        self, node_ids: np.ndarray, succ_indptr: np.ndarray, succ_indices: np.ndarray, pred_indptr: np.ndarray,
+        pred_indices: np.ndarray, sorted_ids: np.ndarray = None, sorted_rows: np.ndarray = None,
+        meta: Dict[str, Any] = None, aux: Dict[str, np.ndarray] = None,
+    ):
+        """Wrap prebuilt CSR arrays. Usually built via from_edges() or load_snapshot() instead.
+
+        :param meta: Provenance of the graph, e.g. the vocab version it was built from. See snapshot.py.
+        :param aux: Auxiliary per-graph arrays, e.g. indexes, keyed by name. Saved in & loaded from snapshots along with
+          the graph."""
+        self.node_ids = node_ids
+        self.succ_indptr = succ_indptr
+        self.succ_indices = succ_indices
+        self.pred_indptr = pred_indptr
+        self.pred_indices = pred_indices
+        if sorted_ids is None or sorted_rows is None:
+            sorted_rows = np.argsort(node_ids, kind='stable').astype(ROW_DTYPE, copy=False)
+            sorted_ids = node_ids[sorted_rows]
+        self.sorted_ids = sorted_ids
+        self.sorted_rows = sorted_rows
+        self.meta: Dict[str, Any] = meta or {}
+        self.aux: Dict[str, np.ndarray] = aux or {}
+
+    # Construction -----------------------------------------------------------------------------------------------------
+    @classmethod
+    def from_edges(cls, sources: NodeIds, targets: NodeIds) -> 'CsrGraph':
+        """Build from parallel arrays of (source, target) concept_ids, as DiGraph.add_edges_from() would"""
+        src = ids_to_array(sources)
+        tgt = ids_to_array(targets)
+        if len(src) != len(tgt):
+            raise ValueError(f'sources and targets differ in length: {len(src)} vs {len(tgt)}')
+        # Drop repeated edges, keeping first occurrence, as networkx does
+        if len(src):
+            _, first = np.unique(edge_keys(src, tgt), return_index=True)
+            if len(first) != len(src):
+                keep = np.sort(first)
+                src, tgt = src[keep], tgt[keep]
+        # Nodes, in order of first appearance in the stream: u0, v0, u1, v1, ...
+        interleaved = np.empty(2 * len(src), dtype=np.int64)
+        interleaved[0::2] = src
+        interleaved[1::2] = tgt
+        sorted_ids, first_seen = np.unique(interleaved, return_index=True)
+        insertion_order = np.argsort(first_seen, kind='stable')
+        node_ids = sorted_ids[insertion_order].astype(ID_DTYPE)
+        sorted_rows = np.empty(len(sorted_ids), dtype=ROW_DTYPE)
+        sorted_rows[insertion_order] = np.arange(len(sorted_ids), dtype=ROW_DTYPE)
+        src_rows = sorted_rows[np.searchsorted(sorted_ids, src)]
+        tgt_rows = sorted_rows[np.searchsorted(sorted_ids, tgt)]
+        n = len(node_ids)
+        succ_indptr, succ_indices = csr_from_pairs(src_rows, tgt_rows, n)
+        pred_indptr, pred_indices = csr_from_pairs(tgt_rows, src_rows, n)
+        return cls(node_ids, succ_indptr, succ_indices, pred_indptr, pred_indices,
+                   sorted_ids.astype(ID_DTYPE), sorted_rows)
+
+    @classmethod
+    def from_networkx(cls, g: DiGraph) -> 'CsrGraph':
+        """Build from an existing DiGraph, e.g. a legacy relationship_graph.pickle, keeping its node/edge order"""
+        node_ids = np.fromiter(g.nodes, dtype=np.int64, count=len(g))
+        sorted_rows = np.argsort(node_ids, kind='stable').astype(ROW_DTYPE)
+        sorted_ids = node_ids[sorted_rows]
+
+        def rows(ids: np.ndarray) -> np.ndarray:
+            return sorted_rows[np.searchsorted(sorted_ids, ids)]
+
+        csr = []
+        for adj in (g.succ, g.pred):
+            lens = np.fromiter((len(adj[n]) for n in g.nodes), dtype=INDPTR_DTYPE, count=len(g))
+            indptr = np.zeros(len(g) + 1, dtype=INDPTR_DTYPE)
+            np.cumsum(lens, out=indptr[1:])
+            nbrs = np.fromiter((nbr for n in g.nodes for nbr in adj[n]), dtype=np.int64, count=int(indptr[-1]))
+            csr.extend([indptr, rows(nbrs).astype(ROW_DTYPE)])
+        return cls(node_ids.astype(ID_DTYPE), *csr, sorted_ids.astype(ID_DTYPE), sorted_rows)
+
+    # Lookups ----------------------------------------------------------------------------------------------------------
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def __contains__(self, node: int) -> bool:
+        return self.has_node(node)
+
+    def number_of_nodes(self) -> int:
+        """Number of nodes"""
+        return len(self.node_ids)
+
+    def number_of_edges(self) -> int:
+        """Number of edges"""
+        return len(self.succ_indices)
+
+    def nbytes(self) -> int:
+        """Memory held by the graph's arrays, including aux arrays"""
+        return sum(a.nbytes for a in (
+            self.node_ids, self.succ_indptr, self.succ_indices, self.pred_indptr, self.pred_indices, self.sorted_ids,
+            self.sorted_rows, *self.aux.values()))
+
+    def rows_of(self, ids: NodeIds) -> np.ndarray:
+        """Row of each concept_id in ids; -1 for ids not in the graph"""
+        ids = ids_to_array(ids)
+        if not len(self.sorted_ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        # Search with ids in sorted_ids' dtype; otherwise numpy casts all of sorted_ids to int64 on every call
+        info = np.iinfo(self.sorted_ids.dtype)
+        in_range = (ids >= info.min) & (ids <= info.max)
+        pos = np.searchsorted(self.sorted_ids, np.where(in_range, ids, 0).astype(self.sorted_ids.dtype))
+        pos_clipped = np.minimum(pos, len(self.sorted_ids) - 1)
+        found = in_range & (self.sorted_ids[pos_clipped] == ids)
+        return np.where(found, self.sorted_rows[pos_clipped], -1).astype(np.int64)
+
+    def has_node(self, node: int) -> bool:
+        """Is concept_id in the graph?"""
+        return bool(self.rows_of([node])[0] >= 0)
+
+    def _neighbors(self, indptr: np.ndarray, indices: np.ndarray, node: int) -> List[int]:
+        row = self.rows_of([node])[0]
+        if row < 0:
+            raise KeyError(f'The node {node} is not in the graph.')
+        return self.node_ids[indices[indptr[row]:indptr[row + 1]]].tolist()
+
+    def successors(self, node: int) -> List[int]:
+        """Children of node"""
+        return self._neighbors(self.succ_indptr, self.succ_indices, node)
+
+    def predecessors(self, node: int) -> List[int]:
+        """Parents of node"""
+        return self._neighbors(self.pred_indptr, self.pred_indices, node)
+
+    def successors_of(self, nodes: NodeIds) -> np.ndarray:
+        """Children of every node in nodes that is in the graph, concatenated in iteration order. May repeat."""
+        rows = self.rows_of(nodes)
+        _, nbr_rows = gather_neighbors(self.succ_indptr, self.succ_indices, rows[rows >= 0])
+        return self.node_ids[nbr_rows]
+
+    def descendants_within(
+        self, nodes: NodeIds, max_depth: int = None, max_nodes: int = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Descendants of nodes, breadth-first, a whole level at a time, within a depth and size budget
+
+        :param max_depth: Levels below nodes to go. None for no limit.
+        :param max_nodes: Max number of descendants to return. None for no limit. When a level doesn't fit, its first
+          nodes, in the order found, are taken up to the limit.
+        :return: (descendant ids, in the order found; ids of the nodes whose children were cut off by either limit,
+          sorted). Descendants don't include nodes themselves."""
+        rows = self.rows_of(nodes)
+        rows = rows[rows >= 0]
+        seen = np.zeros(len(self), dtype=bool)
+        seen[rows] = True
+        _, first = np.unique(rows, return_index=True)
+        frontier = rows[np.sort(first)]
+        found: List[np.ndarray] = []
+        n_found, depth = 0, 0
+        truncated = np.empty(0, dtype=np.int64)
+        while len(frontier):
+            parents, children = gather_neighbors(self.succ_indptr, self.succ_indices, frontier)
+            unseen = ~seen[children]
+            parents, children = parents[unseen], children[unseen]
+            if not len(children):
+                break
+            if max_depth is not None and depth >= max_depth:
+                truncated = parents
+                break
+            _, first = np.unique(children, return_index=True)
+            new = children[np.sort(first)]
+            if max_nodes is not None and n_found + len(new) > max_nodes:
+                new = new[:max_nodes - n_found]
+                seen[new] = True
+                found.append(new)
+                truncated = parents[~seen[children]]
+                break
+            seen[new] = True
+            found.append(new)
+            n_found += len(new)
+            frontier = new
+            depth += 1
+        descendant_rows = np.concatenate(found) if found else np.empty(0, dtype=ROW_DTYPE)
+        return self.node_ids[descendant_rows], np.unique(self.node_ids[truncated])
+
+    def descendants_by_group(
+        self, groups: List[Set[int]], max_depth: Union[int, None] = 1, max_nodes: int = None
+    ) -> List[Tuple[Set[int], Union[List[int], None]]]:
+        """Descendants of each of several groups of nodes, e.g. those concept_graph() adds
+
+        With the default of children only, the children of all the groups' nodes are gathered in one pass and then
+        split by group, each group's in the same order as successors_of() gives them. Budgeted searches (other
+        max_depth, or max_nodes) depend on each group's own frontier, so run per group.
+        :returns: For each group, (descendant ids, ids of the nodes whose children were cut off, or None if no
+          budget)"""
+        if max_depth != 1 or max_nodes is not None:
+            results = []
+            for nodes in groups:
+                descendant_ids, truncated_ids = self.descendants_within(nodes, max_depth, max_nodes)
+                results.append((set(descendant_ids.tolist()), truncated_ids.tolist()))
+            return results
+        if len(groups) == 1:
+            return [(set(self.successors_of(groups[0]).tolist()), None)]
+        group_rows = [self.rows_of(nodes) for nodes in groups]
+        group_rows = [rows[rows >= 0] for rows in group_rows]
+        # Order-preserving dedupe: the union's rows in first-seen order
+        all_rows = np.concatenate(group_rows) if group_rows else np.empty(0, dtype=np.int64)
+        _, first = np.unique(all_rows, return_index=True)
+        union_rows = all_rows[np.sort(first)]
+        _, child_rows = gather_neighbors(self.succ_indptr, self.succ_indices, union_rows)
+        # Then each group's children, in the group's own row order, from the union's: same as successors_of(group)
+        union_indptr = np.zeros(len(union_rows) + 1, dtype=np.int64)
+        np.cumsum(self.succ_indptr[union_rows + 1] - self.succ_indptr[union_rows], out=union_indptr[1:])
+        union_pos = np.empty(len(self), dtype=np.int64)
+        union_pos[union_rows] = np.arange(len(union_rows))
+        return [(set(self.node_ids[gather_neighbors(union_indptr, child_rows, union_pos[rows])[1]].tolist()), None)
+                for rows in group_rows]
+
+    # Edges & subgraphs ------------------------------------------------------------------------------------------------
+    def edge_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """All edges as (source ids, target ids), in DiGraph.edges order"""
+        lens = np.diff(self.succ_indptr)
+        src_rows = np.repeat(np.arange(len(self.node_ids), dtype=ROW_DTYPE), lens)
+        return self.node_ids[src_rows], self.node_ids[self.succ_indices]
+
+    def edge_range(self, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Edges start..stop-1, in DiGraph.edges order, as (source ids, target ids). Lets callers page through all edges
+        without materializing them all at once."""
+        start, stop = max(0, start), min(stop, self.number_of_edges())
+        if start >= stop:
+            return np.empty(0, dtype=self.node_ids.dtype), np.empty(0, dtype=self.node_ids.dtype)
+        src_rows = np.searchsorted(self.succ_indptr, np.arange(start, stop), side='right') - 1
+        return self.node_ids[src_rows], self.node_ids[self.succ_indices[start:stop]]
+
+    @property
+    def edges(self) -> List[Tuple[int, int]]:
+        """All edges as a list of (source, target) tuples, in DiGraph.edges order"""
+        src, tgt = self.edge_arrays()
+        return list(zip(src.tolist(), tgt.tolist()))
+
+    def subgraph(self, nodes: NodeIds) -> 'CsrSubgraph':
+        """Induced subgraph on nodes"""
+        return CsrSubgraph(self, nodes)
+
+
+class CsrSubgraph:
+    """Induced subgraph of a CsrGraph, materialized as row arrays
+
+    Mirrors the iteration order of networkx's subgraph views: when the induced node set is less than half the size of
+    the graph, nodes are visited in the order of the induced set, otherwise in graph order."""
+
+    def __init__(self, graph: CsrGraph, nodes: NodeIds):
+        self.graph = graph
+        ids = ids_to_array(nodes)
+        rows = graph.rows_of(ids)
+        # networkx builds set(nbunch_iter(nodes)); building it with the same insertion sequence reproduces its order
+        induced: Set[int] = set(ids[rows >= 0].tolist())
+        if 2 * len(induced) < len(graph):
+            node_rows = graph.rows_of(induced)
+        else:
+            in_graph_order = np.zeros(len(graph), dtype=bool)
+            in_graph_order[rows[rows >= 0]] = True
+            node_rows = np.flatnonzero(in_graph_order)
+        self.node_rows: np.ndarray = node_rows
+        member = np.zeros(len(graph), dtype=bool)
+        member[node_rows] = True
+        src_rows, tgt_rows = gather_neighbors(graph.succ_indptr, graph.succ_indices, node_rows)
+        keep = member[tgt_rows]
+        self.src_rows: np.ndarray = src_rows[keep]
+        self.tgt_rows: np.ndarray = tgt_rows[keep]
+        self.meta: Dict[str, Any] = {}  # anything the caller wants to report along with the subgraph
+
+    @classmethod
+    def from_rows(
+        cls, graph: CsrGraph, node_rows: np.ndarray, src_rows: np.ndarray, tgt_rows: np.ndarray
+    ) -> 'CsrSubgraph':
+        """Wrap already-selected node & edge rows, e.g. a filtered copy of another subgraph"""
+        sg = cls.__new__(cls)
+        sg.graph, sg.node_rows, sg.src_rows, sg.tgt_rows = graph, node_rows, src_rows, tgt_rows
+        sg.meta = {}
+        return sg
+
+    def __len__(self) -> int:
+        return len(self.node_rows)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __contains__(self, node: int) -> bool:
+        row = self.graph.rows_of([node])[0]
+        return bool(row >= 0 and np.isin(row, self.node_rows))
+
+    @property
+    def nodes(self) -> List[int]:
+        """Node ids, in networkx subgraph iteration order"""
+        return self.graph.node_ids[self.node_rows].tolist()
+
+    def number_of_edges(self) -> int:
+        """Number of edges"""
+        return len(self.src_rows)
+
+    def edge_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Edges as (source ids, target ids)"""
+        return self.graph.node_ids[self.src_rows], self.graph.node_ids[self.tgt_rows]
+
+    @property
+    def edges(self) -> List[Tuple[int, int]]:
+        """Edges as a list of (source, target) tuples, in networkx subgraph order"""
+        src, tgt = self.edge_arrays()
+        return list(zip(src.tolist(), tgt.tolist()))
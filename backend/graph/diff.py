@@ -0,0 +1,85 @@
+"""Edge diff between two versions of the relationship graph, e.g. before and after a vocab refresh
+
+Each graph's edges are packed into sorted int64 keys (see csr.edge_keys()), so added and removed edges come from
+binary searches of one sorted array in the other, rather than from SQL over two schemas.
+
+The diff from the previous graph to the current one is saved next to the snapshot when a new graph is built, as an
+.npz of four int32 arrays, plus the two vocab versions.
+"""
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from backend.graph.csr import CsrGraph, NodeIds, edge_keys, ids_to_array
+from backend.graph.snapshot import load_snapshot
+
+DIFF_ARRAYS = ['added_source', 'added_target', 'removed_source', 'removed_target']
+
+
+def sorted_edge_keys(graph: CsrGraph) -> np.ndarray:
+    """The graph's edges as sorted, unique int64 keys"""
+    return np.unique(edge_keys(*graph.edge_arrays()))
+
+
+def _unpack(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Inverse of csr.edge_keys()"""
+    return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.uint32).view(np.int32)
+
+
+def _not_in(keys: np.ndarray, sorted_keys: np.ndarray) -> np.ndarray:
+    """keys that aren't in sorted_keys"""
+    if not len(sorted_keys):
+        return keys
+    found = sorted_keys[np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)] == keys
+    return keys[~found]
+
+
+def diff_graphs(old: CsrGraph, new: CsrGraph) -> Dict[str, np.ndarray]:
+    """Edges in new but not old (added), and in old but not new (removed)
+
+    :return: {added_source, added_target, removed_source, removed_target, from_version, to_version}. Edges are sorted
+      by source, then target."""
+    old_keys, new_keys = sorted_edge_keys(old), sorted_edge_keys(new)
+    added_source, added_target = _unpack(_not_in(new_keys, old_keys))
+    removed_source, removed_target = _unpack(_not_in(old_keys, new_keys))
+    return {
+        'added_source': added_source, 'added_target': added_target,
+        'removed_source': removed_source, 'removed_target': removed_target,
+        'from_version': old.meta.get('vocab_version'), 'to_version': new.meta.get('vocab_version')}
+
+
+def diff_snapshots(old_path: str, new_path: str) -> Dict[str, np.ndarray]:
+    """diff_graphs() of two snapshot files"""
+    return diff_graphs(load_snapshot(old_path), load_snapshot(new_path))
+
+
+def write_diff(diff: Dict[str, np.ndarray], path: str):
+    """Save diff. Written to a temp file first and then renamed, so readers never see a partial file."""
+    tmp_path = f'{path}.tmp-{os.getpid()}.npz'
+    np.savez(
+        tmp_path, **{name: diff[name] for name in DIFF_ARRAYS},
+        from_version=np.array(diff['from_version'] or ''), to_version=np.array(diff['to_version'] or ''))
+    os.replace(tmp_path, path)
+
+
+def read_diff(path: str) -> Dict[str, np.ndarray]:
+    """Load a diff saved by write_diff()"""
+    with np.load(path) as data:
+        diff = {name: data[name] for name in DIFF_ARRAYS}
+        diff['from_version'] = str(data['from_version']) or None
+        diff['to_version'] = str(data['to_version']) or None
+    return diff
+
+
+def filter_diff(diff: Dict[str, np.ndarray], concept_ids: Optional[NodeIds] = None) -> Dict[str, np.ndarray]:
+    """Just the added & removed edges with a source or target in concept_ids. All of them if concept_ids is None."""
+    if concept_ids is None:
+        return diff
+    ids = np.unique(ids_to_array(concept_ids))
+    filtered = dict(diff)
+    for change in ('added', 'removed'):
+        src, tgt = diff[f'{change}_source'], diff[f'{change}_target']
+        keep = np.isin(src, ids) | np.isin(tgt, ids)
+        filtered[f'{change}_source'], filtered[f'{change}_target'] = src[keep], tgt[keep]
+    return filtered
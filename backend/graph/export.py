@@ -0,0 +1,92 @@
+"""Encoding graph edges for the wire
+
+Streaming export of edges, a chunk at a time, in a choice of formats:
+- json: one JSON array of [source, target] arrays, same as the old non-streaming /wholegraph
+- ndjson: one [source, target] JSON array per line
+- int32: raw little-endian int32 pairs: source0, target0, source1, target1, ...
+- arrow: Arrow IPC stream, one record batch per chunk, with int32 columns source & target
+
+Compact formats for concept graph responses, see encode_columnar_json() and encode_arrow_edges().
+"""
+from typing import Any, Dict, Iterator, Tuple
+
+import numpy as np
+import orjson
+
+from backend.graph.csr import CsrGraph
+
+EDGE_CHUNK_SIZE = 100_000
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'int32': 'application/octet-stream',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+ARROW_METADATA_KEY = b'termhub'
+
+
+def iter_edge_chunks(
+    graph: CsrGraph, start: int = 0, stop: int = None, chunk_size: int = EDGE_CHUNK_SIZE
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield (source ids, target ids) for edges start..stop-1, chunk_size at a time"""
+    stop = graph.number_of_edges() if stop is None else min(stop, graph.number_of_edges())
+    for chunk_start in range(max(0, start), stop, chunk_size):
+        yield graph.edge_range(chunk_start, min(chunk_start + chunk_size, stop))
+
+
+def _json_pairs(src: np.ndarray, tgt: np.ndarray, sep: str) -> str:
+    """'[s0,t0]<sep>[s1,t1]...'"""
+    return sep.join([f'[{s},{t}]' for s, t in zip(src.tolist(), tgt.tolist())])
+
+
+def encode_edges(
+    graph: CsrGraph, fmt: str, start: int = 0, stop: int = None, chunk_size: int = EDGE_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """Yield encoded edges start..stop-1, one piece per chunk, so memory stays flat regardless of range size"""
+    chunks = iter_edge_chunks(graph, start, stop, chunk_size)
+    if fmt == 'json':
+        yield b'['
+        for i, (src, tgt) in enumerate(chunks):
+            yield ((',' if i else '') + _json_pairs(src, tgt, ',')).encode()
+        yield b']'
+    elif fmt == 'ndjson':
+        for src, tgt in chunks:
+            yield (_json_pairs(src, tgt, '\n') + '\n').encode()
+    elif fmt == 'int32':
+        for src, tgt in chunks:
+            pairs = np.empty((len(src), 2), dtype='<i4')
+            pairs[:, 0], pairs[:, 1] = src, tgt
+            yield pairs.tobytes()
+    elif fmt == 'arrow':
+        import pyarrow as pa  # only needed for this format, and slow to import
+        schema = pa.schema([('source', pa.int32()), ('target', pa.int32())])
+        yield schema.serialize().to_pybytes()
+        for src, tgt in chunks:
+            batch = pa.record_batch([pa.array(src.astype(np.int32)), pa.array(tgt.astype(np.int32))], schema=schema)
+            yield batch.serialize().to_pybytes()
+        yield b'\xff\xff\xff\xff\x00\x00\x00\x00'  # end-of-stream marker
+    else:
+        raise ValueError(f'Unknown edge format: {fmt}. Options: {", ".join(MEDIA_TYPES)}')
+
+
+def encode_columnar_json(payload: Dict[str, Any]) -> bytes:
+    """JSON-encode payload with orjson, which writes NumPy arrays directly, so edges can be passed as parallel source &
+    target arrays rather than lists of tuples. Sets are written as sorted lists; int dict keys as strings."""
+    def default(obj):
+        if isinstance(obj, (set, frozenset)):
+            return sorted(obj)
+        raise TypeError
+    return orjson.dumps(payload, default=default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def encode_arrow_edges(src: np.ndarray, tgt: np.ndarray, metadata: Dict[str, Any]) -> bytes:
+    """Arrow IPC stream of one record batch with int32 columns source & target. Everything else in the response goes in
+    the schema metadata, under ARROW_METADATA_KEY, as columnar JSON."""
+    import pyarrow as pa  # only needed for this format, and slow to import
+    schema = pa.schema(
+        [('source', pa.int32()), ('target', pa.int32())], metadata={ARROW_METADATA_KEY: encode_columnar_json(metadata)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(pa.record_batch(
+            [pa.array(src.astype(np.int32, copy=False)), pa.array(tgt.astype(np.int32, copy=False))], schema=schema))
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,169 @@
+"""Layered (Sugiyama-style) layout of concept subgraphs, in NumPy, no external binaries
+
+Stages, each vectorized a layer at a time:
+1. Layering: each node goes on the layer of its longest path from a root, so parents are always above children. Edges
+   on a cycle, which the OMOP hierarchy shouldn't have, are turned around first.
+2. Edges spanning more than one layer are split by dummy nodes, one per layer crossed, so the next stages only deal with
+   edges between adjacent layers.
+3. Ordering within layers, to reduce edge crossings: sweeps down and up, sorting each layer by the barycenter of its
+   neighbors' positions in the layer before.
+4. x coordinates: nodes move toward the mean x of their neighbors, keeping their order and at least 1 unit apart.
+
+The result has x and y, the layer, for each concept in the subgraph. Dummy nodes aren't returned.
+"""
+import hashlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from backend.graph.csr import CsrSubgraph, csr_from_pairs, edge_keys, gather_neighbors
+
+ORDER_SWEEPS = 4
+PLACEMENT_ITERATIONS = 4
+
+
+def layout_key(sg: CsrSubgraph) -> str:
+    """Hash of the subgraph's nodes and edge set, independent of their order"""
+    src, tgt = sg.edge_arrays()
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.sort(sg.graph.node_ids[sg.node_rows].astype(np.int64)).tobytes())
+    digest.update(np.sort(edge_keys(src, tgt)).tobytes())
+    return digest.hexdigest()
+
+
+def assign_layers(n: int, src: np.ndarray, tgt: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Longest-path layer of each node, via Kahn's algorithm a layer at a time
+
+    :return: (layers, src, tgt), where edges that were on a cycle have been turned around, so that every edge goes
+      from a lower to a higher layer"""
+    for attempt in range(2):
+        layer = np.full(n, -1, dtype=np.int64)
+        indptr, indices = csr_from_pairs(src, tgt, n)
+        in_degree = np.bincount(tgt, minlength=n)
+        frontier = np.flatnonzero(in_degree == 0)
+        depth = 0
+        while len(frontier):
+            layer[frontier] = depth
+            _, children = gather_neighbors(indptr, indices, frontier)
+            children, counts = np.unique(children, return_counts=True)
+            in_degree[children] -= counts
+            frontier = children[in_degree[children] == 0]
+            depth += 1
+        if (layer >= 0).all() or attempt:
+            break
+        # Cycles: among nodes left without a layer, point every edge from the lower index to the higher, which can't
+        #  loop, then try again. Self-loops are dropped.
+        flip = (layer[src] < 0) & (layer[tgt] < 0) & (src > tgt)
+        src, tgt = np.where(flip, tgt, src), np.where(flip, src, tgt)
+        keep = src != tgt
+        src, tgt = src[keep], tgt[keep]
+    return layer, src, tgt
+
+
+def split_long_edges(
+    layer: np.ndarray, src: np.ndarray, tgt: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Add a dummy node for each layer an edge crosses
+
+    :return: (layer of every node, real then dummy; segment sources; segment targets), each segment joining adjacent
+      layers"""
+    n = len(layer)
+    span = layer[tgt] - layer[src]
+    lens = span + 1  # nodes along each edge's chain, ends included
+    ends = np.cumsum(lens)
+    starts = ends - lens
+    total = int(ends[-1]) if len(ends) else 0
+    is_dummy = np.ones(total, dtype=bool)
+    is_dummy[starts] = False
+    is_dummy[ends - 1] = False
+    chain = np.empty(total, dtype=np.int64)
+    chain[starts], chain[ends - 1] = src, tgt
+    chain[is_dummy] = n + np.arange(int(is_dummy.sum()))
+    chain_layer = np.repeat(layer[src] - starts, lens) + np.arange(total)
+    all_layers = np.concatenate([layer, chain_layer[is_dummy]])
+    joins = np.ones(max(total - 1, 0), dtype=bool)
+    joins[starts[1:] - 1] = False  # no segment from one edge's chain to the next's
+    return all_layers, chain[:-1][joins], chain[1:][joins]
+
+
+def _by_layer(layer: np.ndarray, keys: np.ndarray, n_layers: int) -> List[np.ndarray]:
+    """Indices of keys, grouped by layer[keys]"""
+    order = np.argsort(layer[keys], kind='stable')
+    bounds = np.searchsorted(layer[keys][order], np.arange(n_layers + 1))
+    return [order[bounds[i]:bounds[i + 1]] for i in range(n_layers)]
+
+
+def order_layers(
+    layer: np.ndarray, seg_src: np.ndarray, seg_tgt: np.ndarray, sweeps: int = ORDER_SWEEPS
+) -> np.ndarray:
+    """Position of each node within its layer, by barycenter sweeps
+
+    :return: pos, where pos[node] is the node's rank within its layer"""
+    n_layers = int(layer.max(initial=-1)) + 1
+    members = _by_layer(layer, np.arange(len(layer)), n_layers)  # initially in input order
+    pos = np.empty(len(layer), dtype=np.float64)
+    for nodes in members:
+        pos[nodes] = np.arange(len(nodes))
+    into = _by_layer(layer, seg_tgt, n_layers)  # segments coming into each layer, from the one above
+    out_of = _by_layer(layer, seg_src, n_layers)  # segments leaving each layer, to the one below
+    loc = np.empty(len(layer), dtype=np.int64)  # index of node within its members array
+    for nodes in members:
+        loc[nodes] = np.arange(len(nodes))
+
+    def reorder(nodes: np.ndarray, this_side: np.ndarray, other_side: np.ndarray):
+        counts = np.bincount(loc[this_side], minlength=len(nodes))
+        sums = np.bincount(loc[this_side], weights=pos[other_side], minlength=len(nodes))
+        bary = np.where(counts > 0, sums / np.maximum(counts, 1), pos[nodes])
+        pos[nodes[np.argsort(bary, kind='stable')]] = np.arange(len(nodes))
+
+    for _ in range(sweeps):
+        for i in range(1, n_layers):
+            segs = into[i]
+            reorder(members[i], seg_tgt[segs], seg_src[segs])
+        for i in range(n_layers - 2, -1, -1):
+            segs = out_of[i]
+            reorder(members[i], seg_src[segs], seg_tgt[segs])
+    return pos
+
+
+def place_x(
+    layer: np.ndarray, pos: np.ndarray, seg_src: np.ndarray, seg_tgt: np.ndarray,
+    iterations: int = PLACEMENT_ITERATIONS,
+) -> np.ndarray:
+    """x coordinate of each node: the mean x of its neighbors, as near as the layer's order and a min gap of 1 allow"""
+    n_layers = int(layer.max(initial=-1)) + 1
+    x = pos.copy()
+    counts = np.bincount(seg_src, minlength=len(x)) + np.bincount(seg_tgt, minlength=len(x))
+    # each layer's nodes, left to right
+    rows = [nodes[np.argsort(pos[nodes], kind='stable')] for nodes in _by_layer(layer, np.arange(len(x)), n_layers)]
+    for _ in range(iterations):
+        sums = np.bincount(seg_src, weights=x[seg_tgt], minlength=len(x)) + \
+            np.bincount(seg_tgt, weights=x[seg_src], minlength=len(x))
+        desired = np.where(counts > 0, sums / np.maximum(counts, 1), x)
+        for nodes in rows:
+            offset = desired[nodes] - np.arange(len(nodes))
+            # closest order-preserving placement pushing right, and pushing left; their average keeps the gaps
+            right = np.maximum.accumulate(offset)
+            left = np.minimum.accumulate(offset[::-1])[::-1]
+            x[nodes] = (right + left) / 2 + np.arange(len(nodes))
+    return x - x.min() if len(x) else x
+
+
+def layered_layout(sg: CsrSubgraph) -> Dict[str, np.ndarray]:
+    """Layered layout of the subgraph
+
+    :return: {'concept_ids', 'x', 'y'}, parallel arrays, one entry per node, in the subgraph's node order. y is the
+      layer, 0 at the top."""
+    node_rows = sg.node_rows
+    node_ids = sg.graph.node_ids[node_rows]
+    n = len(node_rows)
+    # subgraph rows -> 0..n-1
+    sorter = np.argsort(node_rows, kind='stable')
+    src = sorter[np.searchsorted(node_rows, sg.src_rows, sorter=sorter)].astype(np.int64)
+    tgt = sorter[np.searchsorted(node_rows, sg.tgt_rows, sorter=sorter)].astype(np.int64)
+
+    layer, src, tgt = assign_layers(n, src, tgt)
+    all_layers, seg_src, seg_tgt = split_long_edges(layer, src, tgt)
+    pos = order_layers(all_layers, seg_src, seg_tgt)
+    x = place_x(all_layers, pos, seg_src, seg_tgt)
+    return {'concept_ids': node_ids, 'x': np.round(x[:n], 2), 'y': layer.astype(np.int32)}
@@ -0,0 +1,135 @@
+"""Lowest common ancestors and connecting paths for sets of concepts, using the ReachabilityIndex
+
+In a DAG a set of nodes can have several lowest common ancestors (LCAs): the common ancestors that have no other common
+ancestor below them. Ancestry here is ancestor-or-self, so the LCA of a single node, or of a node and its descendant, is
+that node.
+
+The index's pre-order intervals play the role the Euler tour plays for tree LCA: a candidate whose tree interval
+covers the min and max pre of the whole set is a common ancestor without looking at any member, and one whose reach
+interval doesn't cover them is ruled out the same way. Only the remaining, multi-parent cases need pairwise checks.
+"""
+from typing import Tuple
+
+import numpy as np
+
+from backend.graph.csr import NodeIds, ROW_DTYPE, gather_neighbors
+from backend.graph.reachability import ReachabilityIndex
+
+
+def _is_ancestor_or_self(index: ReachabilityIndex, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise: is row a[i] row b[i] or an ancestor of it?"""
+    return (a == b) | index.are_ancestors_rows(a, b)
+
+
+def _is_common_ancestor(index: ReachabilityIndex, candidate: int, rows: np.ndarray, first_chunk=16) -> bool:
+    """Is candidate an ancestor-or-self of every one of rows? Checked in growing chunks, since most candidates that
+    aren't fail on the first few."""
+    start, chunk = 0, first_chunk
+    while start < len(rows):
+        b = rows[start:start + chunk]
+        if not _is_ancestor_or_self(index, np.full(len(b), candidate), b).all():
+            return False
+        start, chunk = start + chunk, chunk * 4
+    return True
+
+
+def lowest_common_ancestor_rows(index: ReachabilityIndex, rows: np.ndarray) -> np.ndarray:
+    """Rows of the lowest common ancestors of rows, which must all be in the graph. Empty if they have none.
+
+    Candidates are the ancestors-or-self of one member, visited lowest first. A candidate above an LCA already found
+    is a common ancestor but not a lowest one, so it is skipped; any other candidate that is a common ancestor is an
+    LCA."""
+    rows = np.unique(np.asarray(rows, dtype=np.int64))
+    if not len(rows):
+        return np.empty(0, dtype=ROW_DTYPE)
+    if not index.acyclic:  # no levels to order candidates by; check them all, then keep the lowest
+        candidates = np.r_[rows[0], index.ancestor_rows(rows[:1])].astype(np.int64)
+        common = candidates[[_is_common_ancestor(index, c, rows) for c in candidates.tolist()]]
+        a, b = np.repeat(common, len(common)), np.tile(common, len(common))
+        above_another = index.are_ancestors_rows(a, b).reshape(len(common), len(common)).any(axis=1)
+        return common[~above_another].astype(ROW_DTYPE)
+
+    # Every common ancestor is an ancestor-or-self of any one member; start from the one w/ the fewest ancestors
+    seed = rows[np.argmin(index.level[rows])]
+    candidates = np.r_[seed, index.ancestor_rows(np.array([seed]))].astype(np.int64)
+    candidates = candidates[np.argsort(-index.level[candidates], kind='stable')]
+    # Interval tests against the whole set at once: [pre_min, pre_max] spans every member
+    pre = index.pre[rows]
+    pre_min, pre_max = int(pre.min()), int(pre.max())
+    c_pre = index.pre[candidates].astype(np.int64)
+    covers_all = (c_pre <= pre_min) & (pre_max < c_pre + index.size[candidates])
+    may_cover = (index.lo[candidates] <= pre_min) & (pre_max <= index.hi[candidates])
+
+    lcas = []
+    for c, sure, maybe in zip(candidates.tolist(), covers_all.tolist(), may_cover.tolist()):
+        if not maybe:
+            continue
+        if lcas and index.are_ancestors_rows(np.full(len(lcas), c), np.array(lcas)).any():
+            continue
+        if sure or _is_common_ancestor(index, c, rows):
+            lcas.append(c)
+    return np.array(lcas, dtype=ROW_DTYPE)
+
+
+def connecting_edge_rows(
+    index: ReachabilityIndex, sources: np.ndarray, targets: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Edges, as (source rows, target rows), of a shortest path to each target from the nearest of sources.
+
+    Paths are taken from a single breadth-first search from all of sources, restricted to ancestors-or-self of the
+    targets. They form a forest, so paths to targets that share ancestors share edges."""
+    graph = index.graph
+    targets = np.unique(np.asarray(targets, dtype=np.int64))
+    sources = np.unique(np.asarray(sources, dtype=np.int64))
+    n = len(graph)
+    between = np.zeros(n, dtype=bool)
+    between[targets] = True
+    between[index.ancestor_rows(targets)] = True
+
+    # BFS down from sources, remembering the first parent each node is reached from
+    parent = np.full(n, -1, dtype=np.int64)
+    reached = np.zeros(n, dtype=bool)
+    reached[sources] = True
+    frontier = sources
+    while len(frontier):
+        src, nbrs = gather_neighbors(graph.succ_indptr, graph.succ_indices, frontier)
+        keep = between[nbrs] & ~reached[nbrs]
+        src, nbrs = src[keep], nbrs[keep]
+        nbrs, first = np.unique(nbrs, return_index=True)
+        parent[nbrs] = src[first]
+        reached[nbrs] = True
+        frontier = nbrs
+
+    # Trace back from each target, all at once
+    edge_src, edge_tgt = [], []
+    on_path = np.zeros(n, dtype=bool)
+    cur = targets[parent[targets] >= 0]
+    while len(cur):
+        cur = cur[~on_path[cur]]
+        on_path[cur] = True
+        edge_src.append(parent[cur])
+        edge_tgt.append(cur)
+        cur = parent[cur]
+        cur = np.unique(cur[parent[cur] >= 0])
+    if not edge_src:
+        return np.empty(0, dtype=ROW_DTYPE), np.empty(0, dtype=ROW_DTYPE)
+    return np.concatenate(edge_src).astype(ROW_DTYPE), np.concatenate(edge_tgt).astype(ROW_DTYPE)
+
+
+def lowest_common_ancestors(index: ReachabilityIndex, nodes: NodeIds) -> np.ndarray:
+    """concept_ids of the lowest common ancestors of nodes that are in the graph, sorted"""
+    rows = index.graph.rows_of(nodes)
+    return np.sort(index.graph.node_ids[lowest_common_ancestor_rows(index, rows[rows >= 0])])
+
+
+def connect_roots(index: ReachabilityIndex, nodes: NodeIds) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Connect nodes to their lowest common ancestors
+
+    :return: (lowest common ancestor ids, edge source ids, edge target ids). The edges connect each node in the graph to
+      the nearest of the lowest common ancestors."""
+    graph = index.graph
+    rows = graph.rows_of(nodes)
+    rows = rows[rows >= 0]
+    lca_rows = lowest_common_ancestor_rows(index, rows)
+    src, tgt = connecting_edge_rows(index, lca_rows, rows)
+    return np.sort(graph.node_ids[lca_rows]), graph.node_ids[src], graph.node_ids[tgt]
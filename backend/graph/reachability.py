@@ -0,0 +1,256 @@
+"""Reachability index over a CsrGraph: ancestor / descendant queries without walking the graph or hitting Postgres
+
+Interval labelling over a spanning tree, with a fallback for the DAG's multi-parent nodes:
+- level: longest-path depth from a root. Parents are always at a lower level than their children.
+- tree: each non-root node keeps one parent at level - 1 as its tree parent. The tree is numbered in pre-order, so the
+  tree descendants of u are exactly the nodes whose pre is in [pre[u], pre[u] + size[u]).
+- reach interval [lo, hi]: the min / max pre over all of u's descendants in the DAG, not just in the tree.
+
+"Is a an ancestor of b" then is:
+- yes, if b is in a's tree interval (the common case)
+- no, if b is outside a's reach interval, or level[a] >= level[b]
+- otherwise, a DFS from a that prunes every branch whose reach interval or level rules out b
+
+Descendant sets are gathered a tree interval at a time, so only non-tree edges need to be followed.
+
+The arrays are stored as aux arrays on the graph, so they are written to, and memory-mapped from, graph snapshots.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+from backend.graph.csr import CsrGraph, NodeIds, ROW_DTYPE, INDPTR_DTYPE, gather_neighbors
+
+AUX_PREFIX = 'reach_'
+INDEX_ARRAYS = ['level', 'tree_parent', 'pre', 'size', 'lo', 'hi', 'by_pre', 'nt_indptr', 'nt_indices']
+
+
+def _ranges(starts: np.ndarray, lens: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(start, start + len) for each start, len"""
+    total = int(lens.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    run_starts = np.cumsum(lens) - lens
+    return np.repeat(starts.astype(np.int64) - run_starts, lens) + np.arange(total, dtype=np.int64)
+
+
+def _bfs(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray, n: int) -> np.ndarray:
+    """Rows reachable from rows in 1 or more steps, one frontier at a time"""
+    seen = np.zeros(n, dtype=bool)
+    reached: List[np.ndarray] = []
+    frontier = np.unique(rows)
+    while len(frontier):
+        _, nbrs = gather_neighbors(indptr, indices, frontier)
+        nbrs = np.unique(nbrs)
+        frontier = nbrs[~seen[nbrs]]
+        seen[frontier] = True
+        reached.append(frontier)
+    return np.concatenate(reached) if reached else np.empty(0, dtype=ROW_DTYPE)
+
+
+def compute_levels(graph: CsrGraph) -> np.ndarray:
+    """Longest-path depth of each row from a root, via Kahn's algorithm a whole level at a time. -1 for rows on or
+    below a cycle."""
+    n = len(graph)
+    level = np.full(n, -1, dtype=ROW_DTYPE)
+    in_degree = np.diff(graph.pred_indptr).astype(np.int64)
+    frontier = np.flatnonzero(in_degree == 0)
+    depth = 0
+    while len(frontier):
+        level[frontier] = depth
+        _, children = gather_neighbors(graph.succ_indptr, graph.succ_indices, frontier)
+        children, counts = np.unique(children, return_counts=True)
+        in_degree[children] -= counts
+        frontier = children[in_degree[children] == 0]
+        depth += 1
+    return level
+
+
+class ReachabilityIndex:
+    """Answers "is a an ancestor of b", "descendants of S" and "ancestors of S" for a CsrGraph
+
+    Ancestry is strict: a node is not its own ancestor. If the graph has a cycle, which the OMOP hierarchy should not,
+    the index is not built, and queries fall back to breadth-first search."""
+
+    def __init__(self, graph: CsrGraph, arrays: Dict[str, np.ndarray]):
+        """Wrap prebuilt index arrays. Use reachability_index() to get or build the index for a graph."""
+        self.graph = graph
+        self.acyclic = all(arrays.get(name) is not None for name in INDEX_ARRAYS)
+        for name in INDEX_ARRAYS:
+            setattr(self, name, arrays.get(name))
+
+    # Construction -----------------------------------------------------------------------------------------------------
+    @classmethod
+    def build(cls, graph: CsrGraph) -> 'ReachabilityIndex':
+        """Compute the index. Vectorized a level at a time, so the number of Python-level steps is the graph's depth."""
+        n = len(graph)
+        level = compute_levels(graph)
+        if (level < 0).any():
+            return cls(graph, {'level': level})
+        by_level = np.argsort(level, kind='stable')
+        level_starts = np.searchsorted(level[by_level], np.arange(int(level.max(initial=-1)) + 2))
+        levels: List[np.ndarray] = [by_level[level_starts[i]:level_starts[i + 1]] for i in range(len(level_starts) - 1)]
+
+        # Tree parent: first parent, in insertion order, that is exactly one level up
+        pred_lens = np.diff(graph.pred_indptr)
+        child_rows = np.repeat(np.arange(n, dtype=ROW_DTYPE), pred_lens)
+        one_up = level[graph.pred_indices] == level[child_rows] - 1
+        children, first = np.unique(child_rows[one_up], return_index=True)
+        tree_parent = np.full(n, -1, dtype=ROW_DTYPE)
+        tree_parent[children] = graph.pred_indices[one_up][first]
+
+        # Tree subtree sizes, bottom-up
+        size = np.ones(n, dtype=np.int64)
+        for rows in reversed(levels[1:]):
+            np.add.at(size, tree_parent[rows], size[rows])
+
+        # Pre-order numbers, top-down. Siblings, and roots, are ordered by row.
+        offset = np.zeros(n, dtype=np.int64)  # position among siblings: total size of earlier siblings
+        order = np.lexsort((np.arange(n), tree_parent))
+        sizes = size[order]
+        before = np.cumsum(sizes) - sizes
+        group_starts = np.flatnonzero(np.r_[True, tree_parent[order][1:] != tree_parent[order][:-1]])
+        offset[order] = before - np.repeat(before[group_starts], np.diff(np.r_[group_starts, n]))
+        pre = np.zeros(n, dtype=np.int64)
+        pre[levels[0]] = offset[levels[0]]
+        for rows in levels[1:]:
+            pre[rows] = pre[tree_parent[rows]] + 1 + offset[rows]
+        by_pre = np.empty(n, dtype=ROW_DTYPE)
+        by_pre[pre] = np.arange(n, dtype=ROW_DTYPE)
+
+        # Reach intervals, bottom-up: children's intervals are final before their parents are visited
+        lo = pre.copy()
+        hi = pre + size - 1
+        for rows in reversed(levels):
+            rows = rows[np.diff(graph.succ_indptr)[rows] > 0]
+            if not len(rows):
+                continue
+            _, nbrs = gather_neighbors(graph.succ_indptr, graph.succ_indices, rows)
+            lens = (graph.succ_indptr[rows + 1] - graph.succ_indptr[rows])
+            run_starts = np.cumsum(lens) - lens
+            lo[rows] = np.minimum(lo[rows], np.minimum.reduceat(lo[nbrs], run_starts))
+            hi[rows] = np.maximum(hi[rows], np.maximum.reduceat(hi[nbrs], run_starts))
+
+        # Non-tree edges, CSR, for gathering descendants beyond a tree interval
+        src_rows = np.repeat(np.arange(n, dtype=ROW_DTYPE), np.diff(graph.succ_indptr))
+        non_tree = tree_parent[graph.succ_indices] != src_rows
+        nt_indptr = np.zeros(n + 1, dtype=INDPTR_DTYPE)
+        np.cumsum(np.bincount(src_rows[non_tree], minlength=n), out=nt_indptr[1:])
+        nt_indices = graph.succ_indices[non_tree].astype(ROW_DTYPE, copy=False)
+
+        return cls(graph, {
+            'level': level, 'tree_parent': tree_parent, 'pre': pre.astype(ROW_DTYPE), 'size': size.astype(ROW_DTYPE),
+            'lo': lo.astype(ROW_DTYPE), 'hi': hi.astype(ROW_DTYPE), 'by_pre': by_pre, 'nt_indptr': nt_indptr,
+            'nt_indices': nt_indices})
+
+    def aux_arrays(self) -> Dict[str, np.ndarray]:
+        """Index arrays, named for storing as CsrGraph.aux. Just the levels if the graph has a cycle."""
+        return {AUX_PREFIX + name: getattr(self, name) for name in INDEX_ARRAYS if getattr(self, name) is not None}
+
+    # Queries ----------------------------------------------------------------------------------------------------------
+    def _in_tree(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Is row b a strict tree descendant of row a?"""
+        pre_a = self.pre[a].astype(np.int64)
+        return (pre_a < self.pre[b]) & (self.pre[b] < pre_a + self.size[a])
+
+    def _search(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """For pairs of rows the labels can't decide: walk up from each b[i] towards a[i], all pairs at once.
+
+        Only parents that could still be descendants of a[i] are followed: ones inside a[i]'s reach interval and below
+        its level. The walk stops for a pair as soon as it enters a[i]'s tree interval."""
+        found = np.zeros(len(a), dtype=bool)
+        pairs = np.arange(len(a), dtype=np.int64)
+        rows = b.astype(np.int64)
+        while len(pairs):
+            starts = self.graph.pred_indptr[rows]
+            lens = self.graph.pred_indptr[rows + 1] - starts
+            pair_idx = np.repeat(pairs, lens)
+            parents = self.graph.pred_indices[_ranges(starts, lens)].astype(np.int64)
+            a_p = a[pair_idx]
+            hit = (parents == a_p) | self._in_tree(a_p, parents)
+            found[pair_idx[hit]] = True
+            pre_p = self.pre[parents]
+            viable = ~found[pair_idx] & (self.lo[a_p] <= pre_p) & (pre_p <= self.hi[a_p]) & \
+                (self.level[a_p] < self.level[parents])
+            keys = np.unique((pair_idx[viable] << 32) | parents[viable])
+            pairs, rows = keys >> 32, keys & 0xFFFFFFFF
+        return found
+
+    def are_ancestors_rows(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """For each pair of rows (a[i], b[i]), is a[i] a strict ancestor of b[i]? Rows of -1 (not in graph) give False."""
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        result = np.zeros(len(a), dtype=bool)
+        valid = (a >= 0) & (b >= 0) & (a != b)
+        if not self.acyclic:
+            for i in np.flatnonzero(valid).tolist():
+                result[i] = bool(np.isin(b[i], _bfs(
+                    self.graph.succ_indptr, self.graph.succ_indices, a[i:i + 1], len(self.graph))))
+            return result
+        a_v, b_v = a[valid], b[valid]
+        in_tree = self._in_tree(a_v, b_v)
+        pre_b = self.pre[b_v]
+        undecided = ~in_tree & (self.lo[a_v] <= pre_b) & (pre_b <= self.hi[a_v]) & (self.level[a_v] < self.level[b_v])
+        answer = in_tree
+        answer[undecided] = self._search(a_v[undecided], b_v[undecided])
+        result[valid] = answer
+        return result
+
+    def are_ancestors(self, ancestors: NodeIds, descendants: NodeIds) -> np.ndarray:
+        """For each pair of concept_ids, is ancestors[i] a strict ancestor of descendants[i]?"""
+        return self.are_ancestors_rows(self.graph.rows_of(ancestors), self.graph.rows_of(descendants))
+
+    def is_ancestor(self, ancestor: int, descendant: int) -> bool:
+        """Is ancestor a strict ancestor of descendant?"""
+        return bool(self.are_ancestors([ancestor], [descendant])[0])
+
+    def descendant_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Rows of all strict descendants of any of rows, unordered"""
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows >= 0]
+        succ_indptr, succ_indices = self.graph.succ_indptr, self.graph.succ_indices
+        if not self.acyclic:
+            return _bfs(succ_indptr, succ_indices, rows, len(self.graph))
+        seen = np.zeros(len(self.graph), dtype=bool)
+        reached: List[np.ndarray] = []
+        # Descendants-or-self of the children. Each round takes whole tree intervals, then follows non-tree edges out.
+        _, roots = gather_neighbors(succ_indptr, succ_indices, np.unique(rows))
+        while len(roots):
+            roots = np.unique(roots)
+            roots = roots[~seen[roots]]
+            if not len(roots):
+                break
+            # Drop roots inside another root's tree interval, so the intervals taken are disjoint
+            roots = roots[np.argsort(self.pre[roots], kind='stable')]
+            ends = self.pre[roots].astype(np.int64) + self.size[roots]
+            covered = np.r_[False, self.pre[roots][1:] < np.maximum.accumulate(ends)[:-1]]
+            roots = roots[~covered]
+            got = self.by_pre[_ranges(self.pre[roots], self.size[roots])]
+            got = got[~seen[got]]
+            seen[got] = True
+            reached.append(got)
+            _, roots = gather_neighbors(self.nt_indptr, self.nt_indices, got)
+        return np.concatenate(reached) if reached else np.empty(0, dtype=ROW_DTYPE)
+
+    def ancestor_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Rows of all strict ancestors of any of rows, unordered. Ancestor sets are small, so this is just a BFS."""
+        rows = np.asarray(rows, dtype=np.int64)
+        return _bfs(self.graph.pred_indptr, self.graph.pred_indices, rows[rows >= 0], len(self.graph))
+
+    def descendants(self, nodes: NodeIds) -> np.ndarray:
+        """concept_ids of all strict descendants of any of nodes, sorted"""
+        return np.sort(self.graph.node_ids[self.descendant_rows(self.graph.rows_of(nodes))])
+
+    def ancestors(self, nodes: NodeIds) -> np.ndarray:
+        """concept_ids of all strict ancestors of any of nodes, sorted"""
+        return np.sort(self.graph.node_ids[self.ancestor_rows(self.graph.rows_of(nodes))])
+
+
+def reachability_index(graph: CsrGraph) -> ReachabilityIndex:
+    """Get the graph's reachability index, building it and adding it to graph.aux if it doesn't have one yet"""
+    arrays = {name: graph.aux.get(AUX_PREFIX + name) for name in INDEX_ARRAYS}
+    if arrays['level'] is not None:
+        return ReachabilityIndex(graph, arrays)
+    index = ReachabilityIndex.build(graph)
+    graph.aux.update(index.aux_arrays())
+    return index
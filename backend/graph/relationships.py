@@ -0,0 +1,176 @@
+"""Typed concept relationships, in memory
+
+concept_relationship edges for a fixed set of relationship_ids (STORED_RELATIONSHIPS), so that mapping and similarity
+lookups, e.g. 'Maps to', 'Mapped from', 'Concept replaced by', for thousands of concepts at once are a few array
+operations rather than a query. Each edge's relationship_id is stored as a small int code, an index into
+RelationshipStore.relationship_ids.
+
+Built along with the hierarchy graph, and stored in its snapshot as aux arrays; see relationship_store().
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from backend.graph.csr import CsrGraph, ID_DTYPE, NodeIds, ids_to_array
+from backend.graph.reachability import _ranges
+
+AUX_PREFIX = 'rel_'
+STORE_ARRAYS = ['src', 'tgt', 'type', 'tgt_order', 'tgt_sorted', 'names']
+TYPE_DTYPE = np.uint8
+# What get_similar_concepts() looks up, by its `which` param
+SIMILAR_RELATIONSHIPS: Dict[str, List[str]] = {
+    # all similar for possible replacement suggestions for codeset comparisons
+    'all': [
+        'Maps to',
+        'Maps to value',
+        'Mapped from',
+        'Mapped from value',
+        'Concept alt_to from',
+        'Concept alt_to to',
+        'Concept poss_eq from',
+        'Concept poss_eq to',
+        'Concept replaced by',
+        'Concept replaces',
+        'Concept same_as from',
+        'Concept same_as to',
+        'Concept was_a from',
+        'Concept was_a to'
+    ],
+    'to': [  # what OHDSI includeMapped usually does, I think
+        'Maps to',
+        'Maps to value',
+    ],
+    'from': [  # what OHDSI includeMapped should do, I think
+        'Mapped from',
+        'Mapped from value',
+    ],
+}
+STORED_RELATIONSHIPS: List[str] = SIMILAR_RELATIONSHIPS['all'] + ['Subsumes']
+
+
+class RelationshipStore:
+    """Typed edges (concept_id_1, concept_id_2, relationship_id), sorted by concept_id_1, with a second ordering by
+    concept_id_2 for reverse lookups. No duplicate edges."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        """Wrap store arrays, as made by from_edges() or loaded from a snapshot"""
+        self.src: np.ndarray = arrays['src']
+        self.tgt: np.ndarray = arrays['tgt']
+        self.type: np.ndarray = arrays['type']
+        self.tgt_order: np.ndarray = arrays['tgt_order']
+        self.tgt_sorted: np.ndarray = arrays['tgt_sorted']
+        self.names: np.ndarray = arrays['names']  # relationship_ids, utf-8, newline separated
+        names = bytes(self.names).decode('utf-8')
+        self.relationship_ids: List[str] = names.split('\n') if names else []
+        self.codes: Dict[str, int] = {rel: code for code, rel in enumerate(self.relationship_ids)}
+
+    @classmethod
+    def from_edges(
+        cls, concept_id_1: NodeIds, concept_id_2: NodeIds, codes: Iterable[int], relationship_ids: List[str]
+    ) -> 'RelationshipStore':
+        """Build from edges
+
+        :param codes: Each edge's relationship, as an index into relationship_ids"""
+        src, tgt = ids_to_array(concept_id_1), ids_to_array(concept_id_2)
+        names = sorted(set(relationship_ids))
+        if len(names) > np.iinfo(TYPE_DTYPE).max + 1:
+            raise ValueError(f'Too many relationship_ids to store: {len(names)}')
+        # recode so codes follow alphabetical order of relationship_id
+        recode = np.array([names.index(rel) for rel in relationship_ids], dtype=TYPE_DTYPE)
+        codes = codes.astype(np.int64) if isinstance(codes, np.ndarray) else np.fromiter(codes, dtype=np.int64)
+        types = recode[codes]
+        order = np.lexsort((types, tgt, src))
+        src, tgt, types = src[order], tgt[order], types[order]
+        if len(src):
+            new = np.ones(len(src), dtype=bool)
+            new[1:] = (src[1:] != src[:-1]) | (tgt[1:] != tgt[:-1]) | (types[1:] != types[:-1])
+            src, tgt, types = src[new], tgt[new], types[new]
+        tgt_order = np.argsort(tgt, kind='stable').astype(np.int64)
+        return cls({
+            'src': src.astype(ID_DTYPE), 'tgt': tgt.astype(ID_DTYPE), 'type': types,
+            'tgt_order': tgt_order, 'tgt_sorted': tgt[tgt_order].astype(ID_DTYPE),
+            'names': np.frombuffer('\n'.join(names).encode('utf-8'), dtype=np.uint8).copy()})
+
+    def __len__(self) -> int:
+        return len(self.src)
+
+    def aux_arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays to store with the graph, under AUX_PREFIX"""
+        return {AUX_PREFIX + name: getattr(self, name) for name in STORE_ARRAYS}
+
+    def nbytes(self) -> int:
+        """Memory used by the arrays"""
+        return sum(getattr(self, name).nbytes for name in STORE_ARRAYS)
+
+    def _type_mask(self, relationship_ids: Optional[Iterable[str]]) -> Optional[np.ndarray]:
+        """Lookup table: allowed[code] is True for codes of relationship_ids, which needn't all be stored. None for
+        any relationship."""
+        if relationship_ids is None:
+            return None
+        allowed = np.zeros(max(len(self.relationship_ids), 1), dtype=bool)
+        allowed[[self.codes[rel] for rel in relationship_ids if rel in self.codes]] = True
+        return allowed
+
+    @staticmethod
+    def _matching(keys: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Positions in sorted keys equal to any of ids"""
+        ids = np.unique(ids.astype(keys.dtype, copy=False)) if len(ids) else ids
+        starts = np.searchsorted(keys, ids, side='left')
+        return _ranges(starts, np.searchsorted(keys, ids, side='right') - starts)
+
+    def edge_indices(
+        self, concept_ids: NodeIds, relationship_ids: Optional[Iterable[str]] = None, direction: str = 'out',
+        exclude_self=False,
+    ) -> np.ndarray:
+        """Indices of edges involving concept_ids, sorted
+
+        :param relationship_ids: Only edges of these relationships. Default: any.
+        :param direction: 'out': concept_ids are concept_id_1; 'in': concept_id_2; 'both': either.
+        :param exclude_self: Leave out edges from a concept to itself."""
+        ids = ids_to_array(concept_ids)
+        ids = ids[(ids >= np.iinfo(ID_DTYPE).min) & (ids <= np.iinfo(ID_DTYPE).max)]
+        if direction not in ('out', 'in', 'both'):
+            raise ValueError(f'Unknown direction: {direction}. Options: out, in, both')
+        idx = self._matching(self.src, ids) if direction != 'in' else np.empty(0, dtype=np.int64)
+        if direction != 'out':
+            idx = np.union1d(idx, self.tgt_order[self._matching(self.tgt_sorted, ids)])
+        allowed = self._type_mask(relationship_ids)
+        if allowed is not None:
+            idx = idx[allowed[self.type[idx]]]
+        if exclude_self:
+            idx = idx[self.src[idx] != self.tgt[idx]]
+        return idx
+
+    def edges(
+        self, concept_ids: NodeIds, relationship_ids: Optional[Iterable[str]] = None, direction: str = 'out',
+        exclude_self=False,
+    ) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """Edges involving concept_ids, see edge_indices(), sorted by concept_id_1, concept_id_2, relationship_id
+
+        :return: (concept_id_1 array, concept_id_2 array, relationship_id list)"""
+        idx = self.edge_indices(concept_ids, relationship_ids, direction, exclude_self)
+        names = self.relationship_ids
+        return self.src[idx], self.tgt[idx], [names[code] for code in self.type[idx].tolist()]
+
+
+def relationship_store(graph: CsrGraph) -> Optional[RelationshipStore]:
+    """The graph's relationship store, if it was built with one"""
+    arrays = {name: graph.aux.get(AUX_PREFIX + name) for name in STORE_ARRAYS}
+    if arrays['src'] is None:
+        return None
+    return RelationshipStore(arrays)
+
+
+_current_store: Optional[RelationshipStore] = None
+
+
+def set_current_relationship_store(store: Optional[RelationshipStore]):
+    """Serve lookups from store, e.g. when a new graph is swapped in"""
+    global _current_store
+    _current_store = store
+
+
+def current_relationship_store() -> Optional[RelationshipStore]:
+    """The store that lookups are served from, or None if no graph with one is loaded in this process, in which case
+    callers query the database instead"""
+    return _current_store
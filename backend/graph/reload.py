@@ -0,0 +1,70 @@
+"""Background hot-reload of the relationship graph after a vocabulary refresh"""
+import threading
+import warnings
+from typing import Callable, Optional
+
+from backend.graph.csr import CsrGraph
+
+
+class GraphReloader:
+    """Polls for a new vocab version and, when there is one, loads the new graph in a background thread and swaps it in.
+
+    Swapping is a single reference assignment, so requests that already grabbed the old graph finish on it, and new
+    requests get the new one. Nothing on the request path waits for the rebuild."""
+
+    def __init__(
+        self, get_latest_version: Callable[[], Optional[str]], get_current_version: Callable[[], Optional[str]],
+        load: Callable[[], CsrGraph], swap: Callable[[CsrGraph], None], interval_seconds: float = 300,
+    ):
+        """Set up reloader. Call start() to begin polling.
+
+        :param get_latest_version: Returns the version of the vocab currently in the database.
+        :param get_current_version: Returns the version of the graph currently being served.
+        :param load: Loads or builds the graph for the latest version.
+        :param swap: Makes the newly loaded graph the one being served."""
+        self.get_latest_version = get_latest_version
+        self.get_current_version = get_current_version
+        self.load = load
+        self.swap = swap
+        self.interval_seconds = interval_seconds
+        self.n_reloads = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        """Reload if the graph being served is outdated.
+
+        :return: True if a new graph was swapped in."""
+        with self._lock:
+            latest = self.get_latest_version()
+            if latest == self.get_current_version():
+                return False
+            print(f'Relationship graph is outdated; loading graph for version {latest}')
+            graph: CsrGraph = self.load()
+            self.swap(graph)
+            self.n_reloads += 1
+            return True
+
+    def _run(self):
+        """Poll until stopped"""
+        while not self._stop.wait(self.interval_seconds):
+            # noinspection PyBroadException
+            try:
+                self.check()
+            except Exception as err:  # keep serving the current graph; try again next interval
+                warnings.warn(f'Relationship graph reload failed: {err}')
+
+    def start(self):
+        """Start polling in a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='rel-graph-reloader', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Stop polling"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
@@ -0,0 +1,129 @@
+"""Usage counts rolled up over the hierarchy: per concept, the total records in its subtree, and how many descendants
+it has
+
+Computed in one pass over the reachability index's spanning tree (see reachability.py): the tree is numbered in
+pre-order, so a concept's subtree is a contiguous range of pre-order positions, and its total is a difference of two
+prefix sums. Every descendant is counted once, so there's no double counting where the hierarchy has diamonds.
+
+The tree keeps one parent per concept, so for a concept with descendants outside its tree subtree, i.e. reached via some
+descendant's other parent, the tree sums only cover its tree subtree. exact says which concepts that doesn't apply to:
+those whose reach interval is just their tree interval. The others are summed over their distinct descendants, from the
+reachability index, when first looked up.
+
+The arrays are stored as aux arrays on the graph, along with the counts version they were computed from, and are
+recomputed when counts are refreshed.
+"""
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from backend.graph.csr import CsrGraph, NodeIds, ids_to_array
+from backend.graph.reachability import ReachabilityIndex, reachability_index
+
+AUX_PREFIX = 'rollup_'
+ROLLUP_ARRAYS = ['total_cnt', 'descendant_cnt', 'exact', 'cnt']
+COUNTS_VERSION_KEY = 'counts_version'
+
+
+def compute_rollups(graph: CsrGraph, concept_ids: NodeIds, total_cnts: np.ndarray) -> Dict[str, np.ndarray]:
+    """Rollups for every node in graph
+
+    :param concept_ids: Concepts with counts. Ones not in the graph are ignored; nodes without counts count as 0.
+    :param total_cnts: Record count of each of concept_ids
+    :return: Arrays by row: total_cnt, records in the node's tree subtree, itself included; descendant_cnt, number of
+      descendants in it; exact, whether the tree subtree is all of the node's descendants; cnt, the node's own
+      records."""
+    n = len(graph)
+    counts = np.zeros(n, dtype=np.int64)
+    rows = graph.rows_of(concept_ids)
+    counts[rows[rows >= 0]] = np.asarray(total_cnts, dtype=np.int64)[rows >= 0]
+    index = reachability_index(graph)
+    if not index.acyclic:  # no spanning tree to sum over; just each node's own count
+        return {
+            'total_cnt': counts, 'descendant_cnt': np.zeros(n, dtype=np.int64), 'exact': np.zeros(n, dtype=bool),
+            'cnt': counts}
+    prefix = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts[index.by_pre], out=prefix[1:])
+    end = index.pre + index.size
+    return {
+        'total_cnt': prefix[end] - prefix[index.pre],
+        'descendant_cnt': index.size - 1,
+        'exact': (index.lo == index.pre) & (index.hi == end - 1),
+        'cnt': counts}
+
+
+def add_rollups(graph: CsrGraph, concept_ids: NodeIds, total_cnts: np.ndarray, counts_version: Optional[str]):
+    """Compute rollups and add them to graph.aux, recording counts_version in graph.meta"""
+    rollups = compute_rollups(graph, concept_ids, total_cnts)
+    graph.aux.update({AUX_PREFIX + name: arr for name, arr in rollups.items()})
+    graph.meta[COUNTS_VERSION_KEY] = counts_version
+
+
+class SubtreeRollups:
+    """Lookups of a graph's rollups by concept_id"""
+
+    def __init__(self, graph: CsrGraph):
+        """Wrap the rollup aux arrays of graph. Use subtree_rollups() to check it has them."""
+        self.graph = graph
+        self.counts_version: Optional[str] = graph.meta.get(COUNTS_VERSION_KEY)
+        for name in ROLLUP_ARRAYS:
+            setattr(self, name, graph.aux[AUX_PREFIX + name])
+        self._index: Optional[ReachabilityIndex] = None
+        # (total_cnt, descendant_cnt) by row, for rows whose tree sums aren't exact, summed so far
+        self._dag_rollups: Dict[int, Tuple[int, int]] = {}
+
+    def _dag_rollup(self, row: int) -> Tuple[int, int]:
+        """(total_cnt, descendant_cnt) of a row, over its distinct descendants"""
+        rollup = self._dag_rollups.get(row)
+        if rollup is None:
+            if self._index is None:
+                self._index = reachability_index(self.graph)
+            descendant_rows = self._index.descendant_rows(np.array([row]))
+            descendant_rows = descendant_rows[descendant_rows != row]  # on a cycle
+            rollup = int(self.cnt[row] + self.cnt[descendant_rows].sum()), len(descendant_rows)
+            self._dag_rollups[row] = rollup
+        return rollup
+
+    def lookup(self, concept_ids: NodeIds) -> Dict[str, np.ndarray]:
+        """Rollups of concept_ids, for the ones in the graph
+
+        :return: {concept_ids, total_cnt, descendant_cnt}, parallel arrays"""
+        ids = ids_to_array(concept_ids)
+        rows = self.graph.rows_of(ids)
+        found = rows >= 0
+        rows = rows[found]
+        total_cnt, descendant_cnt = self.total_cnt[rows], self.descendant_cnt[rows]
+        inexact = np.flatnonzero(~self.exact[rows])
+        if len(inexact):
+            total_cnt, descendant_cnt = total_cnt.copy(), descendant_cnt.copy()
+            for i in inexact.tolist():
+                total_cnt[i], descendant_cnt[i] = self._dag_rollup(int(rows[i]))
+        return {'concept_ids': ids[found], 'total_cnt': total_cnt, 'descendant_cnt': descendant_cnt}
+
+    def by_concept(self, concept_ids: NodeIds) -> Dict[int, Dict[str, int]]:
+        """lookup(), as {concept_id: {subtree_total_cnt, descendant_cnt}}"""
+        found = self.lookup(concept_ids)
+        return {
+            cid: {'subtree_total_cnt': total, 'descendant_cnt': n_desc}
+            for cid, total, n_desc in zip(*[found[k].tolist() for k in ('concept_ids', 'total_cnt', 'descendant_cnt')])}
+
+
+def subtree_rollups(graph: CsrGraph) -> Optional[SubtreeRollups]:
+    """The graph's rollups, if they've been computed, w/ all of ROLLUP_ARRAYS"""
+    if any(AUX_PREFIX + name not in graph.aux for name in ROLLUP_ARRAYS):
+        return None
+    return SubtreeRollups(graph)
+
+
+_current_rollups: Optional[SubtreeRollups] = None
+
+
+def set_current_rollups(rollups: Optional[SubtreeRollups]):
+    """Serve lookups from rollups, e.g. when a new graph is swapped in"""
+    global _current_rollups
+    _current_rollups = rollups
+
+
+def current_rollups() -> Optional[SubtreeRollups]:
+    """The rollups that lookups are served from, or None if no graph with them is loaded in this process"""
+    return _current_rollups
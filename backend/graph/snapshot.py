@@ -0,0 +1,130 @@
+"""Versioned, memory-mappable on-disk snapshot of a CsrGraph
+
+File layout (little-endian):
+- 8 bytes: MAGIC
+- 4 bytes: uint32 format version
+- 4 bytes: uint32 length of the JSON header
+- JSON header: vocab_version, built_at, counts, and {name: [dtype, offset, length]} for each array
+- arrays, each starting on an ALIGN-byte boundary; offsets are relative to the end of the padded header. The CSR_ARRAYS
+  come first, followed by any of the graph's aux arrays, e.g. indexes.
+
+Every worker process maps the same file read-only, so the arrays live once in the OS page cache rather than once per
+process, and opening a snapshot only costs reading the header.
+"""
+import json
+import os
+import struct
+from datetime import datetime, timezone
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+from backend.graph.csr import CsrGraph
+
+MAGIC = b'THGRAPH\x00'
+SNAPSHOT_FORMAT_VERSION = 1
+ALIGN = 64
+PREAMBLE = struct.Struct('<II')  # format version, header length
+CSR_ARRAYS = ['node_ids', 'succ_indptr', 'succ_indices', 'pred_indptr', 'pred_indices', 'sorted_ids', 'sorted_rows']
+
+
+class SnapshotFormatError(ValueError):
+    """File is not a graph snapshot, or was written in a different format version"""
+
+
+def _pad(n: int) -> int:
+    """Bytes needed to pad n up to the next ALIGN boundary"""
+    return -n % ALIGN
+
+
+def is_snapshot(path: str) -> bool:
+    """Does the file at path start like a graph snapshot?"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_snapshot(
+    graph: CsrGraph, path: str, vocab_version: str = None, built_at: str = None, extra: Dict[str, Any] = None
+) -> Dict[str, Any]:
+    """Write graph to path. Written to a temp file first and then renamed, so readers never see a partial file.
+
+    :param vocab_version: Identifies the vocabulary the graph was built from, e.g. 'last_refreshed_vocab_tables'.
+    :param extra: Any additional JSON-serializable metadata to store in the header.
+    :return: The header that was written."""
+    arrays: Dict[str, np.ndarray] = {name: np.ascontiguousarray(getattr(graph, name)) for name in CSR_ARRAYS}
+    for name, arr in graph.aux.items():
+        if name in arrays:
+            raise ValueError(f'aux array name clashes with a graph array: {name}')
+        arrays[name] = np.ascontiguousarray(arr)
+    layout: Dict[str, list] = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = [arr.dtype.newbyteorder('<').str, offset, len(arr)]
+        offset += arr.nbytes + _pad(arr.nbytes)
+    header = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'vocab_version': vocab_version,
+        'built_at': built_at or datetime.now(timezone.utc).isoformat(),
+        'n_nodes': graph.number_of_nodes(),
+        'n_edges': graph.number_of_edges(),
+        'arrays': layout,
+        **(extra or {}),
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    preamble_len = len(MAGIC) + PREAMBLE.size + len(header_bytes)
+
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(PREAMBLE.pack(SNAPSHOT_FORMAT_VERSION, len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b'\x00' * _pad(preamble_len))
+            for arr in arrays.values():
+                f.write(arr.astype(arr.dtype.newbyteorder('<'), copy=False).tobytes())
+                f.write(b'\x00' * _pad(arr.nbytes))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return header
+
+
+def _read_preamble(f) -> Tuple[Dict[str, Any], int]:
+    """Read & validate the header. Returns header and offset at which array data begins."""
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise SnapshotFormatError(f'Not a graph snapshot: {getattr(f, "name", f)}')
+    format_version, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+    if format_version != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotFormatError(
+            f'Graph snapshot format version {format_version} is not supported (expected {SNAPSHOT_FORMAT_VERSION}).')
+    header = json.loads(f.read(header_len).decode('utf-8'))
+    preamble_len = len(MAGIC) + PREAMBLE.size + header_len
+    return header, preamble_len + _pad(preamble_len)
+
+
+def read_snapshot_header(path: str) -> Dict[str, Any]:
+    """Read just the header of a snapshot"""
+    with open(path, 'rb') as f:
+        return _read_preamble(f)[0]
+
+
+def load_snapshot(path: str) -> CsrGraph:
+    """Memory-map a snapshot read-only and return it as a CsrGraph. The header is available as graph.meta, and any
+    arrays besides the CSR_ARRAYS as graph.aux."""
+    with open(path, 'rb') as f:
+        header, data_start = _read_preamble(f)
+    buf = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays: Dict[str, np.ndarray] = {}
+    for name, (dtype, offset, length) in header['arrays'].items():
+        dtype = np.dtype(dtype)
+        start = data_start + offset
+        arrays[name] = buf[start:start + length * dtype.itemsize].view(dtype)
+    aux = {name: arr for name, arr in arrays.items() if name not in CSR_ARRAYS}
+    return CsrGraph(**{name: arrays[name] for name in CSR_ARRAYS}, meta=header, aux=aux)
@@ -7,20 +7,26 @@ import json
 import urllib.parse
 from datetime import datetime
 from functools import cache, lru_cache
-from typing import Dict, List, Union, Set, Optional
+from typing import Any, Dict, Iterator, List, Union, Set, Optional
 
+import numpy as np
 import pandas as pd
-from fastapi import APIRouter, Query, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
-from psycopg2 import sql
 from sqlalchemy import Connection, Row, text
 from sqlalchemy.engine import RowMapping
+from sqlalchemy.sql.elements import TextClause
 from starlette.responses import Response
 
 from backend.api_logger import Api_logger, get_ip_from_request, API_CALL_LOGGING_ON
-from backend.db.queries import get_concepts
-from backend.db.utils import get_db_connection, sql_query, SCHEMA, sql_query_single_col, sql_in, sql_in_safe, run_sql
-from backend.utils import return_err_with_trace, commify, recs2dicts, call_github_action
+from backend.db.async_utils import get_db_connection_async, sql_query_async, sql_query_single_col_async
+from backend.db.queries import get_concepts, get_concepts_async
+from backend.db.query_stats import QUERY_STATS, QUERY_STATS_ROUTES
+from backend.db.utils import get_db_connection, sql_query, SCHEMA, sql_query_single_col, sql_in_safe, run_sql, \
+    sql_query_prepared, sql_query_stream
+from backend.graph.relationships import SIMILAR_RELATIONSHIPS, RelationshipStore, current_relationship_store
+from backend.graph.rollup import current_rollups
+from backend.utils import return_err_with_trace, commify, recs2dicts, call_github_action, json_streaming_response
 from enclave_wrangler.config import RESEARCHER_COLS
 from enclave_wrangler.models import convert_rows
 from enclave_wrangler.objects_api import get_n3c_recommended_csets, get_codeset_json, get_bundle_codeset_ids, \
@@ -51,15 +57,28 @@ router = APIRouter(
 #       probably don't need precision etc.
 #       switched _container suffix on duplicate col names to container_ prefix
 #       joined OMOPConceptSet in the all_csets ddl to get `rid`
+GET_CSETS_QUERY = """
+              SELECT *
+              FROM all_csets
+              WHERE codeset_id = ANY(:codeset_ids);"""
+
+
 def get_csets(codeset_ids: List[int]) -> List[Dict]:
     """Get information about concept sets the user has selected"""
     with get_db_connection() as con:
-        rows: List = sql_query(
-            con, """
-              SELECT *
-              FROM all_csets
-              WHERE codeset_id = ANY(:codeset_ids);""",
-            {'codeset_ids': codeset_ids})
+        rows: List = sql_query(con, GET_CSETS_QUERY, {'codeset_ids': codeset_ids})
+    return csets_with_researchers(rows)
+
+
+async def get_csets_async(codeset_ids: List[int]) -> List[Dict]:
+    """get_csets(), without blocking the event loop"""
+    async with get_db_connection_async() as con:
+        rows: List = await sql_query_async(con, GET_CSETS_QUERY, {'codeset_ids': codeset_ids})
+    return csets_with_researchers(rows)
+
+
+def csets_with_researchers(rows: List[RowMapping]) -> List[Dict]:
+    """all_csets rows as dicts, w/ a researchers dict added to each"""
     row_dicts: List[Dict] = [dict(x) for x in rows]
     for row in row_dicts:
         row['researchers'] = get_row_researcher_ids_dict(row)
@@ -112,6 +131,23 @@ def get_all_researcher_ids(rows: List[Dict]) -> Set[str]:
     return set([r[c] for r in rows for c in RESEARCHER_COLS if r[c]])
 
 
+def cset_members_items_query(
+    columns: Union[List[str], None] = None, column: Union[str, None] = None
+) -> TextClause:
+    """Query for get_cset_members_items(), w/ a :codeset_ids param"""
+    if column and columns:
+        raise ValueError('Cannot specify both columns and column')
+    if column:
+        columns = [column]
+    if columns:
+        # Quoted like psycopg2's sql.Identifier, which needs a psycopg2 connection, and so doesn't do for asyncpg
+        select = 'SELECT DISTINCT ' + ', '.join(['"' + col.replace('"', '""') + '"' for col in columns]) + \
+            ' FROM cset_members_items'
+    else:
+        select = "SELECT * FROM cset_members_items"
+    return text(select + " WHERE codeset_id = ANY(:codeset_ids)")
+
+
 def get_cset_members_items(
     codeset_ids: Union[List[int], None] = None,
     columns: Union[List[str], None] = None,
@@ -124,27 +160,9 @@ def get_cset_members_items(
         item: True if its an expression item, else false
         csm: false if not in concept set members
     """
-    if column and columns:
-        raise ValueError('Cannot specify both columns and column')
-
+    query = cset_members_items_query(columns, column)
+    params = {'codeset_ids': codeset_ids or []}
     with (get_db_connection() as con):
-        where = f" WHERE codeset_id = ANY(:codeset_ids)"
-        params = {'codeset_ids': codeset_ids or []}
-
-        if column:
-            columns = [column]
-
-        if columns:
-            select = sql.SQL("SELECT DISTINCT {}" + " FROM cset_members_items").format(
-                sql.SQL(', ').join(map(sql.Identifier, columns)),
-                sql.SQL(', ').join(sql.Placeholder() * len(columns)))
-            # noinspection PyUnresolvedReferences false_positive
-            select = select.as_string(con.connection.connection)
-        else:
-            select = "SELECT * FROM cset_members_items"
-
-        query = text(select + where)
-
         if column:  # with single column, don't return List[Dict] but just List(<column>)
             res: List = sql_query_single_col(con, query, params)
         else:
@@ -153,6 +171,37 @@ def get_cset_members_items(
     return res
 
 
+async def get_cset_members_items_async(
+    codeset_ids: Union[List[int], None] = None,
+    columns: Union[List[str], None] = None,
+    column: Union[str, None] = None,
+    return_with_keys: bool = True,
+) -> Union[List[int], List]:
+    """get_cset_members_items(), without blocking the event loop"""
+    query = cset_members_items_query(columns, column)
+    params = {'codeset_ids': codeset_ids or []}
+    async with get_db_connection_async() as con:
+        if column:
+            return await sql_query_single_col_async(con, query, params)
+        return await sql_query_async(con, query, params, return_with_keys=return_with_keys)
+
+
+def stream_cset_members_items(
+    codeset_ids: Union[List[int], None] = None,
+    columns: Union[List[str], None] = None,
+    column: Union[str, None] = None,
+    return_with_keys: bool = True,
+) -> Iterator[List]:
+    """get_cset_members_items(), in batches of rows, fetched as they're needed. For huge csets."""
+    query = cset_members_items_query(columns, column)
+    params = {'codeset_ids': codeset_ids or []}
+    if column:
+        for batch in sql_query_stream(query, params, batches=True, return_with_keys=False):
+            yield [row[0] for row in batch]
+    else:
+        yield from sql_query_stream(query, params, batches=True, return_with_keys=return_with_keys)
+
+
 @router.get("/get-cset-members-items")
 async def _get_cset_members_items(
     request: Request,
@@ -160,14 +209,23 @@ async def _get_cset_members_items(
     columns: Union[List[str], None] = Query(default=None),
     column: Union[str, None] = Query(default=None),
     return_with_keys: bool = True,
+    stream: bool = False,
     # extra_concept_ids: Union[int, None] = Query(default=None)
-):  # -> Union[List[int], List]
+):  # -> Union[List[int], List, StreamingResponse]
+    """Get concept set members items for selected concept sets
+
+    :param stream: If True, rows are sent as they're fetched, rather than all at once. For huge csets."""
     requested_codeset_ids = parse_codeset_ids(codeset_ids)
     rpt = Api_logger()
     await rpt.start_rpt(request, params={'codeset_ids': requested_codeset_ids})
 
     try:
-        rows = get_cset_members_items(requested_codeset_ids, columns, column, return_with_keys)
+        if stream:
+            response = json_streaming_response(
+                stream_cset_members_items(requested_codeset_ids, columns, column, return_with_keys))
+            await rpt.finish()  # n rows not known until sent
+            return response
+        rows = await get_cset_members_items_async(requested_codeset_ids, columns, column, return_with_keys)
         await rpt.finish(rows=len(rows))
     except Exception as e:
         await rpt.log_error(e)
@@ -176,20 +234,52 @@ async def _get_cset_members_items(
 
 
 def get_concept_relationships(cids: List[int], reltypes: List[str] = ['Subsumes'], con: Connection = None) -> List:
-    """Get concept_relationship rows for cids """
+    """Get concept_relationship rows for cids
+
+    Served from the in-memory relationship store when the graph is loaded and it has all of reltypes."""
+    store = current_relationship_store()
+    if store is not None and all(rel in store.codes for rel in reltypes):
+        return _concept_relationships_from_store(store, cids, reltypes, con)
     conn = con if con else get_db_connection()
-    result = sql_query(
-        conn, f"""
+    result = sql_query_prepared(
+        conn, """
         SELECT DISTINCT *
         FROM concept_relationship_plus
-        WHERE (concept_id_1 {sql_in(cids)} OR concept_id_2 {sql_in(cids)})
-          AND relationship_id {sql_in(reltypes, quote_items=True)}
-        """, debug=True)
+        WHERE (concept_id_1 = ANY(:cids) OR concept_id_2 = ANY(:cids))
+          AND relationship_id = ANY(:reltypes)
+        """, {'cids': list(cids), 'reltypes': list(reltypes)})
     if not con:
         conn.close()
     return result
 
 
+def _concept_relationships_from_store(
+    store: RelationshipStore, cids: List[int], reltypes: List[str], con: Connection = None
+) -> List[Dict]:
+    """get_concept_relationships() rows, w/ the same columns as concept_relationship_plus, for edges from the store"""
+    concept_id_1, concept_id_2, relationship_ids = store.edges(cids, reltypes, direction='both')
+    conn = con if con else get_db_connection()
+    concepts = sql_query(conn, """
+        SELECT concept_id, vocabulary_id, standard_concept, concept_name, concept_code, total_cnt
+        FROM concepts_with_counts
+        WHERE concept_id = ANY(:concept_ids)
+    """, {'concept_ids': np.union1d(concept_id_1, concept_id_2).tolist()})
+    if not con:
+        conn.close()
+    concepts_by_id = {c['concept_id']: c for c in concepts}
+    rows = []
+    for cid1, cid2, rel in zip(concept_id_1.tolist(), concept_id_2.tolist(), relationship_ids):
+        c1, c2 = concepts_by_id.get(cid1), concepts_by_id.get(cid2)
+        if c1 is None or c2 is None:  # concept_relationship_plus only has concepts in concepts_with_counts
+            continue
+        rows.append({
+            'vocabulary_id_1': c1['vocabulary_id'], 'sc1': c1['standard_concept'], 'concept_id_1': cid1,
+            'concept_name_1': c1['concept_name'], 'concept_code': c1['concept_code'], 'relationship_id': rel,
+            'vocabulary_id_2': c2['vocabulary_id'], 'sc2': c2['standard_concept'], 'concept_id_2': cid2,
+            'concept_name_2': c2['concept_name'], 'total_cnt_1': c1['total_cnt']})
+    return rows
+
+
 def get_all_csets(con: Connection = None) -> Union[Dict, List]:
     """Get all concept sets"""
     conn = con if con else get_db_connection()
@@ -243,13 +333,21 @@ def omop_id_from_concept_name(name):
 # todo: style: 'id' matches built-in name 'id'
 @router.get("/concepts")
 @return_err_with_trace
-async def get_concepts_route(request: Request, id: List[str] = Query(...), table:str='concepts_with_counts') -> List:
-    """expect list of concept_ids. using 'id' for brevity"""
+async def get_concepts_route(
+    request: Request, id: List[str] = Query(...), table:str='concepts_with_counts', rollups: bool = False
+) -> List:
+    """expect list of concept_ids. using 'id' for brevity
+
+    :param rollups: If true, add subtree_total_cnt and descendant_cnt to each concept in the hierarchy
+      graph. See backend/graph/rollup.py."""
     rpt = Api_logger()
     await rpt.start_rpt(request, params={'concept_ids': id})
 
     try:
-        rows = get_concepts(concept_ids=id, table=table)
+        rows = await get_concepts_async(concept_ids=id, table=table)
+        if rollups and (graph_rollups := current_rollups()):
+            by_concept = graph_rollups.by_concept([row['concept_id'] for row in rows])
+            rows = [{**row, **by_concept.get(row['concept_id'], {})} for row in rows]
         await rpt.finish(rows=len(rows))
     except Exception as e:
         await rpt.log_error(e)
@@ -259,10 +357,10 @@ async def get_concepts_route(request: Request, id: List[str] = Query(...), table
 
 @router.post("/concepts")
 async def get_concepts_post_route(
-    request: Request, id: Union[List[str], None] = None, table: str = 'concepts_with_counts'
+    request: Request, id: Union[List[str], None] = None, table: str = 'concepts_with_counts', rollups: bool = False
 ) -> List:
     """Route for get_concepts() via POST"""
-    return await get_concepts_route(request, id=id, table=table)
+    return await get_concepts_route(request, id=id, table=table, rollups=rollups)
 
 
 @lru_cache(maxsize=20)  # probably not helpful, caching at front end anyway
@@ -287,8 +385,8 @@ async def _concept_search(search_str: str, sort_by: str = "-total_cnt|vocabulary
       WHERE concept_name ILIKE :search_str
       ORDER BY {', '.join(sort_cols)} DESC
     """
-    with get_db_connection() as con:
-        concept_ids = sql_query_single_col(con, q, { "search_str": '%' + search_str + '%', })
+    async with get_db_connection_async() as con:
+        concept_ids = await sql_query_single_col_async(con, q, { "search_str": '%' + search_str + '%', })
     return concept_ids
 
 @router.get("/api-call-logging-on")
@@ -354,7 +452,7 @@ async def _get_csets(
     await rpt.start_rpt(request, params={'codeset_ids': requested_codeset_ids})
 
     try:
-        csets = get_csets(requested_codeset_ids)
+        csets = await get_csets_async(requested_codeset_ids)
         await rpt.finish(rows=len(csets))
     except Exception as e:
         await rpt.log_error(e)
@@ -553,7 +651,7 @@ todo: possibly drop return typing, or figure out how to get it correct.
  =None. Read more: https://fastapi.tiangolo.com/tutorial/response-model/
 """
     codeset_ids = get_bundle_codeset_ids(bundle)
-    q = f"""
+    q = """
             SELECT
                   ac.is_most_recent_version,
                   ac.codeset_id, ac.concept_set_name, ac.alias,
@@ -567,12 +665,12 @@ todo: possibly drop return typing, or figure out how to get it correct.
             FROM all_csets ac
             JOIN code_sets cs ON ac.concept_set_name = cs.concept_set_name
             JOIN researcher r ON ac.codeset_created_by = r."multipassId"
-            WHERE ac.codeset_id {sql_in(codeset_ids)}
+            WHERE ac.codeset_id = ANY(:codeset_ids)
             GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
             ORDER BY 1, 6, 5, 4
     """
     with get_db_connection() as con:
-        rows = sql_query(con, q)
+        rows = sql_query_prepared(con, q, {'codeset_ids': list(codeset_ids)})
     if as_json:
         return rows
     else:
@@ -628,36 +726,44 @@ def get_similar_concepts(concept_ids: List[Union[int, str]], which: str = 'all'
      Args:
         concept_ids: List of concept IDs (can be integers or strings)
         which: Relationship type filter ('all', 'to', or 'from')
+
+    Relationships come from the in-memory relationship store when the graph is loaded, else from the database.
     """
     concept_ids = [int(cid) for cid in concept_ids]
-    if which == 'all':  # all similar for possible replacement suggestions for codeset comparisons
-        rels = [
-            'Maps to',
-            'Maps to value',
-            'Mapped from',
-            'Mapped from value',
-            'Concept alt_to from',
-            'Concept alt_to to',
-            'Concept poss_eq from',
-            'Concept poss_eq to',
-            'Concept replaced by',
-            'Concept replaces',
-            'Concept same_as from',
-            'Concept same_as to',
-            'Concept was_a from',
-            'Concept was_a to'
-        ]
-    elif which == 'to': # what OHDSI includeMapped usually does, I think
-        rels = [
-            'Maps to',
-            'Maps to value',
-        ]
-    elif which == 'from': # what OHDSI includeMapped should do, I think
-        rels = [
-            'Mapped from',
-            'Mapped from value',
-        ]
+    rels = SIMILAR_RELATIONSHIPS[which]
+
+    store = current_relationship_store()
+    if store is None:
+        return _get_similar_concepts_from_db(concept_ids, rels)
 
+    source_ids, related_ids, relationship_ids = store.edges(concept_ids, rels, exclude_self=True)
+    with get_db_connection() as con:
+        concepts = sql_query(con, """
+            SELECT concept_id, concept_name, vocabulary_id, concept_class_id, standard_concept
+            FROM concepts_with_counts
+            WHERE concept_id = ANY(:concept_ids)
+        """, {'concept_ids': np.unique(related_ids).tolist()})
+    concepts_by_id = {c['concept_id']: c for c in concepts}
+
+    # Organize results by source concept. Edges come sorted by source, related concept & relationship_id, so each
+    #  (source, related concept) pair is one run, its rels already sorted.
+    replacements_by_concept = {}
+    prev = None
+    for source_id, concept_id, rel in zip(source_ids.tolist(), related_ids.tolist(), relationship_ids):
+        concept = concepts_by_id.get(concept_id)
+        if concept is None:  # not in concepts_with_counts
+            continue
+        if (source_id, concept_id) != prev:
+            prev = (source_id, concept_id)
+            replacement = {**concept, 'rels': []}
+            replacements_by_concept.setdefault(source_id, []).append(replacement)
+        replacement['rels'].append(rel)
+
+    return replacements_by_concept
+
+
+def _get_similar_concepts_from_db(concept_ids: List[int], rels: List[str]) -> Dict:
+    """get_similar_concepts(), querying concept_relationship"""
     with get_db_connection() as con:
         q = """
             SELECT 
@@ -808,31 +914,62 @@ def check_token() -> Dict:
 
 
 # todo: can / should we replace this query with selecting from `apijoin` table instead?
+USAGE_QUERY = """SELECT * FROM public.apijoin"""
+# SELECT DISTINCT r.*, array_sort(g.api_calls) api_calls, g.duration_seconds, g.group_start_time,
+#     date_bin('1 week', timestamp::TIMESTAMP, TIMESTAMP '2023-10-30')::date week,
+#     timestamp::date date
+# FROM public.api_runs r
+# LEFT JOIN public.apiruns_grouped g ON g.api_call_group_id = r.api_call_group_id
+# WHERE g.api_call_group_id != -1 AND g.api_call_group_id IS NOT NULL;
+# -- WHERE g.api_call_group_id = -1 or g.api_call_group_id IS NULL;
+
+
 def usage_query(verbose=True) -> List[Dict]:
-    """Query for usage data
+    """Query for usage data: USAGE_QUERY's rows, as dicts
 
     Filters out problematic api_call_group_id where the call group is amibiguous (-1 or NULL)"""
     t0 = datetime.now()
     with get_db_connection() as con:
-        data: List[RowMapping] = sql_query(con, """SELECT * FROM public.apijoin""")
-            # SELECT DISTINCT r.*, array_sort(g.api_calls) api_calls, g.duration_seconds, g.group_start_time,
-            #     date_bin('1 week', timestamp::TIMESTAMP, TIMESTAMP '2023-10-30')::date week,
-            #     timestamp::date date
-            # FROM public.api_runs r
-            # LEFT JOIN public.apiruns_grouped g ON g.api_call_group_id = r.api_call_group_id
-            # WHERE g.api_call_group_id != -1 AND g.api_call_group_id IS NOT NULL;
-            # -- WHERE g.api_call_group_id = -1 or g.api_call_group_id IS NULL;
-            # """)
+        data: List[RowMapping] = sql_query(con, USAGE_QUERY)
     data: List[Dict] = [dict(x) for x in data]
     if verbose:
         print(f'usage_query(): Fetched {len(data)} records in n seconds: {(datetime.now() - t0).seconds}')
     return data
 
 
+def query_stats_routes_enabled():
+    """Dependency of the /query-stats routes: 404 unless TERMHUB_QUERY_STATS_ROUTES is set. See QUERY_STATS_ROUTES."""
+    if not QUERY_STATS_ROUTES:
+        raise HTTPException(status_code=404, detail='Not Found')
+
+
+@router.get("/query-stats", dependencies=[Depends(query_stats_routes_enabled)])
+def query_stats(top: int = 50, sort_by: str = 'total_seconds') -> Dict[str, Any]:
+    """Timings, row counts and sizes of this worker's SQL statements, by fingerprint, and its recent slow queries.
+    Statements are normalized, w/ literals replaced by '?'; params aren't included: they're only in the slow query log.
+
+    :param sort_by: Any numeric field of the stats, e.g. total_seconds, p95_ms, est_calls, mean_bytes"""
+    sortable = {'sampled_calls', 'est_calls', 'total_seconds', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms',
+                'mean_rows', 'mean_bytes'}
+    if sort_by not in sortable:
+        raise HTTPException(status_code=400, detail=f'sort_by must be one of: {", ".join(sorted(sortable))}')
+    return QUERY_STATS.snapshot(top, sort_by)
+
+
+@router.post("/query-stats/reset", dependencies=[Depends(query_stats_routes_enabled)])
+def query_stats_reset() -> Dict[str, Any]:
+    """Clear this worker's query stats and slow queries, returning them as they were. See /query-stats."""
+    stats: Dict[str, Any] = QUERY_STATS.snapshot()
+    QUERY_STATS.clear()
+    return stats
+
+
 @router.get("/usage")
-def usage():  # -> JSON_TYPE
-    """Usage report: Get all data from our monitoring."""
-    return usage_query()
+def usage():  # -> StreamingResponse
+    """Usage report: Get all data from our monitoring.
+
+    usage_query()'s rows, sent as they're fetched, a batch at a time, rather than all at once."""
+    return json_streaming_response(sql_query_stream(USAGE_QUERY, batches=True))
 
 
 if __name__ == '__main__':
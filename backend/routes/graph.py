@@ -1,97 +1,387 @@
 """Graph related functions and routes"""
 import os, warnings
 import dateutil.parser as dp
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Iterable, List, Set, Tuple, Union, Dict, Optional
+from typing import Any, Iterable, List, Literal, Set, Tuple, Union, Dict, Optional
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 import pickle
-import networkx as nx
-from fastapi import APIRouter, Query, Request
+import numpy as np
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from networkx import DiGraph
+from pydantic import BaseModel
 from sqlalchemy import Row, RowMapping
 from sqlalchemy.sql import text
 
-from backend.routes.db import get_cset_members_items
-from backend.db.queries import get_concepts
+from backend.cache import MISSING, LruTtlCache
+from backend.routes.db import get_cset_members_items, get_cset_members_items_async
+from backend.db.async_utils import check_db_status_var_async
+from backend.db.queries import get_concepts_async
 from backend.db.utils import check_db_status_var, get_db_connection, SCHEMA
+from backend.graph.condense import CondensedSubgraph, condense_super_nodes, expand_super_node
+from backend.graph.csr import CsrGraph, CsrSubgraph
+from backend.graph.diff import diff_graphs, filter_diff, read_diff, write_diff
+from backend.graph.export import EDGE_CHUNK_SIZE, MEDIA_TYPES as EDGE_MEDIA_TYPES, encode_arrow_edges, \
+    encode_columnar_json, encode_edges
+from backend.graph.layout import layered_layout, layout_key
+from backend.graph.lca import connect_roots
+from backend.graph.reachability import AUX_PREFIX as REACHABILITY_AUX_PREFIX, reachability_index
+from backend.graph.relationships import AUX_PREFIX as RELATIONSHIP_AUX_PREFIX, STORED_RELATIONSHIPS, \
+    RelationshipStore, relationship_store, set_current_relationship_store
+from backend.graph.reload import GraphReloader
+from backend.graph.rollup import COUNTS_VERSION_KEY, add_rollups, set_current_rollups, subtree_rollups
+from backend.graph.snapshot import SnapshotFormatError, is_snapshot, load_snapshot, read_snapshot_header, \
+    write_snapshot
 from backend.api_logger import Api_logger
 from backend.utils import get_timer, commify
 
 VERBOSE = False
 PROJECT_DIR = Path(os.path.dirname(__file__)).parent.parent
 VOCABS_PATH = os.path.join(PROJECT_DIR, 'termhub-vocab')
-GRAPH_PATH = os.path.join(VOCABS_PATH, 'relationship_graph.pickle')
-GRAPH_UNDIRECTED_PATH = os.path.join(VOCABS_PATH, 'relationship_graph_undirected.pickle')
+GRAPH_PATH = os.path.join(VOCABS_PATH, 'relationship_graph.csr')
+# Legacy networkx pickle: converted to a GRAPH_PATH snapshot on load if it is current and no snapshot exists yet
+GRAPH_PICKLE_PATH = os.path.join(VOCABS_PATH, 'relationship_graph.pickle')
+# Edges added & removed by the last rebuild of the graph; see diff.py
+GRAPH_DIFF_PATH = os.path.join(VOCABS_PATH, 'relationship_graph.diff.npz')
+VOCAB_VERSION_VAR = 'last_refreshed_vocab_tables'
+COUNTS_VERSION_VAR = 'last_refreshed_counts_tables'
+GRAPH_RELOAD_INTERVAL_SECONDS = 5 * 60
+CONCEPT_GRAPH_CACHE_MAX_BYTES = int(os.getenv('TERMHUB_CONCEPT_GRAPH_CACHE_MB', 512)) * 1024 ** 2
+CONCEPT_GRAPH_CACHE_TTL_SECONDS = 6 * 60 * 60
+LAYOUT_CACHE_MAX_BYTES = int(os.getenv('TERMHUB_LAYOUT_CACHE_MB', 128)) * 1024 ** 2
+SET_ITEM_BYTES = 64  # rough size of an int in a Python set, for cache size estimates
+# Max descendants the routes add when expanding past children (max_depth != 1), whatever max_nodes is asked for
+CONCEPT_GRAPH_MAX_NODES = int(os.getenv('TERMHUB_CONCEPT_GRAPH_MAX_NODES', 10_000))
 
 router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
 
+def route_max_nodes(max_depth: Optional[int], max_nodes: Optional[int]) -> Optional[int]:
+    """max_nodes budget for a route's descendant expansion: as asked for if only adding children (max_depth 1),
+    otherwise at most CONCEPT_GRAPH_MAX_NODES, so a deep expansion of e.g. a root concept stays bounded"""
+    if max_depth == 1:
+        return max_nodes
+    return CONCEPT_GRAPH_MAX_NODES if max_nodes is None else min(max_nodes, CONCEPT_GRAPH_MAX_NODES)
+
+
 @router.get("/concept-graph")
 async def concept_graph_get(
     request: Request, codeset_ids: Optional[List[int]] = Query(None), cids: Optional[List[int]] = Query(None),
     hide_vocabs = ['RxNorm Extension'], hide_nonstandard_concepts=False, verbose = VERBOSE,
+    condense_threshold: Optional[int] = None, format: Optional[Literal['json', 'columnar', 'arrow']] = None,
+    max_depth: int = 1, max_nodes: Optional[int] = None, layout: bool = False, rollups: bool = False,
 ) -> Dict[str, Any]:
     """Return concept graph"""
     cids = cids if cids else []
-    return await concept_graph_post(request, codeset_ids, cids, hide_vocabs, hide_nonstandard_concepts, verbose)
+    return await concept_graph_post(
+        request, codeset_ids, cids, hide_vocabs, hide_nonstandard_concepts, verbose, condense_threshold, format,
+        max_depth, max_nodes, layout, rollups)
 
 
 @router.post("/concept-graph")
 async def concept_graph_post(
     request: Request, codeset_ids: List[int], cids: Union[List[int], None] = [],
     hide_vocabs = ['RxNorm Extension'], hide_nonstandard_concepts=False, verbose = VERBOSE,
+    condense_threshold: Optional[int] = None, format: Optional[Literal['json', 'columnar', 'arrow']] = None,
+    max_depth: int = 1, max_nodes: Optional[int] = None, layout: bool = False, rollups: bool = False,
 ) -> Dict:
-    """Return concept graph via HTTP POST"""
+    """Return concept graph via HTTP POST
+
+    :param max_depth: Levels of descendants to add below the concept sets' concepts. The default, 1, adds children.
+    :param max_nodes: Max number of descendants to add. If either limit cuts off any descendants, the response's
+      truncated lists the concepts whose children were left out. Unless max_depth is 1, at most, and by default,
+      CONCEPT_GRAPH_MAX_NODES.
+    :param condense_threshold: If set, hide the children of nodes with more than this many children, where nothing else
+      depends on them. See condense.py. Hidden children can be fetched via /expand-super-node.
+    :param format: Response format. Defaults to json, or arrow if the Accept header asks for
+      application/vnd.apache.arrow.stream.
+      - json: edges as a list of [source, target] pairs
+      - columnar: same fields, but edges as {source: [...], target: [...]} and id sets as sorted lists
+      - arrow: Arrow IPC stream of the edges, w/ the other fields as columnar JSON in the schema metadata
+    :param layout: If true, the response includes a precomputed layered layout, see layout.py: {concept_ids, x, y},
+      parallel lists, y being the layer, 0 at the top.
+    :param rollups: If true, the response includes subtree rollups of the graph's concepts, see rollup.py:
+      {concept_ids, total_cnt, descendant_cnt}, parallel lists. total_cnt is the records in each concept's subtree,
+      itself included, and descendant_cnt its number of distinct descendants."""
     rpt = Api_logger()
     try:
         await rpt.start_rpt(request, params={'codeset_ids': codeset_ids, 'cids': cids})
 
         hide_vocabs = hide_vocabs if isinstance(hide_vocabs, list) else []
-        sg: DiGraph
+        sg: CsrSubgraph
         hidden_by_voc: Dict[str, Set[int]]
         nonstandard_concepts_hidden: Set[int]
 
-        sg, concept_ids, hidden_dict, nonstandard_concepts_hidden = await concept_graph(
-            codeset_ids, cids, hide_vocabs, hide_nonstandard_concepts, verbose)
-        missing_from_graph = set(concept_ids) - set(sg.nodes)
+        sg, concept_ids, hidden_dict, nonstandard_concepts_hidden = await cached_concept_graph(
+            codeset_ids, cids, hide_vocabs, hide_nonstandard_concepts, verbose, condense_threshold, max_depth,
+            route_max_nodes(max_depth, max_nodes))
+        if format is None:
+            format = 'arrow' if EDGE_MEDIA_TYPES['arrow'] in request.headers.get('accept', '') else 'json'
 
         await rpt.finish(rows=len(sg))
-        return {
-            'edges': list(sg.edges),
-            'concept_ids': concept_ids,
-            'missing_from_graph': missing_from_graph,
-            'hidden_by_vocab': hidden_dict,
-            'nonstandard_concepts_hidden': nonstandard_concepts_hidden}
+        response = concept_graph_response(
+            sg, concept_ids, hidden_dict, nonstandard_concepts_hidden, format, layout, rollups)
+        if format == 'json':
+            return response
+        if format == 'arrow':
+            edges = response.pop('edges')
+            return Response(
+                encode_arrow_edges(edges['source'], edges['target'], response), media_type=EDGE_MEDIA_TYPES['arrow'])
+        return Response(encode_columnar_json(response), media_type='application/json')
+    except Exception as e:
+        await rpt.log_error(e)
+        raise e
+
+
+class ConceptGraphGroup(BaseModel):
+    """One /concept-graph-batch group: the codeset_ids and cids of one /concept-graph call"""
+    codeset_ids: List[int] = []
+    cids: List[int] = []
+
+
+@router.post("/concept-graph-batch")
+async def concept_graph_batch_post(
+    request: Request, groups: List[ConceptGraphGroup], hide_vocabs = ['RxNorm Extension'],
+    hide_nonstandard_concepts=False, verbose = VERBOSE, condense_threshold: Optional[int] = None,
+    format: Literal['json', 'columnar'] = 'json', max_depth: int = 1, max_nodes: Optional[int] = None,
+    layout: bool = False, rollups: bool = False,
+) -> List[Dict[str, Any]]:
+    """Concept graphs for several groups of concept sets in one call, e.g. for comparison pages
+
+    Takes the same options as /concept-graph, applied to every group. Concepts are looked up once for all groups.
+    :returns: One /concept-graph response per group, in order. Formats are json or columnar; for arrow, use
+      /concept-graph per group."""
+    rpt = Api_logger()
+    try:
+        await rpt.start_rpt(request, params={'groups': [[g.codeset_ids, g.cids] for g in groups]})
+        hide_vocabs = hide_vocabs if isinstance(hide_vocabs, list) else []
+        results = await cached_concept_graph_batch(
+            [(g.codeset_ids, g.cids) for g in groups], hide_vocabs, hide_nonstandard_concepts, verbose,
+            condense_threshold, max_depth, route_max_nodes(max_depth, max_nodes))
+        await rpt.finish(rows=sum(len(sg) for sg, _, _, _ in results))
+        response = [
+            concept_graph_response(*result, format=format, layout=layout, rollups=rollups) for result in results]
+        if format == 'json':
+            return response
+        return Response(encode_columnar_json(response), media_type='application/json')
     except Exception as e:
         await rpt.log_error(e)
         raise e
 
 
+def concept_graph_response(
+    sg: CsrSubgraph, concept_ids: Set[int], hidden_by_voc: Dict[str, Set[int]], nonstandard_concepts_hidden: Set[int],
+    format: str = 'json', layout: bool = False, rollups: bool = False,
+) -> Dict[str, Any]:
+    """/concept-graph response body for a concept_graph() result. Edges are [source, target] pairs for json, else
+    {source: [...], target: [...]} arrays; likewise the layout's and rollups' arrays, if requested."""
+    ids = np.fromiter(concept_ids, dtype=np.int64, count=len(concept_ids))
+    if format == 'json':
+        edges = list(sg.edges)
+    else:
+        src, tgt = sg.edge_arrays()
+        edges = {'source': src, 'target': tgt}
+    response = {
+        'edges': edges,
+        'concept_ids': concept_ids,
+        'missing_from_graph': set(ids[sg.graph.rows_of(ids) < 0].tolist()),
+        'hidden_by_vocab': hidden_by_voc,
+        'nonstandard_concepts_hidden': nonstandard_concepts_hidden}
+    if isinstance(sg, CondensedSubgraph):
+        response['super_nodes'] = sg.super_nodes
+    if 'truncated' in sg.meta:
+        response['truncated'] = sg.meta['truncated']
+    if layout:
+        coordinates = cached_layout(sg)
+        response['layout'] = {k: v.tolist() for k, v in coordinates.items()} if format == 'json' else coordinates
+    if rollups:
+        graph_rollups = subtree_rollups(sg.graph)
+        found = graph_rollups.lookup(sg.graph.node_ids[sg.node_rows]) if graph_rollups else None
+        response['rollups'] = {k: v.tolist() for k, v in found.items()} if found and format == 'json' else found
+    return response
+
+
+# Layouts, per worker, by subgraph and vocab version: the same subgraph can come from different requests
+LAYOUT_CACHE = LruTtlCache(
+    max_bytes=LAYOUT_CACHE_MAX_BYTES, ttl_seconds=CONCEPT_GRAPH_CACHE_TTL_SECONDS,
+    sizeof=lambda coordinates: sum(v.nbytes for v in coordinates.values()))
+
+
+def cached_layout(sg: CsrSubgraph) -> Dict[str, np.ndarray]:
+    """layered_layout(sg), via LAYOUT_CACHE. The result is shared with other requests: don't mutate it."""
+    key = (layout_key(sg), sg.graph.meta.get('vocab_version'))
+    return LAYOUT_CACHE.get_or_compute(key, lambda: layered_layout(sg))
+
+
+def _concept_graph_size(result: Tuple[CsrSubgraph, Set[int], Dict[str, Set[int]], Set[int]]) -> int:
+    """Estimated memory held by a concept_graph() result"""
+    sg, concept_ids, hidden_by_voc, nonstandard_concepts_hidden = result
+    n_ids = len(concept_ids) + sum(len(ids) for ids in hidden_by_voc.values()) + len(nonstandard_concepts_hidden)
+    return sg.node_rows.nbytes + sg.src_rows.nbytes + sg.tgt_rows.nbytes + n_ids * SET_ITEM_BYTES
+
+
+# Results of concept_graph(), per worker. Keys include the DB refresh time and graph version, so refreshes invalidate.
+CONCEPT_GRAPH_CACHE = LruTtlCache(
+    max_bytes=CONCEPT_GRAPH_CACHE_MAX_BYTES, ttl_seconds=CONCEPT_GRAPH_CACHE_TTL_SECONDS, sizeof=_concept_graph_size)
+
+
+def _concept_graph_cache_key(
+    rel_graph: CsrGraph, codeset_ids: Union[List[int], None], cids: Union[List[int], None], hide_vocabs: List[str],
+    hide_nonstandard_concepts: bool, condense_threshold: Optional[int], max_depth: Optional[int],
+    max_nodes: Optional[int], last_refresh: Any,
+) -> Tuple:
+    """CONCEPT_GRAPH_CACHE key for a concept_graph() call"""
+    return (
+        tuple(sorted(set(codeset_ids or []))), tuple(sorted(set(cids or []))), tuple(sorted(set(hide_vocabs))),
+        bool(hide_nonstandard_concepts), condense_threshold, max_depth, max_nodes, last_refresh,
+        rel_graph.meta.get('vocab_version'), rel_graph.meta.get('built_at'))
+
+
+async def cached_concept_graph(
+    codeset_ids: Union[List[int], None], cids: Union[List[int], None] = [], hide_vocabs = [],
+    hide_nonstandard_concepts=False, verbose = VERBOSE, condense_threshold: Optional[int] = None, max_depth: int = 1,
+    max_nodes: Optional[int] = None,
+) -> Tuple[CsrSubgraph, Set[int], Dict[str, Set[int]], Set[int]]:
+    """concept_graph(), via CONCEPT_GRAPH_CACHE. The result is shared with other requests: don't mutate it."""
+    rel_graph: CsrGraph = REL_GRAPH
+    key = _concept_graph_cache_key(
+        rel_graph, codeset_ids, cids, hide_vocabs, hide_nonstandard_concepts, condense_threshold, max_depth, max_nodes,
+        await check_db_status_var_async('last_refresh_success'))
+    result = CONCEPT_GRAPH_CACHE.get(key)
+    if result is MISSING:
+        result = await concept_graph(
+            codeset_ids, cids, hide_vocabs, hide_nonstandard_concepts, verbose, condense_threshold=condense_threshold,
+            max_depth=max_depth, max_nodes=max_nodes)
+        CONCEPT_GRAPH_CACHE.put(key, result)
+    return result
+
+
+async def cached_concept_graph_batch(
+    groups: List[Tuple[List[int], List[int]]], hide_vocabs = [], hide_nonstandard_concepts=False, verbose = VERBOSE,
+    condense_threshold: Optional[int] = None, max_depth: int = 1, max_nodes: Optional[int] = None,
+) -> List[Tuple[CsrSubgraph, Set[int], Dict[str, Set[int]], Set[int]]]:
+    """cached_concept_graph() for several (codeset_ids, cids) groups. Groups not already cached are computed together
+    by concept_graph_batch(), and cached individually, so later single /concept-graph calls reuse them."""
+    rel_graph: CsrGraph = REL_GRAPH
+    last_refresh = await check_db_status_var_async('last_refresh_success')
+    keys = [
+        _concept_graph_cache_key(
+            rel_graph, codeset_ids, cids, hide_vocabs, hide_nonstandard_concepts, condense_threshold, max_depth,
+            max_nodes, last_refresh)
+        for codeset_ids, cids in groups]
+    results = [CONCEPT_GRAPH_CACHE.get(key) for key in keys]
+    # dedupe: groups w/ the same key are computed once
+    todo: Dict[Tuple, Tuple[List[int], List[int]]] = {
+        key: group for key, group, result in zip(keys, groups, results) if result is MISSING}
+    if todo:
+        computed = await concept_graph_batch(
+            list(todo.values()), hide_vocabs, hide_nonstandard_concepts, verbose, condense_threshold, max_depth,
+            max_nodes)
+        for key, result in zip(todo, computed):
+            CONCEPT_GRAPH_CACHE.put(key, result)
+        by_key = dict(zip(todo, computed))
+        results = [by_key[key] if result is MISSING else result for key, result in zip(keys, results)]
+    return results
+
+
+async def concept_graph_batch(
+    groups: List[Tuple[List[int], List[int]]], hide_vocabs = [], hide_nonstandard_concepts=False, verbose = VERBOSE,
+    condense_threshold: Optional[int] = None, max_depth: Optional[int] = 1, max_nodes: Optional[int] = None,
+) -> List[Tuple[CsrSubgraph, Set[int], Dict[str, Set[int]], Set[int]]]:
+    """concept_graph() for each of several (codeset_ids, cids) groups
+
+    Same results as calling concept_graph() per group, but with a fixed number of queries however many groups there
+    are: one for the members of every group's concept sets, one for every group's cids, and one for all the groups'
+    descendants. Descendants are expanded for all groups in one pass; see CsrGraph.descendants_by_group()."""
+    timer = get_timer('')
+    verbose and timer(f'concept_graph_batch(): {len(groups)} groups')
+    rel_graph: CsrGraph = REL_GRAPH
+
+    # Get concepts & metadata, once for all groups
+    all_codeset_ids: Set[int] = set().union(*[codeset_ids or [] for codeset_ids, _ in groups])
+    all_cids: Set[int] = set().union(*[cids or [] for _, cids in groups])
+    members: List[RowMapping] = await get_cset_members_items_async(
+        codeset_ids=list(all_codeset_ids), columns=['codeset_id', 'concept_id', 'vocabulary_id', 'standard_concept']) \
+        if all_codeset_ids else []
+    members_by_cset: Dict[int, List[RowMapping]] = {}
+    for row in members:
+        members_by_cset.setdefault(row['codeset_id'], []).append(row)
+    concepts_by_cid: Dict[int, RowMapping] = \
+        {c['concept_id']: c for c in await get_concepts_async(all_cids)} if all_cids else {}
+
+    # - filter: by vocab & non-standard, per group
+    seeds: List[Tuple[Set[int], Dict[str, Set[int]], Set[int]]] = []
+    for codeset_ids, cids in groups:
+        concepts_unfiltered = [
+            row for codeset_id in set(codeset_ids or []) for row in members_by_cset.get(codeset_id, [])]
+        concepts_unfiltered.extend([concepts_by_cid[cid] for cid in set(cids or []) if cid in concepts_by_cid])
+        concepts, hidden_by_voc, nonstandard_concepts_hidden = filter_concepts(
+            concepts_unfiltered, hide_vocabs, hide_nonstandard_concepts)
+        seeds.append((set([c['concept_id'] for c in concepts]), hidden_by_voc, nonstandard_concepts_hidden))
+    verbose and timer('descendants')
+
+    # Descendants: one expansion, one lookup
+    expansions = rel_graph.descendants_by_group([concept_ids for concept_ids, _, _ in seeds], max_depth, max_nodes)
+    all_more_concept_ids: Set[int] = set().union(*[more_concept_ids for more_concept_ids, _ in expansions])
+    concepts_by_id: Dict[int, RowMapping] = \
+        {c['concept_id']: c for c in await get_concepts_async(all_more_concept_ids)} if all_more_concept_ids else {}
+    verbose and timer('subgraphs')
+
+    results = []
+    for seed, (more_concept_ids, truncated) in zip(seeds, expansions):
+        concept_ids, hidden_by_voc, nonstandard_concepts_hidden = seed
+        more_concepts = [concepts_by_id[cid] for cid in more_concept_ids if cid in concepts_by_id]
+        results.append(assemble_concept_graph(
+            rel_graph, concept_ids, hidden_by_voc, nonstandard_concepts_hidden, more_concept_ids, more_concepts,
+            truncated, hide_vocabs, hide_nonstandard_concepts, condense_threshold))
+    verbose and timer('done')
+    return results
+
+
+@router.get("/concept-graph-cache-stats")
+def concept_graph_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters and size of this worker's concept graph and layout caches"""
+    return {**CONCEPT_GRAPH_CACHE.stats(), 'layout': LAYOUT_CACHE.stats()}
+
+
 async def concept_graph(
     codeset_ids: Union[List[int], None], cids: Union[List[int], None] = [], hide_vocabs = [],
-    hide_nonstandard_concepts=False, verbose = VERBOSE, all_descendants = True
- ) -> Tuple[DiGraph, Set[int], Set[int], Dict[str, Set[int]], Set[int]]:
+    hide_nonstandard_concepts=False, verbose = VERBOSE, all_descendants = True, condense_threshold: Optional[int] = None,
+    max_depth: Optional[int] = 1, max_nodes: Optional[int] = None,
+ ) -> Tuple[CsrSubgraph, Set[int], Dict[str, Set[int]], Set[int]]:
     """Return concept graph
 
         concepts/concept_ids will include all definition and expansion concepts for codeset_ids
             plus any cids that are passed in
+    :param condense_threshold: If set, the subgraph is a CondensedSubgraph, and concept_ids leaves out the concepts it
+      hides. Concepts in the concept sets themselves, or cids, are never hidden.
+    :param max_depth: Levels of descendants to add; None for all. Other than the default of 1, i.e. children, or if
+      max_nodes is set, this is a budgeted breadth-first search, and sg.meta['truncated'] lists the concepts whose
+      children were cut off.
     :returns
       hidden_by_voc: Map of vocab to set of concept ids"""
     timer = get_timer('')
     verbose and timer('concept_graph()')
+    # Hold on to the graph for the whole call, in case GRAPH_RELOADER swaps in a new one meanwhile
+    rel_graph: CsrGraph = REL_GRAPH
 
     # Get concepts & metadata
-    concepts_unfiltered: List[RowMapping] = get_cset_members_items(
+    concepts_unfiltered: List[RowMapping] = await get_cset_members_items_async(
         codeset_ids=codeset_ids, columns=['concept_id', 'vocabulary_id', 'standard_concept'])
     concepts: List[Dict[str, Any]]
     hidden_by_voc: Dict[str, Set[int]]
     nonstandard_concepts_hidden: Set
 
     if cids:
-        more_concepts = get_concepts(cids)
+        more_concepts = await get_concepts_async(cids)
         concepts_unfiltered.extend(more_concepts)
 
     # - filter: by vocab & non-standard
@@ -103,10 +393,30 @@ async def concept_graph(
     # 2024-10-22. What if we get all descendants, not just missing in between?
     # 2024-11-18. It's been working ok. Now getting rid of all missing-in-between stuff.
     #               Return to commit fdb472ee1bf14156e87c324f2d7297ea2df3601d to get it back.
-    more_concept_ids: Set[int] = get_all_descendants(REL_GRAPH, concept_ids)
+    more_concept_ids, truncated = rel_graph.descendants_by_group([concept_ids], max_depth, max_nodes)[0]
 
     # merge and filter
-    more_concepts: List[RowMapping] = get_concepts(more_concept_ids)
+    more_concepts: List[RowMapping] = await get_concepts_async(more_concept_ids)
+    result = assemble_concept_graph(
+        rel_graph, concept_ids, hidden_by_voc, nonstandard_concepts_hidden, more_concept_ids, more_concepts, truncated,
+        hide_vocabs, hide_nonstandard_concepts, condense_threshold)
+
+    # Return
+    verbose and timer('done')
+    return result
+
+
+def assemble_concept_graph(
+    rel_graph: CsrGraph, concept_ids: Set[int], hidden_by_voc: Dict[str, Set[int]],
+    nonstandard_concepts_hidden: Set[int], more_concept_ids: Set[int], more_concepts: List[RowMapping],
+    truncated: Optional[List[int]], hide_vocabs: List[str], hide_nonstandard_concepts=False,
+    condense_threshold: Optional[int] = None,
+) -> Tuple[CsrSubgraph, Set[int], Dict[str, Set[int]], Set[int]]:
+    """Second half of concept_graph(), once the concept sets' concepts and their descendants have been looked up
+
+    :param concept_ids: The concept sets' concepts, & cids, after filtering. Updated in place.
+    :param more_concept_ids: Their descendants, from CsrGraph.descendants_by_group()
+    :param more_concepts: Concept rows for more_concept_ids"""
     concepts_m: List[Dict]
     hidden_by_voc_m: Dict[str, Set[int]]
     nonstandard_concepts_hidden_m: Set
@@ -115,30 +425,84 @@ async def concept_graph(
         more_concepts, hide_vocabs, hide_nonstandard_concepts)
 
     # Merge: more_concepts into concept_ids
+    cset_concept_ids: Set[int] = set(concept_ids) if condense_threshold is not None else set()
     concept_ids.update(more_concept_ids)
     for voc, hidden in hidden_by_voc_m.items():
         hidden_by_voc[voc] = hidden_by_voc.get(voc, set()).union(hidden)
     nonstandard_concepts_hidden = nonstandard_concepts_hidden.union(nonstandard_concepts_hidden_m)
 
     # Get subgraph
-    sg: DiGraph = REL_GRAPH.subgraph(concept_ids)
-
-    # Return
-    verbose and timer('done')
+    sg: CsrSubgraph = rel_graph.subgraph(concept_ids)
+    if condense_threshold is not None:
+        sg = condense_super_nodes(sg, condense_threshold, keep=cset_concept_ids)
+        concept_ids -= sg.hidden
+    if truncated is not None:
+        sg.meta['truncated'] = truncated
     return sg, concept_ids, hidden_by_voc, nonstandard_concepts_hidden
 
 
-def get_all_descendants(g: nx.DiGraph, subgraph_nodes: Union[List[int], Set[int]]) -> Set[int]:
+def get_all_descendants(
+    g: CsrGraph, subgraph_nodes: Union[List[int], Set[int]], transitive=False
+) -> Set[int]:
     """Get all descendants of a set of nodes
 
     Using this instead of get_missing_in_between_nodes. this way the front end has the entire descendant tree for all
     concepts being looked at.
-    """
-    descendants: Set[int] = set()
-    for node in subgraph_nodes:
-        if g.has_node(node):
-            descendants.update(g.successors(node))
-    return descendants
+
+    The set is built from successors in node iteration order, same as repeated set.update(g.successors(node)) would,
+    so that downstream set iteration order (and thus subgraph edge order) is unchanged.
+
+    :param transitive: If False, as concept_graph() uses it, just the children. If True, every descendant, via the
+      graph's reachability index."""
+    if transitive:
+        return set(reachability_index(g).descendants(subgraph_nodes).tolist())
+    return set(g.successors_of(subgraph_nodes).tolist())
+
+
+@router.get("/descendants")
+def descendants_get(concept_ids: List[int] = Query(...)) -> Dict[int, List[int]]:
+    """Get all descendants of each concept"""
+    return descendants_post(concept_ids)
+
+
+@router.post("/descendants")
+def descendants_post(concept_ids: List[int]) -> Dict[int, List[int]]:
+    """Get all descendants of each concept, via HTTP POST"""
+    index = reachability_index(REL_GRAPH)
+    return {cid: index.descendants([cid]).tolist() for cid in concept_ids}
+
+
+@router.get("/ancestors")
+def ancestors_get(concept_ids: List[int] = Query(...)) -> Dict[int, List[int]]:
+    """Get all ancestors of each concept"""
+    return ancestors_post(concept_ids)
+
+
+@router.post("/ancestors")
+def ancestors_post(concept_ids: List[int]) -> Dict[int, List[int]]:
+    """Get all ancestors of each concept, via HTTP POST"""
+    index = reachability_index(REL_GRAPH)
+    return {cid: index.ancestors([cid]).tolist() for cid in concept_ids}
+
+
+@router.post("/connect-roots")
+def connect_roots_route(concept_ids: List[int]) -> Dict[str, Any]:
+    """Find the lowest common ancestor(s) of concept_ids, and the edges connecting them to each of concept_ids"""
+    rel_graph: CsrGraph = REL_GRAPH
+    lcas, src, tgt = connect_roots(reachability_index(rel_graph), concept_ids)
+    return {
+        'lowest_common_ancestors': lcas.tolist(),
+        'edges': list(zip(src.tolist(), tgt.tolist())),
+        'missing_from_graph': [cid for cid, row in zip(concept_ids, rel_graph.rows_of(concept_ids).tolist()) if row < 0]}
+
+
+@router.post("/is-ancestor")
+def is_ancestor(pairs: List[Tuple[int, int]]) -> List[bool]:
+    """For each (ancestor_id, descendant_id) pair, is the first an ancestor of the second?"""
+    if not pairs:
+        return []
+    ancestor_ids, descendant_ids = zip(*pairs)
+    return reachability_index(REL_GRAPH).are_ancestors(ancestor_ids, descendant_ids).tolist()
 
 
 # TODO: @Siggie: move below to frontend
@@ -193,56 +557,87 @@ def filter_concepts(
 print_stack = lambda s: ' | '.join([f"{n} => {','.join([str(x) for x in p])}" for n,p in s])
 
 
-@router.get("/wholegraph")
-def wholegraph():
-    """Get subgraph edges for the whole graph"""
-    return list(REL_GRAPH.edges)
-
-
-def condense_super_nodes(sg, threshhold=10):  # todo
-    """Condense super nodes"""
-    super_nodes = [node for node, degree in sg.out_degree() if degree > threshhold]
-    # for node in super_nodes:
-    # sg.discard(node) -- n
-    return NotImplementedError(super_nodes)
-
+@router.get("/wholegraph", response_model=None)
+def wholegraph(
+    format: Literal['json', 'ndjson', 'int32', 'arrow'] = 'json', offset: int = 0, limit: Optional[int] = None,
+    vocab_version: Optional[str] = None,
+) -> StreamingResponse:
+    """Stream edges of the whole graph, a chunk at a time. See graph/export.py for the formats.
+
+    :param offset: Index of the first edge to return. Edges are in a fixed order for a given graph version.
+    :param limit: Max number of edges to return. To page through, pass the previous response's X-Next-Offset as offset.
+    :param vocab_version: When paging, the X-Vocab-Version of the first page. If the graph has since been reloaded,
+      offsets no longer line up, so this responds with 409 rather than mixing versions."""
+    rel_graph: CsrGraph = REL_GRAPH
+    current_version = rel_graph.meta.get('vocab_version')
+    if vocab_version is not None and vocab_version != current_version:
+        raise HTTPException(
+            status_code=409, detail=f'Graph is now at vocab version {current_version}; restart from offset 0.')
+    n_edges = rel_graph.number_of_edges()
+    start = max(0, offset)
+    stop = n_edges if limit is None else min(n_edges, start + max(0, limit))
+    headers = {'X-Total-Edges': str(n_edges), 'X-Vocab-Version': str(current_version)}
+    if stop < n_edges:
+        headers['X-Next-Offset'] = str(stop)
+    return StreamingResponse(
+        encode_edges(rel_graph, format, start, stop, EDGE_CHUNK_SIZE), media_type=EDGE_MEDIA_TYPES[format],
+        headers=headers)
+
+
+# Saved diffs, per worker, by path & modification time
+GRAPH_DIFF_CACHE = LruTtlCache(
+    max_bytes=CONCEPT_GRAPH_CACHE_MAX_BYTES, ttl_seconds=CONCEPT_GRAPH_CACHE_TTL_SECONDS, max_entries=2,
+    sizeof=lambda diff: sum(v.nbytes for v in diff.values() if isinstance(v, np.ndarray)))
+
+
+def get_graph_diff(codeset_ids: Optional[List[int]] = None, graph_path: str = GRAPH_PATH) -> Dict[str, Any]:
+    """Edges added & removed by the last rebuild of the graph, limited to edges touching the concepts of codeset_ids
+    if given"""
+    path = graph_diff_path(graph_path)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail='No graph diff saved yet. One is saved when the graph is rebuilt.')
+    diff = GRAPH_DIFF_CACHE.get_or_compute((path, os.path.getmtime(path)), lambda: read_diff(path))
+    if codeset_ids is not None:
+        concept_ids: List[int] = get_cset_members_items(codeset_ids, column='concept_id')
+        diff = filter_diff(diff, concept_ids)
+    return {
+        'from_version': diff['from_version'],
+        'to_version': diff['to_version'],
+        'codeset_ids': codeset_ids,
+        'added': list(zip(diff['added_source'].tolist(), diff['added_target'].tolist())),
+        'removed': list(zip(diff['removed_source'].tolist(), diff['removed_target'].tolist()))}
+
+
+@router.get("/graph-diff")
+def graph_diff_get(codeset_ids: Optional[List[int]] = Query(None)) -> Dict[str, Any]:
+    """Edges added & removed by the last vocab refresh, for the concepts in codeset_ids, or all if not given"""
+    return get_graph_diff(codeset_ids)
+
+
+@router.post("/graph-diff")
+def graph_diff_post(codeset_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Edges added & removed by the last vocab refresh, for the concepts in codeset_ids, or all if not given"""
+    return get_graph_diff(codeset_ids)
+
+
+@router.post("/expand-super-node")
+async def expand_super_node_route(
+    super_node: int, codeset_ids: List[int], cids: Union[List[int], None] = [],
+    hide_vocabs = ['RxNorm Extension'], hide_nonstandard_concepts=False, max_depth: int = 1,
+    max_nodes: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Get the children of a super node that /concept-graph hid when called with condense_threshold
 
-# noinspection PyPep8Naming
-def expand_super_node(G, subgraph_nodes, super_node):  # todo
-    """Expand super node"""
-    # sg = G.subgraph(subgraph_nodes)
-    return NotImplementedError(G, subgraph_nodes, super_node)
-
-
-def from_pydot_layout(g):  # Todo
-    """From PyDot layout"""
-    return NotImplementedError(g)
-# def find_nearest_common_ancestor(G, nodes):
-#     all_ancestors = [set(nx.ancestors(G, node)) for node in nodes]
-#     common_ancestors = set.intersection(*all_ancestors)
-#
-#     # Find the lowest common ancestor
-#     lowest_common_ancestor = None
-#     for ancestor in common_ancestors:
-#         if all(ancestor in ancestors or ancestor == node for node, ancestors in zip(nodes, all_ancestors)):
-#             if lowest_common_ancestor is None or not ancestor in nx.ancestors(G, lowest_common_ancestor):
-#                 lowest_common_ancestor = ancestor
-#
-#     return lowest_common_ancestor
-#
-#
-# def connect_roots(G, target_nodes):
-#     # Find the nearest common ancestor
-#     nca = find_nearest_common_ancestor(G, target_nodes)
-#
-#     # Create a subgraph including the paths from the nearest common ancestor to the target nodes
-#     edges_to_include = set()
-#     for node in target_nodes:
-#         path = nx.shortest_path(G, nca, node)
-#         edges_to_include.update([tuple(l) for l in zip(path, path[1:])])
-#
-#     SG = G.edge_subgraph(edges_to_include).copy()
-#     return SG
+    Takes the same codeset_ids, cids, hiding options, max_depth and max_nodes as that /concept-graph call, so the
+    children come from the same, equally budgeted, subgraph. truncated is true if that budget cut off some of the
+    super node's children."""
+    hide_vocabs = hide_vocabs if isinstance(hide_vocabs, list) else []
+    sg, _, _, _ = await cached_concept_graph(
+        codeset_ids, cids, hide_vocabs, hide_nonstandard_concepts, max_depth=max_depth,
+        max_nodes=route_max_nodes(max_depth, max_nodes))
+    src, tgt, truncated = expand_super_node(sg, super_node)
+    return {'super_node': super_node, 'edges': list(zip(src.tolist(), tgt.tolist())), 'concept_ids': tgt.tolist(),
+            'truncated': truncated}
 
 
 def generate_graph_edges() -> Iterable[Row]:
@@ -260,72 +655,211 @@ def generate_graph_edges() -> Iterable[Row]:
             yield row
 
 
+def create_relationship_store(relationship_ids: List[str] = STORED_RELATIONSHIPS) -> RelationshipStore:
+    """Load concept_relationship edges of relationship_ids into a RelationshipStore"""
+    sources: List[np.ndarray] = []
+    targets: List[np.ndarray] = []
+    codes: List[np.ndarray] = []
+    with get_db_connection() as con:
+        for code, relationship_id in enumerate(relationship_ids):
+            rows = con.execute(text(f"""
+                SELECT concept_id_1, concept_id_2
+                FROM {SCHEMA}.concept_relationship
+                WHERE relationship_id = :relationship_id"""), {'relationship_id': relationship_id}).fetchall()
+            pairs = np.array(rows, dtype=np.int64).reshape(-1, 2)
+            sources.append(pairs[:, 0])
+            targets.append(pairs[:, 1])
+            codes.append(np.full(len(pairs), code, dtype=np.int64))
+    return RelationshipStore.from_edges(
+        np.concatenate(sources), np.concatenate(targets), np.concatenate(codes), relationship_ids)
+
+
 # todo: control verbosity?
-def create_rel_graphs(save_to_pickle: bool) -> DiGraph:
-    """Create relationship graphs"""
+def create_rel_graphs(save: bool, graph_path: str = GRAPH_PATH) -> CsrGraph:
+    """Create relationship graphs
+
+    :param save: Write a snapshot to graph_path and return the graph memory-mapped from it."""
     timer = get_timer('create_rel_graphs')
 
+    vocab_version: str = check_db_status_var(VOCAB_VERSION_VAR)
     timer('get edge records')
     edge_generator = generate_graph_edges()
 
-    # noinspection PyPep8Naming
-    G = nx.DiGraph()
-    if save_to_pickle:
-        msg = 'loading and pickling'
-        pickle_file = open(GRAPH_PATH, 'ab')
-    else:
-        msg = 'loading'
-        pickle_file = None
-
+    msg = 'loading and saving' if save else 'loading'
     timer(msg)
     rownum = 0
     chunk_size = 10000
     msg = msg.replace('ing', 'ed')
     edges = []
-    chunks_loaded = 0
+    chunks: List[np.ndarray] = []
     for source, target in edge_generator:
         edges.append((source, target))
         rownum += 1
         if rownum >= chunk_size:
-            chunks_loaded += 1
-            G.add_edges_from(edges)
+            chunks.append(np.array(edges, dtype=np.int64))
             edges = []
-            if chunks_loaded % 100 == 0:
-                timer(f'{commify(chunks_loaded * chunk_size)} rows {msg}')
+            if len(chunks) % 100 == 0:
+                timer(f'{commify(len(chunks) * chunk_size)} rows {msg}')
             rownum = 0
-
-    if save_to_pickle:
-        timer('saving to pickle')
-        pickle.dump(G, pickle_file)  # , pickle.HIGHEST_PROTOCOL
+    if edges:  # final, partial chunk
+        chunks.append(np.array(edges, dtype=np.int64))
+    all_edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+    # noinspection PyPep8Naming
+    G = CsrGraph.from_edges(all_edges[:, 0], all_edges[:, 1])
+    G.meta = {'vocab_version': vocab_version}
+    timer('indexing')
+    reachability_index(G)
+    timer('loading typed relationships')
+    G.aux.update(create_relationship_store().aux_arrays())
+    timer('rolling up counts')
+    refresh_rollups(G)
+
+    if save:
+        if is_snapshot(graph_path):
+            timer('diffing against previous snapshot')
+            save_graph_diff(graph_path, G)
+        timer('saving snapshot')
+        G = save_rel_graph(G, graph_path)
 
     timer('done')
-    return G # , Gu
+    return G
+
+
+def refresh_rollups(G: CsrGraph):
+    """(Re)compute subtree rollups of concepts_with_counts.total_cnt, see rollup.py, and add them to G"""
+    counts_version: str = check_db_status_var(COUNTS_VERSION_VAR)
+    with get_db_connection() as con:
+        rows = con.execute(text(f"""
+            SELECT concept_id, total_cnt
+            FROM {SCHEMA}.concepts_with_counts
+            WHERE total_cnt > 0""")).fetchall()
+    counts = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    add_rollups(G, counts[:, 0], counts[:, 1], counts_version)
+
+
+def save_rel_graph(G: CsrGraph, graph_path: str = GRAPH_PATH) -> CsrGraph:
+    """Write G's snapshot, with everything in its meta that needs to survive, and return the graph memory-mapped from
+    it"""
+    write_snapshot(
+        G, graph_path, G.meta.get('vocab_version'), G.meta.get('built_at'),
+        extra={COUNTS_VERSION_KEY: G.meta.get(COUNTS_VERSION_KEY)})
+    return load_snapshot(graph_path)
+
+
+def graph_diff_path(graph_path: str = GRAPH_PATH) -> str:
+    """Where the diff for the graph at graph_path is saved"""
+    return GRAPH_DIFF_PATH if graph_path == GRAPH_PATH else os.path.splitext(graph_path)[0] + '.diff.npz'
+
+
+def save_graph_diff(old_graph_path: str, new_graph: CsrGraph):
+    """Save the edges added & removed between the snapshot at old_graph_path and new_graph. A failure here shouldn't
+    stop the new graph from being saved and served."""
+    try:
+        diff = diff_graphs(load_snapshot(old_graph_path), new_graph)
+        write_diff(diff, graph_diff_path(old_graph_path))
+        print(f'Graph diff {diff["from_version"]} -> {diff["to_version"]}: {commify(len(diff["added_source"]))} '
+              f'edges added, {commify(len(diff["removed_source"]))} removed')
+    except (SnapshotFormatError, OSError) as err:
+        warnings.warn(f'Could not diff against previous graph snapshot: {err}')
 
 
 def is_graph_up_to_date(graph_path: str = GRAPH_PATH) -> bool:
-    """Determine if the networkx relationship_graph derived from OMOP vocab is current"""
-    voc_last_updated = dp.parse(check_db_status_var('last_refreshed_vocab_tables'))
+    """Determine if the relationship graph derived from OMOP vocab is current
+
+    Snapshots record the vocab version they were built from. For anything else, e.g. a legacy pickle, falls back to
+    comparing the file's modification time against when the vocab was last refreshed."""
+    if not os.path.isfile(graph_path):
+        return False
+    voc_last_updated_str: str = check_db_status_var(VOCAB_VERSION_VAR)
+    if is_snapshot(graph_path):
+        try:
+            return read_snapshot_header(graph_path)['vocab_version'] == voc_last_updated_str
+        except SnapshotFormatError:
+            return False
+    voc_last_updated = dp.parse(voc_last_updated_str)
     graph_last_updated = datetime.fromtimestamp(os.path.getmtime(graph_path))
     if voc_last_updated.tzinfo and not graph_last_updated.tzinfo:  # if one has timezone, both need
         graph_last_updated = graph_last_updated.replace(tzinfo=voc_last_updated.tzinfo)
     return graph_last_updated > voc_last_updated
 
 
+@contextmanager
+def graph_build_lock(graph_path: str = GRAPH_PATH):
+    """Inter-process lock around checking/(re)building the snapshot
+
+    All workers start at once. This way one of them builds the snapshot while the others wait, then just map it."""
+    os.makedirs(os.path.dirname(graph_path), exist_ok=True)
+    with open(graph_path + '.lock', 'w') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 # noinspection PyPep8Naming for_G
-def load_relationship_graph(graph_path: str = GRAPH_PATH, update_if_outdated=True, save=True) -> DiGraph:
-    """Load relationship graph from disk"""
+def load_relationship_graph(graph_path: str = GRAPH_PATH, update_if_outdated=True, save=True) -> CsrGraph:
+    """Load relationship graph from disk
+
+    The snapshot is memory-mapped read-only, so every worker process shares the same pages via the OS page cache."""
     timer = get_timer('./load_relationship_graph')
     timer(f'loading {graph_path}')
-    up_to_date = True if not update_if_outdated else is_graph_up_to_date(graph_path)
-    if os.path.isfile(graph_path) and up_to_date:
-        with open(graph_path, 'rb') as pickle_file:
-            G: DiGraph = pickle.load(pickle_file)
-    else:
-        G: DiGraph = create_rel_graphs(save)
+    with graph_build_lock(graph_path):
+        if os.path.isfile(graph_path) and (not update_if_outdated or is_graph_up_to_date(graph_path)):
+            G: CsrGraph = load_snapshot(graph_path)
+            has_index = any(name.startswith(REACHABILITY_AUX_PREFIX) for name in G.aux)
+            has_relationships = any(name.startswith(RELATIONSHIP_AUX_PREFIX) for name in G.aux)
+            rollups_current = subtree_rollups(G) is not None and \
+                G.meta.get(COUNTS_VERSION_KEY) == check_db_status_var(COUNTS_VERSION_VAR)
+            if not rollups_current:
+                timer('rolling up counts')
+                refresh_rollups(G)
+            if save and not (has_index and has_relationships and rollups_current):
+                timer('adding reachability index, typed relationships and rollups to snapshot')
+                reachability_index(G)
+                if not has_relationships:
+                    G.aux.update(create_relationship_store().aux_arrays())
+                G = save_rel_graph(G, graph_path)
+        elif os.path.isfile(GRAPH_PICKLE_PATH) and (not update_if_outdated or is_graph_up_to_date(GRAPH_PICKLE_PATH)):
+            timer(f'converting {GRAPH_PICKLE_PATH}')
+            vocab_version: str = check_db_status_var(VOCAB_VERSION_VAR)
+            with open(GRAPH_PICKLE_PATH, 'rb') as pickle_file:
+                G: Union[CsrGraph, DiGraph] = pickle.load(pickle_file)
+            if isinstance(G, DiGraph):
+                G = CsrGraph.from_networkx(G)
+            G.meta = {'vocab_version': vocab_version}
+            reachability_index(G)
+            G.aux.update(create_relationship_store().aux_arrays())
+            refresh_rollups(G)
+            if save:
+                G = save_rel_graph(G, graph_path)
+        else:
+            G: CsrGraph = create_rel_graphs(save, graph_path)
+    reachability_index(G)  # no-op if it came with the graph; otherwise build it here rather than on first request
     timer('done')
     return G
 
 
+def _swap_rel_graph(g: CsrGraph):
+    """Start serving g. Rebinding the global is atomic; in-flight requests keep their reference to the old graph."""
+    global REL_GRAPH
+    REL_GRAPH = g
+    set_current_relationship_store(relationship_store(g))
+    set_current_rollups(subtree_rollups(g))
+
+
+# Watches for vocab & counts refreshes, e.g. by refresh_dataset_group_tables, and swaps in the new graph, or the graph
+#  with new rollups, without a restart
+GRAPH_RELOADER = GraphReloader(
+    get_latest_version=lambda: (check_db_status_var(VOCAB_VERSION_VAR), check_db_status_var(COUNTS_VERSION_VAR)),
+    get_current_version=lambda: (REL_GRAPH.meta.get('vocab_version'), REL_GRAPH.meta.get(COUNTS_VERSION_KEY)),
+    load=load_relationship_graph,
+    swap=_swap_rel_graph,
+    interval_seconds=GRAPH_RELOAD_INTERVAL_SECONDS)
+
+
 LOAD_FROM_PICKLE = False
 LOAD_RELGRAPH = True
 
@@ -339,4 +873,5 @@ else:
     if hasattr(builtins, 'DONT_LOAD_GRAPH') and builtins.DONT_LOAD_GRAPH:
         warnings.warn('not loading relationship graph')
     else:
-        REL_GRAPH = load_relationship_graph()
+        _swap_rel_graph(load_relationship_graph())
+        GRAPH_RELOADER.start()
@@ -5,16 +5,18 @@ from itertools import chain, combinations
 from functools import wraps, reduce
 import threading
 import json
+import math
 import operator
 import os
 import smtplib
 import traceback
-from typing import Dict, List, Any
+from typing import Dict, Iterable, Iterator, List, Any
 from datetime import datetime
 import warnings
 
+from fastapi.encoders import jsonable_encoder
 from requests import Response, post
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 # for cancel on disconnect, from https://github.com/RedRoserade/fastapi-disconnect-example/blob/main/app.py
 
 from backend.config import CONFIG
@@ -211,6 +213,36 @@ def get_nested_from_dict(d: Dict, key_path: List):
     return reduce(operator.getitem, key_path, d)
 
 
+def nan_to_none(o: Any) -> Any:
+    """Copy of JSON-able o, w/ float NaN & +/-Infinity, which aren't valid JSON, as None"""
+    if isinstance(o, float):
+        return None if math.isnan(o) or math.isinf(o) else o
+    if isinstance(o, list):
+        return [nan_to_none(x) for x in o]
+    if isinstance(o, dict):
+        return {k: nan_to_none(v) for k, v in o.items()}
+    return o
+
+
+def json_array_chunks(batches: Iterable[List]) -> Iterator[str]:
+    """Encode batches of items as 1 JSON array, 1 chunk of text per batch, e.g. from sql_query_stream(batches=True)
+
+    Items are encoded like FastAPI would a returned list, e.g. datetimes as ISO strings, except that NaN & Infinity are
+    null: the response is sent as it's encoded, so it can't fail partway through on them."""
+    yield '['
+    sep = ''
+    for batch in batches:
+        if batch:
+            yield sep + json.dumps(nan_to_none(jsonable_encoder(batch)), allow_nan=False)[1:-1]
+            sep = ','
+    yield ']'
+
+
+def json_streaming_response(batches: Iterable[List]) -> StreamingResponse:
+    """Respond w/ a JSON array, sent a batch of items at a time. See json_array_chunks()."""
+    return StreamingResponse(json_array_chunks(batches), media_type='application/json')
+
+
 def return_err_with_trace(func):
     """Handle exceptions"""
     @wraps(func)
@@ -118,13 +118,20 @@ DATASET_REGISTRY = OrderedDict({
         'name': 'concept_ancestor',
         'rid': 'ri.foundry.main.dataset.c5e0521a-147e-4608-b71e-8f53bcdbe03c',
         'sort_idx': ['ancestor_concept_id', 'descendant_concept_id'],
-        'dataset_groups': ['vocab']
+        'dataset_groups': ['vocab'],
+        # for loading w/o inferring types from the whole file first; see backend/db/utils.py load_csv()
+        'column_types': {
+            'ancestor_concept_id': 'BIGINT', 'descendant_concept_id': 'BIGINT', 'min_levels_of_separation': 'BIGINT',
+            'max_levels_of_separation': 'BIGINT'},
     },
     'concept_relationship': {  # transform depends on: concept_set_members transform
         'name': 'concept_relationship',
         'rid': 'ri.foundry.main.dataset.0469a283-692e-4654-bb2e-26922aff9d71',
         'sort_idx': ['concept_id_1', 'concept_id_2'],
-        'dataset_groups': ['vocab']
+        'dataset_groups': ['vocab'],
+        'column_types': {
+            'concept_id_1': 'BIGINT', 'concept_id_2': 'BIGINT', 'relationship_id': 'TEXT', 'valid_start_date': 'TEXT',
+            'valid_end_date': 'TEXT', 'invalid_reason': 'TEXT'},
     },
     'concept_set_version_item': {
         # actually, this one is missing stuff. using concept_set_version_item_rv instead
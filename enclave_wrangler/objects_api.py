@@ -43,8 +43,8 @@ from enclave_wrangler.utils import EnclavePaginationLimitErr, JSON_TYPE, enclave
     make_objects_request
 from enclave_wrangler.models import OBJECT_TYPE_TABLE_MAP, convert_row, get_field_names, field_name_mapping, pkey
 from backend.db.utils import SCHEMA, dedupe_dicts, delete_obj_by_pk, get_field_data_types, insert_fetch_statuses, \
-    insert_from_dict, insert_from_dicts, is_refresh_active, reset_temp_refresh_tables, refresh_derived_tables, \
-    sql_in, sql_query, sql_query_single_col, run_sql, get_db_connection, update_from_dicts
+    bulk_insert_from_dicts, insert_from_dict, is_refresh_active, reset_temp_refresh_tables, refresh_derived_tables, \
+    sql_in, sql_query, sql_query_single_col, run_sql, get_db_connection, update_from_dicts, update_from_dicts_statement
 from backend.db.queries import get_concepts
 from backend.utils import call_github_action
 
@@ -657,14 +657,14 @@ def fetch_cset_expression_item(object_id: int, retain_properties_nesting=False)
 
 
 def update_objects_in_db(
-    con: Connection, object_type_name: str, objects: List[Dict], tables: List[str] = None
+    con: Connection, object_type_name: str, objects: List[Dict], tables: List[str] = None, schema=SCHEMA
 ):
     """Update objects in db"""
     tables = tables if tables else OBJECT_TYPE_TABLE_MAP[object_type_name]
     for table in tables:
         table_objects: List[Dict] = [
             convert_row(object_type_name, table, obj, keep_missing_fields=True) for obj in objects]
-        update_from_dicts(con, table, table_objects)
+        update_from_dicts(con, table, table_objects, schema)
 
 
 def add_objects_to_db(
@@ -674,7 +674,7 @@ def add_objects_to_db(
     tables = tables if tables else OBJECT_TYPE_TABLE_MAP[object_type_name]
     for table in tables:
         table_objects: List[Dict] = [convert_row(object_type_name, table, obj) for obj in objects]
-        insert_from_dicts(con, table, table_objects, skip_if_already_exists)
+        bulk_insert_from_dicts(con, table, table_objects, skip_if_already_exists)
 
 
 # todo: is this redundant with add_objects_to_db()? Any way to just use that one instead?
@@ -766,7 +766,7 @@ def concept_set_members__cset_rows_to_db(con: Connection, cset: Dict, members: L
         'concept_name': member.get('conceptName', None),
         'archived': container.get('archived', False),
     } for member in members]
-    insert_from_dicts(con, 'concept_set_members', table_objs, skip_if_already_exists=True)
+    bulk_insert_from_dicts(con, 'concept_set_members', table_objs, skip_if_already_exists=True)
 
 
 # deprecated?: The only function that calls this, concept_set_members_enclave_to_db(), has been deprecated
@@ -1089,19 +1089,11 @@ def update_cset_metadata_from_objs(
      will not return fields on objects if they are NULL in the Enclave. However, if using this function to update a set
      of specific values, and cset_objs are not the result of a fetch from the Enclave, then set this to False.
 
+    All csets are updated in 1 round trip: the 'before' audit rows, the updates, and the 'after' audit rows are sent as
+    1 multi-statement query, which Postgres runs as 1 transaction. So, if any part fails, nothing is written, including
+    audit rows. Csets w/ the same fields share an UPDATE, so that fields missing from a cset are left untouched.
+
     todo: Ideally would check if there were any changes before updating the DB, and do nothing if no changes.
-    todo: refactor to do all csets in 1 audit query each, and 1 update_objects_in_db() call
-    todo: performance: Ideally would update all csets with a single query, but right now stability is more important. We
-     want to update one at a time, and as soon as a single case fails, we want to throw an err message at that time.
-     This applies to the 'for cset in cset_objs' part. In order to run update_objects_in_db() on all cset_objs at once,
-     I should also update the audit_query to run on multiple objs at once. Also, it may be useful that updated rows are
-     sorted 1 at a time in the audit table. So that with default sorting / or sorting explicitly by the update
-     timestamp, you see the before/after for each cset, rather than all of the csets before the update, then all the
-     csets after the update, with all the timestamps in the before/after sets being equal due to the same audit_query
-     for each set.
-    todo: If errors after the 1st audit table entry but before the 2nd, it should delete the 1st audit query. There
-     should only be ever 2 rows for a single update: the before and after. It might also help in this case to have a
-     special PK for such things so that the pair for each before/after update can easily be identified.
     """
     conn = con if con else get_db_connection()
     cset_objs = cset_objs if isinstance(cset_objs, list) else [cset_objs]
@@ -1109,15 +1101,23 @@ def update_cset_metadata_from_objs(
     if set_missing_fields_to_null:
         cset_objs = cset_objs_set_missing_fields_to_null(cset_objs, schema)
 
+    # clock_timestamp(), unlike CURRENT_TIMESTAMP, is later for the updated rows than the originals in 1 transaction
     audit_query = """INSERT INTO code_sets_audit
-        SELECT *, CURRENT_TIMESTAMP AS update_timestamp
+        SELECT *, clock_timestamp() AS update_timestamp
         FROM code_sets
-        WHERE codeset_id = cset_id;"""
+        WHERE codeset_id = ANY(:codeset_ids);"""
+    rows_by_fields: Dict[Tuple[str, ...], List[Dict]] = {}
     for cset in cset_objs:
-        cset_id = str(cset.get('codesetId', cset.get('codeset_id')))
-        run_sql(con, audit_query.replace('cset_id', cset_id))  # backup to audit table: original
-        update_objects_in_db(con, 'OMOPConceptSet', [cset])
-        run_sql(con, audit_query.replace('cset_id', cset_id))  # backup to audit table: updated
+        row: Dict = convert_row('OMOPConceptSet', 'code_sets', cset, keep_missing_fields=True)
+        rows_by_fields.setdefault(tuple(sorted(row.keys())), []).append(row)
+    statements: List[str] = [audit_query]  # backup to audit table: original
+    params: Dict[str, Any] = {'codeset_ids': [int(cset.get('codesetId', cset.get('codeset_id'))) for cset in cset_objs]}
+    for i, rows in enumerate(rows_by_fields.values()):
+        statement, statement_params = update_from_dicts_statement('code_sets', rows, schema, f'g{i}_')
+        statements.append(statement)
+        params.update(statement_params)
+    statements.append(audit_query)  # backup to audit table: updated
+    run_sql(conn, '\n'.join(statements), params)
     if not con:
         conn.close()
 
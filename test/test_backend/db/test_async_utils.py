@@ -0,0 +1,42 @@
+"""Tests for backend.db.async_utils
+
+How to run:
+    python -m unittest discover
+"""
+import asyncio
+import os
+import sys
+import unittest
+from pathlib import Path
+
+TEST_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = Path(TEST_DIR).parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.db.async_utils import check_db_status_var_async, dispose_async_engines
+from backend.db.queries import get_concepts, get_concepts_async
+from backend.db.utils import check_db_status_var
+
+CONCEPT_IDS = [1738170, 1738202, 1738203]
+
+
+class TestAsyncUtils(unittest.TestCase):
+
+    def test_same_results(self):
+        """Test async queries return the same rows as their sync counterparts"""
+        async def query():
+            """Run the async queries"""
+            try:
+                return await get_concepts_async([str(cid) for cid in CONCEPT_IDS]), \
+                    await check_db_status_var_async('last_refresh_success')
+            finally:
+                await dispose_async_engines()
+
+        concepts, last_refresh = asyncio.run(query())
+        by_id = lambda rows: {row['concept_id']: dict(row) for row in rows}
+        self.assertEqual(by_id(concepts), by_id(get_concepts(CONCEPT_IDS)))
+        self.assertEqual(last_refresh, check_db_status_var('last_refresh_success'))
+
+
+# Uncomment this and run this file and run directly to run all tests
+# if __name__ == '__main__':
+#     unittest.main()
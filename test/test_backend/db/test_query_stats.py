@@ -0,0 +1,65 @@
+"""Tests for backend.db.query_stats
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import unittest
+from pathlib import Path
+
+TEST_DIR = os.path.dirname(__file__)
+PROJECT_ROOT = Path(TEST_DIR).parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.db.query_stats import QueryStats, _cached_fingerprint, estimate_bytes, fingerprint
+
+
+class TestQueryStats(unittest.TestCase):
+
+    def test_fingerprint(self):
+        """Test statements differing only in literals share a fingerprint, and that params & identifiers are kept"""
+        fp1, text1 = fingerprint("SELECT * FROM t1 WHERE id IN (1, 2, 3) AND name = 'a''b'; -- comment")
+        fp2, text2 = fingerprint("SELECT *\n  FROM t1 WHERE id IN (45) AND name = 'c'")
+        self.assertEqual(fp1, fp2)
+        self.assertEqual(text1, "SELECT * FROM t1 WHERE id IN (?) AND name = ?")
+        self.assertNotEqual(fingerprint('SELECT * FROM t2 WHERE id = :id')[0], fp1)
+        self.assertEqual(fingerprint('SELECT * FROM t2 WHERE id = :id')[1], 'SELECT * FROM t2 WHERE id = :id')
+        self.assertEqual(
+            fingerprint('INSERT INTO t (a, b) VALUES (:a0, :b0), (:a1, :b1)'),
+            fingerprint('INSERT INTO t (a, b) VALUES (:a0, :b0)'))
+        expected = fingerprint('SELECT * FROM t WHERE id IN (1)')
+        long_query = 'SELECT * FROM t WHERE id IN (' + ', '.join(map(str, range(5000))) + ')'
+        n_cached = _cached_fingerprint.cache_info().currsize
+        self.assertEqual(fingerprint(long_query), expected)
+        self.assertEqual(_cached_fingerprint.cache_info().currsize, n_cached)  # too long to cache
+
+    def test_snapshot(self):
+        """Test stats are aggregated per fingerprint, w/ calls scaled by the sample rate, and slow queries kept"""
+        stats = QueryStats(sample_rate=0.5)
+        for seconds in [0.001] * 8 + [0.3, 2]:
+            stats.add('SELECT * FROM t WHERE id = 1', seconds, n_rows=10, n_bytes=100, route='/a')
+        stats.add('SELECT 1', 0.004, n_rows=-1, route='/b')
+        stats.add_slow('SELECT * FROM t WHERE id = 1', {'id': 1}, 2, n_rows=10, route='/a')
+        snapshot = stats.snapshot()
+        slowest = snapshot['queries'][0]
+        self.assertEqual(slowest['query'], 'SELECT * FROM t WHERE id = ?')
+        self.assertEqual((slowest['sampled_calls'], slowest['est_calls']), (10, 20))
+        self.assertEqual((slowest['p50_ms'], slowest['p95_ms'], slowest['max_ms']), (1, 2000, 2000))
+        self.assertEqual((slowest['mean_rows'], slowest['mean_bytes'], slowest['routes']), (10, 100, {'/a': 10}))
+        self.assertEqual(snapshot['queries'][1]['mean_rows'], 0)  # unknown row counts aren't negative
+        self.assertEqual(snapshot['slow_queries'][0]['query'], 'SELECT * FROM t WHERE id = ?')
+        self.assertNotIn('params', snapshot['slow_queries'][0])  # may hold user data: only logged
+        self.assertEqual(len(stats.snapshot(top=1)['queries']), 1)
+        stats.clear()
+        self.assertEqual(stats.snapshot()['queries'], [])
+
+    def test_estimate_bytes(self):
+        """Test result size is extrapolated from the first rows"""
+        self.assertEqual(estimate_bytes([['ab', 1]] * 1000), 3000)
+        self.assertEqual(estimate_bytes([{'a': 'abc'}]), 3)
+        self.assertEqual(estimate_bytes([]), 0)
+
+
+# Uncomment this and run this file and run directly to run all tests
+# if __name__ == '__main__':
+#     unittest.main()
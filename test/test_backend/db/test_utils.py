@@ -3,19 +3,33 @@
 How to run:
     python -m unittest discover
 """
+import contextlib
+import csv
+import io
 import os
+import re
 import sys
+import tempfile
+import threading
 import unittest
 from pathlib import Path
 from typing import Dict, List
 
+import numpy as np
+import pandas as pd
 from sqlalchemy.engine.base import Connection
 
 TEST_DIR = os.path.dirname(__file__)
 PROJECT_ROOT = Path(TEST_DIR).parent.parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
-from backend.db.utils import get_db_connection, get_idle_connections, insert_fetch_statuses, run_sql, \
-    select_failed_fetches, sql_query
+from backend.db import utils
+from backend.db.config import CORE_CSET_TABLES
+from backend.db.query_stats import QUERY_STATS
+from backend.db.utils import _copy_csv, _csv_chunks, _parquet_chunks, copy_load, derived_tables_dag, \
+    file_column_names, get_db_connection, get_dependent_tables_queue, get_engine, get_field_data_types, \
+    get_idle_connections, infer_csv_column_types, insert_fetch_statuses, invalidate_column_types, \
+    parquet_column_types, pg_array_literal, run_sql, select_failed_fetches, sql_query, sql_query_prepared, \
+    sql_query_stream, StatusVarStore, topological_generations, update_from_dicts_statement
 
 
 # todo: add datetime to setUp and tearDown: It might be possible, despite failsafes being in place to prevent refreshes
@@ -83,6 +97,212 @@ class TestIdleConnections(unittest.TestCase):
         msg = f'{len(idle_cnx)} exceeds the theshold of {threshold} for interval {interval}.'
         self.assertLessEqual(len(idle_cnx), threshold, msg=msg)
 
+
+class TestEngineRegistry(unittest.TestCase):
+
+    def test_pooled_connections(self):
+        """Test get_db_connection() reuses one engine per schema, and that pooled connections keep their search_path"""
+        self.assertIs(get_engine(schema='n3c'), get_engine(schema='n3c'))
+        self.assertIsNot(get_engine(schema='n3c'), get_engine(schema='test_n3c'))
+        with get_db_connection(schema='test_n3c') as con:
+            pid = sql_query(con, 'SELECT pg_backend_pid() AS pid;')[0]['pid']
+        with get_db_connection(schema='test_n3c') as con:
+            self.assertEqual(sql_query(con, 'SELECT pg_backend_pid() AS pid;')[0]['pid'], pid)
+            self.assertEqual(sql_query(con, 'SHOW search_path;')[0]['search_path'], 'test_n3c')
+
+class TestPreparedQueries(unittest.TestCase):
+
+    def test_pg_array_literal(self):
+        """Test pg_array_literal() quoting"""
+        self.assertEqual(pg_array_literal([1, 2.5, None]), '{1,2.5,NULL}')
+        self.assertEqual(pg_array_literal(['a', 'b"c', 'd\\e']), '{"a","b\\"c","d\\\\e"}')
+        self.assertEqual(pg_array_literal(set()), '{}')
+
+    def test_sql_query_prepared(self):
+        """Test sql_query_prepared() returns the same rows as sql_query(), preparing each query once per connection"""
+        query = 'SELECT concept_id FROM concept WHERE concept_id = ANY(:ids) AND vocabulary_id = ANY(:vocabs);'
+        ids, vocabs = [1738170, 1738202, 1738203], ['RxNorm', 'SNOMED']
+        with get_db_connection(schema='n3c') as con:
+            expected = sql_query(con, query, {'ids': ids, 'vocabs': vocabs}, return_with_keys=False)
+            for ids_param, vocabs_param in ((ids, vocabs), (tuple(ids), set(vocabs))):
+                self.assertEqual(
+                    sorted(sql_query_prepared(
+                        con, query, {'ids': ids_param, 'vocabs': vocabs_param}, return_with_keys=False)),
+                    sorted(expected))
+            self.assertEqual(sql_query_prepared(con, query, {'ids': [], 'vocabs': vocabs}), [])
+            n_prepared = sql_query(con, 'SELECT COUNT(*) FROM pg_prepared_statements;')[0]['count']
+            self.assertEqual(n_prepared, len(con.info['prepared_statements']))
+
+class TestCopyLoad(unittest.TestCase):
+
+    def test_copy_load_inputs(self):
+        """Test column types match what DataFrame.to_sql() would use, and CSV & parquet files stream the same rows"""
+        df = pd.DataFrame({
+            'id': range(250), 'name': ['x\n"y"' if i % 7 == 0 else f's{i}' for i in range(250)],
+            'cnt': [np.nan] * 200 + list(range(50)), 'flag': [True, False] * 125})
+        expected_types = {'id': 'BIGINT', 'name': 'TEXT', 'cnt': 'DOUBLE PRECISION', 'flag': 'BOOLEAN'}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path, parquet_path = os.path.join(tmp_dir, 't.csv'), os.path.join(tmp_dir, 't.parquet')
+            df.to_csv(csv_path, index=False)
+            df.to_parquet(parquet_path, index=False)
+            # chunks smaller than the leading NaNs in cnt: types must be unified across chunks
+            self.assertEqual(infer_csv_column_types(csv_path, chunksize=100), (expected_types, 250))
+            self.assertEqual(parquet_column_types(parquet_path), (expected_types, 250))
+            csv_rows = list(csv.reader(io.StringIO(''.join(_csv_chunks(csv_path, skip_rows=5, max_rows=10)))))
+            parquet_rows = list(csv.reader(io.StringIO(''.join(_parquet_chunks(parquet_path, 5, 10)))))
+            self.assertEqual(len(csv_rows), 10)
+            self.assertEqual([row[:3] for row in csv_rows], [row[:3] for row in parquet_rows])
+            self.assertEqual(csv_rows[2][1], 'x\n"y"')
+            self.assertEqual(file_column_names(csv_path), list(df.columns))
+            self.assertEqual(file_column_names(parquet_path), list(df.columns))
+            with self.assertRaises(ValueError):  # checked against the header before anything is loaded
+                copy_load(None, 't', csv_path, {**expected_types, 'other': 'TEXT'})
+
+    def test_csv_chunks_na_values(self):
+        """Test _csv_chunks() empties the values pd.read_csv() reads as NA, quoted or not, so COPY loads them as NULL"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 't.csv')
+            with open(path, 'w', newline='') as f:
+                na_values = ['', 'NA', 'NaN', 'null', 'NULL', 'N/A', 'nan', 'None']
+                f.write('a,b\n' + ''.join(f'{x},"{x}"\n' for x in na_values) + 'x,NAN\n')
+            rows = list(csv.reader(io.StringIO(''.join(_csv_chunks(path)))))
+            df = pd.read_csv(path)
+        self.assertEqual(rows, [['', '']] * 8 + [['x', 'NAN']])
+        self.assertEqual(df.isna().values.tolist(), [[True, True]] * 8 + [[False, False]])
+
+    def test_copy_csv(self):
+        """Test bulk_insert_from_dicts() CSV: NULLs are unquoted & empty, unlike empty strings; missing keys too"""
+        rows = [{'a': 1, 'b': None, 'c': '', 'd': True, 'e': 'x,"y\nz', 'f': [1, 2], 'g': 1.5}, {'a': 2}]
+        text = _copy_csv(rows, list('abcdefg'))
+        self.assertEqual(text.split('\n')[0], '1,,"","true","x,""y')
+        self.assertTrue(text.endswith('2,,,,,,\n'))
+        self.assertEqual(next(csv.reader(io.StringIO(text))), ['1', '', '', 'true', 'x,"y\nz', '{1,2}', '1.5'])
+
+class TestUpdateFromDicts(unittest.TestCase):
+
+    def test_update_from_dicts_statement(self):
+        """Test update_from_dicts() binds 1 typed array per field, w/ None as NULL, from the column type catalog"""
+        schema = '_test_catalog'
+        utils._COLUMN_TYPES[schema] = {'code_sets': {
+            'codeset_id': ('integer', 'int4'), 'limitations': ('text', 'text'), 'counts': ('ARRAY', '_int4')}}
+        try:
+            rows = [{'codeset_id': 1, 'limitations': None, 'counts': [1, 2]}, {'codeset_id': 2, 'limitations': 'x'}]
+            statement, params = update_from_dicts_statement('code_sets', rows, schema)
+            self.assertEqual(get_field_data_types('code_sets', schema)['counts'], 'ARRAY')
+            self.assertIn('FROM unnest(', statement)
+            self.assertNotIn('"codeset_id" =', statement.split('WHERE')[0])
+            fields = re.findall(r'"(\w+)"', statement.split(') AS v(')[1].split(')')[0])
+            self.assertEqual({x: params[f'v{i}'] for i, x in enumerate(fields)}, {
+                'codeset_id': '{1,2}', 'limitations': '{NULL,"x"}', 'counts': '{"{1,2}",NULL}'})
+            self.assertIn('CAST(:v{} AS text[])'.format(fields.index('counts')), statement)
+            self.assertIn('"counts" = CAST(v."counts" AS _int4)', statement)
+            with self.assertRaises(ValueError):
+                update_from_dicts_statement('code_sets', [{'codeset_id': 1, 'not_a_field': 1}], schema)
+        finally:
+            invalidate_column_types(schema)
+        self.assertNotIn(schema, utils._COLUMN_TYPES)
+
+
+class TestStatusVarStore(unittest.TestCase):
+    keys = ['unit_testing_status_var_1', 'unit_testing_status_var_2']
+
+    def tearDown(self):
+        """tearDown"""
+        with get_db_connection(schema='') as con:
+            run_sql(con, 'DELETE FROM public.manage WHERE key = ANY(:keys);', {'keys': self.keys})
+
+    def test_status_var_store(self):
+        """Test StatusVarStore: upserts, batches, and cached reads, checked against a 2nd store's fresh reads"""
+        store, other = StatusVarStore(cache_seconds=60), StatusVarStore(cache_seconds=0)
+        store.set_many({self.keys[0]: 'a', self.keys[1]: 'b'})
+        store.set(self.keys[0], 'c')  # upsert: not a duplicate key
+        self.assertEqual([other.get(k) for k in self.keys], ['c', 'b'])
+        with store.batch():
+            store.set(self.keys[1], 'd')
+            self.assertEqual(store.get(self.keys[1]), 'd')
+            self.assertEqual(other.get(self.keys[1]), 'b')  # not written until the end of the batch
+        self.assertEqual(other.get(self.keys[1]), 'd')
+        other.set(self.keys[0], 'e')
+        self.assertEqual(store.get(self.keys[0]), 'c')  # cached
+        self.assertEqual(store.get(self.keys[0], refresh=True), 'e')
+        store.delete(self.keys[0])
+        self.assertIsNone(other.get(self.keys[0]))
+        with get_db_connection(schema='') as con:
+            n = sql_query(con, 'SELECT COUNT(*) FROM public.manage WHERE key = ANY(:keys);', {'keys': self.keys})
+        self.assertEqual(n[0]['count'], 1)
+        self.assertIsNone(other.cached())  # expired: callers, e.g. check_db_status_var_async(), query & load()
+        self.assertEqual(other.load([[self.keys[1], 'f']]), {self.keys[1]: 'f'})
+
+
+class TestSqlQueryStream(unittest.TestCase):
+
+    def test_sql_query_stream(self):
+        """Test sql_query_stream() yields the same rows as sql_query(), in batches of up to fetch_size"""
+        query = 'SELECT concept_id, concept_name FROM concept ORDER BY concept_id LIMIT 25;'
+        with get_db_connection(schema='n3c') as con:
+            expected = [dict(x) for x in sql_query(con, query)]
+        sample_rate, QUERY_STATS.sample_rate = QUERY_STATS.sample_rate, 1
+        try:
+            QUERY_STATS.clear()
+            batches = list(sql_query_stream(query, fetch_size=10, batches=True, schema='n3c'))
+            observed = QUERY_STATS.snapshot()['queries']
+        finally:
+            QUERY_STATS.sample_rate = sample_rate
+        self.assertEqual([len(x) for x in batches], [10, 10, 5])
+        self.assertEqual([row for batch in batches for row in batch], expected)
+        streamed = [(x['sampled_calls'], x['mean_rows']) for x in observed if 'ORDER BY concept_id' in x['query']]
+        self.assertEqual(streamed, [(1, 25)])
+        self.assertEqual(list(sql_query_stream(query, fetch_size=10, schema='n3c')), expected)
+
+
+
+class TestDerivedTablesDag(unittest.TestCase):
+
+    def test_topological_generations(self):
+        """Test each generation only depends on earlier ones, and that cycles are caught"""
+        dag = {'a': set(), 'b': {'a', 'not_refreshed'}, 'c': set(), 'd': {'b', 'c'}}
+        self.assertEqual(topological_generations(dag), [['a', 'c'], ['b'], ['d']])
+        with self.assertRaises(ValueError):
+            topological_generations({'a': {'c'}, 'b': {'a'}, 'c': {'b'}, 'd': set()})
+
+    def test_derived_tables_dag(self):
+        """Test the graph has all, and only, tables downstream of the independent ones, w/ their dependencies in it"""
+        dag = derived_tables_dag(['a'], {'b': ['a', 'x'], 'c': ['b', 'y'], 'y': ['x'], 'z': ['c']})
+        self.assertEqual(dag, {'b': set(), 'c': {'b'}, 'z': {'c'}})
+        queue = get_dependent_tables_queue(CORE_CSET_TABLES)
+        for i, table in enumerate(queue):
+            self.assertFalse(derived_tables_dag(CORE_CSET_TABLES)[table] - set(queue[:i]))
+
+    def test_refresh_failure(self):
+        """Test a failed module stops the refresh: modules already running finish, but nothing more is started"""
+        dag = {'cset_members_items': set(), 'codeset_counts': set(), 'all_csets': {'cset_members_items'},
+               'members_items_summary': {'codeset_counts'}}
+        started, failed, refreshed = threading.Event(), threading.Event(), []
+
+        def refresh(_con, module: str, *_args):
+            """Fail cset_members_items once codeset_counts is running, which then finishes"""
+            if module == 'cset_members_items':
+                started.wait(5)
+                failed.set()
+                raise RuntimeError(module)
+            started.set()
+            failed.wait(5)
+            refreshed.append(module)
+
+        class Engine:
+            """Engine whose connections are never used"""
+            def connect(self):
+                """A stand-in connection"""
+                return contextlib.nullcontext()
+
+        original, utils._refresh_derived_module = utils._refresh_derived_module, refresh
+        try:
+            with self.assertRaisesRegex(RuntimeError, 'cset_members_items'):
+                utils._refresh_derived_modules_concurrently(Engine(), dag, workers=2)
+        finally:
+            utils._refresh_derived_module = original
+        self.assertEqual(refreshed, ['codeset_counts'])
+
 # Uncomment this and run this file and run directly to run all tests
 # if __name__ == '__main__':
 #     unittest.main()
@@ -0,0 +1,64 @@
+"""Tests for backend.graph.condense
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import unittest
+from pathlib import Path
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.condense import condense_super_nodes, expand_super_node
+from test.test_backend.graph.utils import csr_graph
+
+# 1 has 6 children: 10-13 are plain leaves, 14 has a child of its own, 15 also has non-super parent 2
+EDGES = [(1, c) for c in range(10, 16)] + [(14, 20), (2, 15), (0, 1), (0, 2)]
+
+
+class TestCondense(unittest.TestCase):
+    """Tests for condense.py"""
+
+    def test_condense_super_nodes(self):
+        """Test which children get hidden, and the super node summaries"""
+        sg = csr_graph(EDGES).subgraph({c for e in EDGES for c in e})
+        condensed = condense_super_nodes(sg, threshold=3, keep=[11])
+        self.assertEqual(condensed.hidden, {10, 12, 13})
+        self.assertEqual(condensed.super_nodes, {1: {'n_children': 6, 'n_hidden': 3}})
+        self.assertEqual(set(condensed.nodes), set(sg.nodes) - {10, 12, 13})
+        self.assertEqual(condensed.edges, [e for e in sg.edges if e[1] not in {10, 12, 13}])
+        # Under the threshold: nothing to condense
+        condensed = condense_super_nodes(sg, threshold=6)
+        self.assertEqual((condensed.hidden, condensed.super_nodes, condensed.edges), (set(), {}, sg.edges))
+
+    def test_expand_super_node(self):
+        """Test expand_super_node() gives back all of a super node's children"""
+        sg = csr_graph(EDGES).subgraph({c for e in EDGES for c in e})
+        src, tgt, truncated = expand_super_node(sg, 1)
+        self.assertEqual(set(src.tolist()), {1})
+        self.assertEqual(sorted(tgt.tolist()), list(range(10, 16)))
+        self.assertFalse(truncated)
+        self.assertEqual(len(expand_super_node(sg, 999)[0]), 0)
+
+    def test_expand_super_node_budget(self):
+        """Test expanding a super node in a subgraph built w/ a descendant budget, as concept_graph() does"""
+        graph = csr_graph(EDGES)
+        for max_depth, max_nodes, expected_children, expected_truncated in (
+            (2, None, set(range(10, 16)), False),
+            (1, None, set(), True),  # 1's children are 2 levels below 0
+            (2, 5, {10, 11, 12}, True),  # 1, 2, then the first 3 of level 2
+        ):
+            descendant_ids, truncated_ids = graph.descendants_within([0], max_depth, max_nodes)
+            sg = graph.subgraph({0} | set(descendant_ids.tolist()))
+            sg.meta['truncated'] = truncated_ids.tolist()
+            condensed = condense_super_nodes(sg, threshold=2)
+            _, tgt, truncated = expand_super_node(sg, 1)
+            self.assertEqual(set(tgt.tolist()), expected_children)
+            self.assertEqual(truncated, expected_truncated)
+            self.assertTrue(set(tgt.tolist()) >= condensed.hidden)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Tests for backend.graph.csr
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import random
+import sys
+import unittest
+from pathlib import Path
+
+from networkx import DiGraph, multi_source_dijkstra_path_length
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.csr import CsrGraph
+from test.test_backend.graph.utils import EDGES, csr_graph, random_edges
+
+
+class TestCsrGraph(unittest.TestCase):
+    """Tests for CsrGraph: results should be identical, including order, to networkx"""
+
+    def test_matches_networkx(self):
+        """Test nodes, edges, successors & predecessors against DiGraph"""
+        for edges in [EDGES] + [random_edges(seed) for seed in range(3)]:
+            g = DiGraph(edges)
+            for csr in (csr_graph(edges), CsrGraph.from_networkx(g)):
+                self.assertEqual(csr.node_ids.tolist(), list(g.nodes))
+                self.assertEqual(csr.edges, list(g.edges))
+                self.assertEqual(csr.number_of_edges(), g.number_of_edges())
+                for node in g.nodes:
+                    self.assertEqual(csr.successors(node), list(g.successors(node)))
+                    self.assertEqual(csr.predecessors(node), list(g.predecessors(node)))
+
+    def test_subgraph(self):
+        """Test subgraph() edges and nodes, including order, for small and large node sets"""
+        for seed in range(3):
+            edges = random_edges(seed)
+            g = DiGraph(edges)
+            csr = csr_graph(edges)
+            rnd = random.Random(seed)
+            candidates = list(g.nodes) + [-1, 99999999]  # some not in graph
+            for k in (1, 10, len(candidates) // 3, len(candidates) // 2 + 1, len(candidates)):
+                nodes = set(rnd.sample(candidates, k))
+                sg_nx, sg = g.subgraph(nodes), csr.subgraph(nodes)
+                self.assertEqual(sg.edges, list(sg_nx.edges))
+                self.assertEqual(sg.nodes, list(sg_nx.nodes))
+                self.assertEqual(len(sg), len(sg_nx))
+
+    def test_successors_of(self):
+        """Test successors_of(): same set, built in the same order, as repeated set.update(g.successors(n))"""
+        edges = random_edges(7)
+        g = DiGraph(edges)
+        csr = csr_graph(edges)
+        nodes = set(list(g.nodes)[:50] + [-5])
+        expected = set()
+        for node in nodes:
+            if g.has_node(node):
+                expected.update(g.successors(node))
+        actual = set(csr.successors_of(nodes).tolist())
+        self.assertEqual(list(actual), list(expected))
+
+    def test_descendants_within(self):
+        """Test descendants_within() against BFS distances from networkx, with and without limits"""
+        csr = csr_graph(EDGES)
+        self.assertEqual([a.tolist() for a in csr.descendants_within([1], max_depth=2)], [[2, 3, 6, 4, 7, 5], [7]])
+        self.assertEqual([a.tolist() for a in csr.descendants_within([1], max_nodes=4)], [[2, 3, 6, 4], [2, 6]])
+        self.assertEqual([a.tolist() for a in csr.descendants_within([1], max_depth=0)], [[], [1]])
+        edges = random_edges(3)
+        g = DiGraph(edges)
+        csr = csr_graph(edges)
+        sources = list(g.nodes)[:5]
+        distance = multi_source_dijkstra_path_length(g, sources)
+        for max_depth in (1, 2, 3, None):
+            found, truncated = csr.descendants_within(sources, max_depth=max_depth)
+            expected = {n for n, d in distance.items() if 0 < d <= (max_depth or len(g))}
+            self.assertEqual(len(found), len(expected))
+            self.assertEqual(set(found.tolist()), expected)
+            self.assertEqual(set(truncated.tolist()), {
+                n for n, d in distance.items() if d == max_depth and any(c not in distance or distance[c] > d
+                                                                          for c in g.successors(n))})
+        found, truncated = csr.descendants_within(sources, max_nodes=30)
+        self.assertEqual(len(found), 30)
+        self.assertTrue(len(truncated))
+
+    def test_lookups(self):
+        """Test has_node() and rows_of() on missing ids"""
+        csr = csr_graph(EDGES)
+        self.assertTrue(csr.has_node(5))
+        self.assertFalse(csr.has_node(9))
+        self.assertEqual(csr.rows_of([9, 1]).tolist(), [-1, 0])
+        with self.assertRaises(KeyError):
+            csr.successors(9)
+
+    def test_descendants_by_group(self):
+        """Test descendants_by_group() gives each group the same descendants as expanding it on its own"""
+        g = csr_graph(random_edges(0))
+        nodes = g.node_ids.tolist()
+        groups = [set(nodes[:20]), set(nodes[10:40]), set(), {nodes[5], -1}]
+        batch = g.descendants_by_group(groups)
+        self.assertEqual(batch, [(set(g.successors_of(group).tolist()), None) for group in groups])
+        # Same order, too, as each group on its own, since both are cached under the same key
+        self.assertEqual(
+            [list(ids) for ids, _ in batch], [list(g.descendants_by_group([group])[0][0]) for group in groups])
+        for max_depth, max_nodes in ((2, None), (None, 15)):
+            expected = [g.descendants_within(group, max_depth, max_nodes) for group in groups]
+            self.assertEqual(
+                g.descendants_by_group(groups, max_depth, max_nodes),
+                [(set(ids.tolist()), truncated.tolist()) for ids, truncated in expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
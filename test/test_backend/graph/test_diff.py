@@ -0,0 +1,65 @@
+"""Tests for backend.graph.diff
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.diff import diff_graphs, diff_snapshots, filter_diff, read_diff, write_diff
+from backend.graph.snapshot import write_snapshot
+from test.test_backend.graph.utils import csr_graph, random_edges
+
+
+def pairs(diff, change: str):
+    """Edges of one kind of change, as (source, target) tuples"""
+    return list(zip(diff[f'{change}_source'].tolist(), diff[f'{change}_target'].tolist()))
+
+
+class TestDiff(unittest.TestCase):
+    """Tests for diff.py"""
+
+    def setUp(self):
+        edges = random_edges(0)
+        self.old_edges, self.new_edges = edges[:900], edges[100:] + [(-5, 7), (1, 2 ** 31 - 1)]
+        self.old, self.new = csr_graph(self.old_edges), csr_graph(self.new_edges)
+        self.old.meta, self.new.meta = {'vocab_version': 'v1'}, {'vocab_version': 'v2'}
+
+    def test_diff_graphs(self):
+        """Test added & removed edges match Python set differences, and survive saving"""
+        diff = diff_graphs(self.old, self.new)
+        self.assertEqual(pairs(diff, 'added'), sorted(set(self.new_edges) - set(self.old_edges)))
+        self.assertEqual(pairs(diff, 'removed'), sorted(set(self.old_edges) - set(self.new_edges)))
+        self.assertEqual((diff['from_version'], diff['to_version']), ('v1', 'v2'))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'relationship_graph.diff.npz')
+            write_diff(diff, path)
+            loaded = read_diff(path)
+            for change in ('added', 'removed'):
+                self.assertEqual(pairs(loaded, change), pairs(diff, change))
+            self.assertEqual((loaded['from_version'], loaded['to_version']), ('v1', 'v2'))
+
+            old_path, new_path = os.path.join(tmp_dir, 'old.csr'), os.path.join(tmp_dir, 'new.csr')
+            write_snapshot(self.old, old_path, 'v1')
+            write_snapshot(self.new, new_path, 'v2')
+            self.assertEqual(pairs(diff_snapshots(old_path, new_path), 'added'), pairs(diff, 'added'))
+
+    def test_filter_diff(self):
+        """Test filtering to edges touching some concepts"""
+        diff = diff_graphs(self.old, self.new)
+        concept_ids = {-5, 1, 3}
+        filtered = filter_diff(diff, concept_ids)
+        for change in ('added', 'removed'):
+            self.assertEqual(
+                pairs(filtered, change), [e for e in pairs(diff, change) if e[0] in concept_ids or e[1] in concept_ids])
+        self.assertIs(filter_diff(diff), diff)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Tests for backend.graph.export
+
+How to run:
+    python -m unittest discover
+"""
+import json
+import os
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.export import ARROW_METADATA_KEY, encode_arrow_edges, encode_columnar_json, encode_edges
+from test.test_backend.graph.utils import csr_graph, random_edges
+
+
+def decode(fmt: str, data: bytes):
+    """Edges back from encoded bytes"""
+    if fmt == 'json':
+        return [tuple(e) for e in json.loads(data)]
+    if fmt == 'ndjson':
+        return [tuple(json.loads(line)) for line in data.decode().splitlines()]
+    if fmt == 'int32':
+        return [tuple(e) for e in np.frombuffer(data, dtype='<i4').reshape(-1, 2).tolist()]
+    table = pa.ipc.open_stream(data).read_all()
+    return list(zip(table['source'].to_pylist(), table['target'].to_pylist()))
+
+
+class TestExport(unittest.TestCase):
+    """Tests for export.py"""
+
+    def test_encode_edges(self):
+        """Test every format round-trips any range of edges, across chunk boundaries"""
+        graph = csr_graph(random_edges(0))
+        edges = graph.edges
+        for fmt in ('json', 'ndjson', 'int32', 'arrow'):
+            for start, stop in ((0, None), (5, 700), (10, 10), (len(edges) - 3, len(edges) + 10)):
+                data = b''.join(encode_edges(graph, fmt, start, stop, chunk_size=64))
+                self.assertEqual(decode(fmt, data), edges[start:stop], f'{fmt} {start}:{stop}')
+        with self.assertRaises(ValueError):
+            list(encode_edges(graph, 'xml'))
+
+    def test_concept_graph_formats(self):
+        """Test encode_columnar_json() and encode_arrow_edges() carry the same content as the default JSON response"""
+        graph = csr_graph(random_edges(1))
+        sg = graph.subgraph(graph.node_ids[:150])
+        src, tgt = sg.edge_arrays()
+        rest = {'concept_ids': set(sg.nodes), 'hidden_by_vocab': {'RxNorm Extension': {3, 1, 2}}, 'super_nodes': {
+            7: {'n_children': 20, 'n_hidden': 15}}}
+        columnar = json.loads(encode_columnar_json({'edges': {'source': src, 'target': tgt}, **rest}))
+        self.assertEqual(list(zip(columnar['edges']['source'], columnar['edges']['target'])), sg.edges)
+        self.assertEqual(columnar['concept_ids'], sorted(sg.nodes))
+        self.assertEqual(columnar['hidden_by_vocab'], {'RxNorm Extension': [1, 2, 3]})
+        self.assertEqual(columnar['super_nodes'], {'7': {'n_children': 20, 'n_hidden': 15}})
+
+        table = pa.ipc.open_stream(encode_arrow_edges(src, tgt, rest)).read_all()
+        self.assertEqual(list(zip(table['source'].to_pylist(), table['target'].to_pylist())), sg.edges)
+        metadata = json.loads(table.schema.metadata[ARROW_METADATA_KEY])
+        self.assertEqual(metadata['concept_ids'], sorted(sg.nodes))
+
+
+if __name__ == '__main__':
+    unittest.main()
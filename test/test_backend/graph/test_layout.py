@@ -0,0 +1,69 @@
+"""Tests for backend.graph.layout
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.csr import CsrGraph
+from backend.graph.layout import assign_layers, layered_layout, layout_key, order_layers, split_long_edges
+from test.test_backend.graph.utils import csr_graph, random_dag_edges
+
+
+def count_crossings(layer: np.ndarray, pos: np.ndarray, src: np.ndarray, tgt: np.ndarray) -> int:
+    """Crossings between segments joining adjacent layers, brute force"""
+    n = 0
+    for i in np.unique(layer[src]):
+        a, b = pos[src][layer[src] == i], pos[tgt][layer[src] == i]
+        n += int(((a[:, None] < a[None, :]) & (b[:, None] > b[None, :])).sum())
+    return n
+
+
+class TestLayout(unittest.TestCase):
+    """Tests for layout.py"""
+
+    def test_layered_layout(self):
+        """Test parents are laid out above children, and nodes in a layer are at least 1 apart"""
+        graph = csr_graph(random_dag_edges(0))
+        sg = graph.subgraph(graph.node_ids[:300])
+        layout = layered_layout(sg)
+        self.assertEqual(layout['concept_ids'].tolist(), sg.nodes)
+        y = dict(zip(layout['concept_ids'].tolist(), layout['y'].tolist()))
+        for source, target in sg.edges:
+            self.assertLess(y[source], y[target])
+        for layer in np.unique(layout['y']):
+            self.assertTrue((np.diff(np.sort(layout['x'][layout['y'] == layer])) >= 0.99).all())
+        # Same nodes & edges in another order: same key
+        self.assertEqual(layout_key(sg), layout_key(graph.subgraph(graph.node_ids[:300][::-1])))
+        self.assertNotEqual(layout_key(sg), layout_key(graph.subgraph(graph.node_ids[:299])))
+
+    def test_order_layers(self):
+        """Test long edges are split into adjacent-layer segments, and that ordering sweeps reduce crossings"""
+        graph = csr_graph(random_dag_edges(1))
+        src = np.repeat(np.arange(len(graph)), np.diff(graph.succ_indptr))
+        layer, src, tgt = assign_layers(len(graph), src, graph.succ_indices.astype(np.int64))
+        all_layers, seg_src, seg_tgt = split_long_edges(layer, src, tgt)
+        self.assertTrue((all_layers[seg_tgt] - all_layers[seg_src] == 1).all())
+        self.assertEqual(len(seg_src), int((layer[tgt] - layer[src]).sum()))
+        self.assertLess(
+            count_crossings(all_layers, order_layers(all_layers, seg_src, seg_tgt), seg_src, seg_tgt),
+            count_crossings(all_layers, order_layers(all_layers, seg_src, seg_tgt, sweeps=0), seg_src, seg_tgt) / 2)
+
+    def test_cycle(self):
+        """Test a cycle still gets a layout, with every node on a layer"""
+        graph = CsrGraph.from_edges([1, 2, 3, 3, 4], [2, 3, 1, 4, 4])
+        layout = layered_layout(graph.subgraph([1, 2, 3, 4]))
+        self.assertEqual(sorted(layout['y'].tolist()), [0, 1, 2, 3])
+        self.assertEqual(len(layered_layout(graph.subgraph([]))['x']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests for backend.graph.lca
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import random
+import sys
+import unittest
+from pathlib import Path
+
+from networkx import DiGraph, ancestors, has_path
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.lca import connect_roots, lowest_common_ancestors
+from backend.graph.reachability import reachability_index
+from test.test_backend.graph.utils import EDGES, csr_graph, random_dag_edges
+
+
+def brute_force_lcas(g: DiGraph, nodes):
+    """Lowest common ancestors, straight from the definition"""
+    common = set.intersection(*[ancestors(g, n) | {n} for n in nodes])
+    return sorted(c for c in common if not any(c in ancestors(g, d) for d in common if d != c))
+
+
+class TestLca(unittest.TestCase):
+    """Tests for lca.py"""
+
+    def test_lowest_common_ancestors(self):
+        """Test lowest_common_ancestors() against a brute force version"""
+        index = reachability_index(csr_graph(EDGES))
+        self.assertEqual(lowest_common_ancestors(index, [4, 7]).tolist(), [2])
+        self.assertEqual(lowest_common_ancestors(index, [5, 8]).tolist(), [2])
+        self.assertEqual(lowest_common_ancestors(index, [3, 7]).tolist(), [1])
+        self.assertEqual(lowest_common_ancestors(index, [2, 4]).tolist(), [2])
+        self.assertEqual(lowest_common_ancestors(index, []).tolist(), [])
+        for seed in range(4):
+            edges = random_dag_edges(seed, n_nodes=200, n_edges=500)
+            g = DiGraph(edges)
+            index = reachability_index(csr_graph(edges))
+            rnd = random.Random(seed)
+            for k in (1, 2, 3, 10):
+                for _ in range(10):
+                    nodes = rnd.sample(list(g.nodes), k)
+                    self.assertEqual(lowest_common_ancestors(index, nodes).tolist(), brute_force_lcas(g, nodes))
+
+    def test_connect_roots(self):
+        """Test connect_roots(): every node is reachable from an LCA using only graph edges returned"""
+        for seed in range(4):
+            edges = random_dag_edges(seed, n_nodes=200, n_edges=500)
+            g = DiGraph(edges)
+            index = reachability_index(csr_graph(edges))
+            rnd = random.Random(seed)
+            for k in (2, 5, 20):
+                nodes = rnd.sample(list(g.nodes), k)
+                lcas, src, tgt = connect_roots(index, nodes + [-1])
+                connecting = DiGraph(list(zip(src.tolist(), tgt.tolist())))
+                self.assertTrue(all(g.has_edge(*e) for e in connecting.edges))
+                self.assertEqual(len(set(tgt.tolist())), len(tgt))  # a forest: one way in to each node
+                if not len(lcas):
+                    continue
+                for n in nodes:
+                    self.assertTrue(n in lcas or any(
+                        n in connecting and lca in connecting and has_path(connecting, lca, n) for lca in lcas))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests for backend.graph.reachability
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from networkx import DiGraph, ancestors, descendants
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.csr import CsrGraph
+from backend.graph.reachability import AUX_PREFIX, reachability_index
+from backend.graph.snapshot import load_snapshot, write_snapshot
+from test.test_backend.graph.utils import EDGES, csr_graph, random_dag_edges
+
+
+class TestReachabilityIndex(unittest.TestCase):
+    """Tests for ReachabilityIndex: answers should match networkx"""
+
+    def test_matches_networkx(self):
+        """Test are_ancestors(), descendants() and ancestors() against networkx"""
+        for edges in [EDGES] + [random_dag_edges(seed) for seed in range(4)]:
+            g = DiGraph(edges)
+            index = reachability_index(csr_graph(edges))
+            self.assertTrue(index.acyclic)
+            rnd = random.Random(0)
+            nodes = list(g.nodes)
+            pairs = [(rnd.choice(nodes), rnd.choice(nodes)) for _ in range(2000)] + [(-1, nodes[0]), (nodes[0], -1)]
+            expected = [b in g and a in g and b in descendants(g, a) for a, b in pairs]
+            self.assertEqual(index.are_ancestors(*zip(*pairs)).tolist(), expected)
+            for k in (1, 3, 20):
+                some = rnd.sample(nodes, min(k, len(nodes)))
+                self.assertEqual(
+                    index.descendants(some).tolist(), sorted(set().union(*[descendants(g, n) for n in some])))
+                self.assertEqual(
+                    index.ancestors(some).tolist(), sorted(set().union(*[ancestors(g, n) for n in some])))
+
+    def test_cycle(self):
+        """Test that a graph with a cycle falls back to search and still gives correct answers"""
+        index = reachability_index(CsrGraph.from_edges([1, 2, 3, 3], [2, 3, 1, 4]))
+        self.assertFalse(index.acyclic)
+        self.assertTrue(index.is_ancestor(1, 4))
+        self.assertFalse(index.is_ancestor(1, 1))  # strict, even on a cycle
+        self.assertFalse(index.is_ancestor(4, 1))
+        self.assertEqual(index.descendants([4]).tolist(), [])
+        self.assertEqual(index.ancestors([4]).tolist(), [1, 2, 3])
+
+    def test_snapshot(self):
+        """Test that the index is saved with, and memory-mapped from, a snapshot"""
+        graph = csr_graph(random_dag_edges(0))
+        index = reachability_index(graph)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'relationship_graph.csr')
+            write_snapshot(graph, path, 'v1')
+            loaded = load_snapshot(path)
+            self.assertTrue(any(name.startswith(AUX_PREFIX) for name in loaded.aux))
+            loaded_index = reachability_index(loaded)
+            self.assertIsInstance(loaded_index.pre.base, np.memmap)
+            some = graph.node_ids[:10]
+            self.assertEqual(loaded_index.descendants(some).tolist(), index.descendants(some).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Tests for backend.graph.relationships
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.relationships import RelationshipStore, relationship_store
+from backend.graph.snapshot import load_snapshot, write_snapshot
+from test.test_backend.graph.utils import EDGES, csr_graph
+
+RELATIONSHIP_IDS = ['Maps to', 'Mapped from', 'Concept replaced by']
+# (concept_id_1, concept_id_2, index into RELATIONSHIP_IDS)
+TYPED_EDGES = [
+    (1, 2, 0), (2, 1, 1), (1, 1, 0), (3, 4, 2), (1, 2, 2), (5, 1, 0), (1, 2, 0),  # last one is a duplicate
+]
+
+
+class TestRelationships(unittest.TestCase):
+    """Tests for relationships.py"""
+
+    def test_edges(self):
+        """Test lookups by direction, relationship and self-edges, against a brute-force filter"""
+        store = RelationshipStore.from_edges(*[np.array(col) for col in zip(*TYPED_EDGES)], RELATIONSHIP_IDS)
+        self.assertEqual(store.relationship_ids, sorted(RELATIONSHIP_IDS))
+        self.assertEqual(len(store), 6)
+        src, tgt, rels = store.edges([1, 999])
+        self.assertEqual(
+            list(zip(src.tolist(), tgt.tolist(), rels)),
+            [(1, 1, 'Maps to'), (1, 2, 'Concept replaced by'), (1, 2, 'Maps to')])
+        src, tgt, rels = store.edges([1], ['Maps to', 'Not stored'], exclude_self=True)
+        self.assertEqual(list(zip(src.tolist(), tgt.tolist(), rels)), [(1, 2, 'Maps to')])
+        src, tgt, rels = store.edges([1], ['Maps to', 'Mapped from'], direction='in')
+        self.assertEqual(
+            list(zip(src.tolist(), tgt.tolist(), rels)), [(1, 1, 'Maps to'), (2, 1, 'Mapped from'), (5, 1, 'Maps to')])
+        both = store.edge_indices([1, 4], direction='both')
+        expected = [i for i in range(len(store)) if store.src[i] in (1, 4) or store.tgt[i] in (1, 4)]
+        self.assertEqual(both.tolist(), expected)
+        with self.assertRaises(ValueError):
+            store.edges([1], direction='sideways')
+
+    def test_snapshot(self):
+        """Test the store survives a snapshot round trip with its graph"""
+        graph = csr_graph(EDGES)
+        self.assertIsNone(relationship_store(graph))
+        store = RelationshipStore.from_edges(*[np.array(col) for col in zip(*TYPED_EDGES)], RELATIONSHIP_IDS)
+        graph.aux.update(store.aux_arrays())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'relationship_graph.csr')
+            write_snapshot(graph, path)
+            loaded = relationship_store(load_snapshot(path))
+            self.assertEqual(loaded.relationship_ids, store.relationship_ids)
+            for direction in ('out', 'in', 'both'):
+                self.assertEqual(
+                    [a.tolist() if isinstance(a, np.ndarray) else a for a in loaded.edges([1, 2], direction=direction)],
+                    [a.tolist() if isinstance(a, np.ndarray) else a for a in store.edges([1, 2], direction=direction)])
+
+
+if __name__ == '__main__':
+    unittest.main()
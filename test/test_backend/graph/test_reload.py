@@ -0,0 +1,63 @@
+"""Tests for backend.graph.reload
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.csr import CsrGraph
+from backend.graph.reload import GraphReloader
+
+
+class TestGraphReloader(unittest.TestCase):
+    """Tests for GraphReloader"""
+
+    def setUp(self):
+        self.db_version = 'v1'
+        self.served = CsrGraph.from_edges([1], [2])
+        self.served.meta = {'vocab_version': 'v1'}
+        self.swapped = threading.Event()
+
+        def load() -> CsrGraph:
+            g = CsrGraph.from_edges([1, 2], [2, 3])
+            g.meta = {'vocab_version': self.db_version}
+            return g
+
+        def swap(g: CsrGraph):
+            self.served = g
+            self.swapped.set()
+
+        self.reloader = GraphReloader(
+            lambda: self.db_version, lambda: self.served.meta['vocab_version'], load, swap, interval_seconds=0.01)
+
+    def test_check(self):
+        """Test check(): only reloads when the vocab version changes; old graph stays usable"""
+        self.assertFalse(self.reloader.check())
+        old = self.served
+        self.db_version = 'v2'
+        self.assertTrue(self.reloader.check())
+        self.assertEqual(self.served.edges, [(1, 2), (2, 3)])
+        self.assertEqual(old.edges, [(1, 2)])  # e.g. an in-flight request holding the old graph
+        self.assertFalse(self.reloader.check())
+        self.assertEqual(self.reloader.n_reloads, 1)
+
+    def test_background_thread(self):
+        """Test start()/stop(): background polling picks up a new version"""
+        self.reloader.start()
+        try:
+            self.db_version = 'v2'
+            self.assertTrue(self.swapped.wait(5))
+            self.assertEqual(self.served.meta['vocab_version'], 'v2')
+        finally:
+            self.reloader.stop(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
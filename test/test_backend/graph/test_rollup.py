@@ -0,0 +1,74 @@
+"""Tests for backend.graph.rollup
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from networkx import DiGraph, descendants
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.csr import CsrGraph
+from backend.graph.rollup import AUX_PREFIX, COUNTS_VERSION_KEY, add_rollups, subtree_rollups
+from backend.graph.snapshot import load_snapshot, write_snapshot
+from test.test_backend.graph.utils import csr_graph, random_dag_edges
+
+
+class TestRollup(unittest.TestCase):
+    """Tests for rollup.py"""
+
+    def test_rollups(self):
+        """Test rollups match sums over networkx descendants, including in a DAG, where the tree sums aren't exact"""
+        edges = random_dag_edges(0, n_nodes=300, n_edges=400)
+        graph = csr_graph(edges)
+        nx_graph = DiGraph(edges)
+        rng = np.random.default_rng(0)
+        concept_ids = graph.node_ids[::2]
+        total_cnts = rng.integers(0, 1000, len(concept_ids))
+        cnt = dict(zip(concept_ids.tolist(), total_cnts.tolist()))
+        add_rollups(graph, np.append(concept_ids, -1), np.append(total_cnts, 5), 'counts v1')
+
+        exact = graph.aux[AUX_PREFIX + 'exact']
+        self.assertTrue(exact.any() and not exact.all())
+        # Inexact ones first, so their lookup isn't only served from an earlier one
+        ids = np.concatenate([graph.node_ids[~exact], graph.node_ids[exact]])
+        found = subtree_rollups(graph).lookup(ids)
+        for cid, total, n_desc in zip(*[found[k].tolist() for k in ('concept_ids', 'total_cnt', 'descendant_cnt')]):
+            desc = descendants(nx_graph, cid)
+            self.assertEqual((total, n_desc), (cnt.get(cid, 0) + sum(cnt.get(d, 0) for d in desc), len(desc)), cid)
+        self.assertEqual(subtree_rollups(graph).lookup(ids)['total_cnt'].tolist(), found['total_cnt'].tolist())
+        cid = int(found['concept_ids'][0])
+        self.assertEqual(subtree_rollups(graph).by_concept([cid, -2]), {cid: {
+            'subtree_total_cnt': found['total_cnt'][0], 'descendant_cnt': found['descendant_cnt'][0]}})
+
+    def test_cyclic(self):
+        """Test rollups of a graph w/ a cycle, which has no spanning tree"""
+        graph = CsrGraph.from_edges([1, 2, 3, 3], [2, 3, 1, 4])
+        add_rollups(graph, [1, 2, 3, 4], [1, 10, 100, 1000], 'counts v1')
+        self.assertEqual(subtree_rollups(graph).by_concept([1, 4]), {
+            1: {'subtree_total_cnt': 1111, 'descendant_cnt': 3}, 4: {'subtree_total_cnt': 1000, 'descendant_cnt': 0}})
+
+    def test_snapshot(self):
+        """Test rollups and their counts version survive a snapshot round trip"""
+        graph = CsrGraph.from_edges([1, 1, 2], [2, 3, 4])
+        self.assertIsNone(subtree_rollups(graph))
+        add_rollups(graph, [1, 2, 3, 4], [1, 10, 100, 1000], 'counts v1')
+        self.assertEqual(subtree_rollups(graph).by_concept([1])[1], {
+            'subtree_total_cnt': 1111, 'descendant_cnt': 3})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'relationship_graph.csr')
+            write_snapshot(graph, path, extra={COUNTS_VERSION_KEY: graph.meta[COUNTS_VERSION_KEY]})
+            loaded = subtree_rollups(load_snapshot(path))
+            self.assertEqual(loaded.counts_version, 'counts v1')
+            self.assertEqual(loaded.by_concept([1, 2, 4]), subtree_rollups(graph).by_concept([1, 2, 4]))
+
+
+if __name__ == '__main__':
+    unittest.main()
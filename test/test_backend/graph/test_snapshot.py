@@ -0,0 +1,64 @@
+"""Tests for backend.graph.snapshot
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.snapshot import MAGIC, SnapshotFormatError, is_snapshot, load_snapshot, read_snapshot_header, \
+    write_snapshot
+from test.test_backend.graph.utils import EDGES, csr_graph, random_edges
+
+
+class TestSnapshot(unittest.TestCase):
+    """Tests for snapshot.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'relationship_graph.csr')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        """Test write_snapshot() -> load_snapshot() gives back the same, read-only, memory-mapped graph"""
+        for edges in (EDGES, random_edges(1)):
+            graph = csr_graph(edges)
+            write_snapshot(graph, self.path, vocab_version='2024-10-01T00:00:00+00:00')
+            loaded = load_snapshot(self.path)
+            self.assertEqual(loaded.edges, graph.edges)
+            self.assertEqual(loaded.subgraph([1, 2, 4]).edges, graph.subgraph([1, 2, 4]).edges)
+            self.assertIsInstance(loaded.succ_indices.base, np.memmap)
+            self.assertFalse(loaded.succ_indices.flags.writeable)
+            self.assertEqual(loaded.meta['vocab_version'], '2024-10-01T00:00:00+00:00')
+            self.assertEqual(loaded.meta['n_edges'], graph.number_of_edges())
+
+    def test_header(self):
+        """Test read_snapshot_header() and rejection of non-snapshot files"""
+        write_snapshot(csr_graph(EDGES), self.path, 'v1', built_at='2024-01-01')
+        self.assertTrue(is_snapshot(self.path))
+        header = read_snapshot_header(self.path)
+        self.assertEqual((header['vocab_version'], header['built_at']), ('v1', '2024-01-01'))
+        other = os.path.join(self.tmp_dir.name, 'relationship_graph.pickle')
+        with open(other, 'wb') as f:
+            f.write(b'not a snapshot')
+        self.assertFalse(is_snapshot(other))
+        with self.assertRaises(SnapshotFormatError):
+            load_snapshot(other)
+        with open(other, 'wb') as f:  # right magic, unsupported format version
+            f.write(MAGIC + (999).to_bytes(4, 'little') + (2).to_bytes(4, 'little') + b'{}')
+        with self.assertRaises(SnapshotFormatError):
+            read_snapshot_header(other)
+
+
+if __name__ == '__main__':
+    unittest.main()
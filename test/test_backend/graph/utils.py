@@ -0,0 +1,36 @@
+"""Shared fixtures for backend.graph tests"""
+import os
+import random
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.graph.csr import CsrGraph
+
+# Small hierarchy w/ a multi-parent node (5) and a node only ever seen as a target first (4)
+EDGES = [(1, 2), (1, 3), (2, 4), (3, 4), (4, 5), (6, 5), (1, 6), (2, 7), (7, 8), (1, 2)]
+
+
+def random_edges(seed: int, n_nodes=300, n_edges=900) -> List[Tuple[int, int]]:
+    """Random edge stream w/ scattered, non-contiguous concept_ids"""
+    rnd = random.Random(seed)
+    return [(rnd.randint(1, n_nodes) * 7919 % 100003, rnd.randint(1, n_nodes) * 7919 % 100003)
+            for _ in range(n_edges)]
+
+
+def random_dag_edges(seed: int, n_nodes=400, n_edges=1000) -> List[Tuple[int, int]]:
+    """Random DAG edge stream: edges always go from a lower to a higher node number, w/ plenty of multi-parent nodes"""
+    rnd = random.Random(seed)
+    edges = []
+    for _ in range(n_edges):
+        a, b = sorted(rnd.sample(range(n_nodes), 2))
+        edges.append((a * 7919 % 100003, b * 7919 % 100003))
+    return edges
+
+
+def csr_graph(edges: List[Tuple[int, int]]) -> CsrGraph:
+    """CsrGraph from (source, target) pairs"""
+    return CsrGraph.from_edges(*zip(*edges))
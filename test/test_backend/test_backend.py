@@ -1,5 +1,7 @@
 """Tests for backend web server and utilities"""
+import json
 import os
+from datetime import datetime
 from typing import Dict, Union
 
 import pandas as pd
@@ -16,7 +18,8 @@ TEST_DIR = THIS_TEST_DIR.parent
 PROJECT_ROOT = TEST_DIR.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 from backend.db.analysis import InvalidCompareSchemaError, counts_compare_schemas, counts_over_time
-from backend.routes.db import get_concepts, get_researchers, get_cset_members_items
+from backend.routes.db import get_concepts, get_researchers, get_cset_members_items, stream_cset_members_items
+from backend.utils import json_array_chunks
 
 
 TEST_DIR = os.path.dirname(__file__)
@@ -341,3 +344,22 @@ class TestBackend(unittest.TestCase):
             {'concept_id': 4091006, 'standard_concept': 'S', 'vocabulary_id': 'SNOMED'},
             {'concept_id': 4052321, 'standard_concept': 'S', 'vocabulary_id': 'SNOMED'}].sort(key=key)
         self.assertEquals(csmi, expected)
+
+    def test_stream_cset_members_items(self):
+        """Test stream_cset_members_items() yields the same rows as get_cset_members_items(), in batches"""
+        codeset_ids = [396155663, 643758668]
+        for kwargs in ({}, {'column': 'concept_id'}):
+            expected = get_cset_members_items(codeset_ids, **kwargs)
+            expected = expected if kwargs else [dict(x) for x in expected]
+            streamed = [x for batch in stream_cset_members_items(codeset_ids, **kwargs) for x in batch]
+            self.assertCountEqual(streamed, expected)
+
+    def test_json_array_chunks(self):
+        """Test json_array_chunks() makes 1 JSON array of all batches, skipping empty ones"""
+        batches = [[{'a': 1, 'ts': datetime(2024, 1, 2)}], [], [{'a': 2, 'ts': None}]]
+        text = ''.join(json_array_chunks(batches))
+        self.assertEqual(json.loads(text), [{'a': 1, 'ts': '2024-01-02T00:00:00'}, {'a': 2, 'ts': None}])
+        self.assertEqual(''.join(json_array_chunks([])), '[]')
+        # NaN & Infinity aren't JSON: strict parsers, e.g. browsers', must be able to read the result
+        text = ''.join(json_array_chunks([[{'x': float('nan'), 'y': [float('inf'), 1.5]}]]))
+        self.assertEqual(json.loads(text, parse_constant=lambda c: self.fail(c)), [{'x': None, 'y': [None, 1.5]}])
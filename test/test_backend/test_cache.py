@@ -0,0 +1,53 @@
+"""Tests for backend.cache
+
+How to run:
+    python -m unittest discover
+"""
+import os
+import sys
+import time
+import unittest
+from pathlib import Path
+
+THIS_DIR = Path(os.path.dirname(__file__))
+PROJECT_ROOT = THIS_DIR.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+from backend.cache import MISSING, LruTtlCache
+
+
+class TestLruTtlCache(unittest.TestCase):
+    """Tests for LruTtlCache"""
+
+    def test_lru_and_size_eviction(self):
+        """Test least-recently-used entries are evicted first once over max_bytes or max_entries"""
+        cache = LruTtlCache(max_bytes=10, ttl_seconds=60, sizeof=len)
+        cache.put('a', 'xxxx')
+        cache.put('b', 'xxxx')
+        self.assertEqual(cache.get('a'), 'xxxx')  # now b is least recently used
+        cache.put('c', 'xxxx')
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual((cache.get('a'), cache.get('c')), ('xxxx', 'xxxx'))
+        cache.put('too big', 'x' * 11)
+        self.assertIs(cache.get('too big'), MISSING)
+        self.assertEqual(cache.n_bytes, 8)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (3, 2, 1))
+
+        cache = LruTtlCache(max_bytes=100, ttl_seconds=60, max_entries=2)
+        for key in 'abc':
+            cache.put(key, key)
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get('a'), MISSING)
+
+    def test_ttl(self):
+        """Test entries expire"""
+        cache = LruTtlCache(max_bytes=100, ttl_seconds=0.01)
+        self.assertEqual(cache.get_or_compute('a', lambda: 1), 1)
+        self.assertEqual(cache.get_or_compute('a', lambda: 2), 1)
+        time.sleep(0.02)
+        self.assertEqual(cache.get_or_compute('a', lambda: 3), 3)
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()